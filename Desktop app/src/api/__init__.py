@@ -3,5 +3,8 @@ API package initialization.
 Contains OpenRouter API client implementations.
 """
 from .openrouter import OpenRouterClient
+from .async_openrouter import AsyncOpenRouterClient
+from .scheduler import RequestScheduler
+from .balance import BalanceRefresher
 
-__all__ = ['OpenRouterClient']
+__all__ = ['OpenRouterClient', 'AsyncOpenRouterClient', 'RequestScheduler', 'BalanceRefresher']
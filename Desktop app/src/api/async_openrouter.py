@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import aiohttp
+import asyncio
+import os
+import json
+import time
+from dotenv import load_dotenv
+from utils.logger import AppLogger
+from utils.tracing import tracer
+from .openrouter import (
+    RETRY_STATUS_CODES, DEFAULT_REQUEST_TIMEOUT, SERVICE_TIMEOUT,
+    compute_retry_delay, parse_retry_after
+)
+
+load_dotenv()
+
+
+def _error_message(error: Exception, limit: float) -> str:
+    # asyncio.TimeoutError приходит без текста.
+    if isinstance(error, asyncio.TimeoutError) and not str(error):
+        return f"No response within {limit:.1f}s"
+    return str(error)
+
+
+class AsyncOpenRouterClient:
+    """
+    Асинхронный клиент OpenRouter на неблокирующих сокетах (aiohttp).
+
+    Запросы выполняются прямо в event loop, не занимая потоки executor'а,
+    и могут быть отменены через asyncio.Task.cancel(): соединение при этом
+    закрывается сразу. Ответы имеют тот же формат, что и у OpenRouterClient
+    (choices/usage/error).
+    """
+
+    def __init__(self, api_key: str | None = None, base_url: str | None = None,
+                 pool_size: int = 10, max_retries: int = 3,
+                 backoff_factor: float = 0.5, backoff_max: float = 30.0):
+        self.logger = AppLogger("api")
+
+        self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
+        self.base_url = base_url or os.getenv("BASE_URL") or "https://openrouter.ai/api/v1"
+
+        if not self.api_key:
+            self.logger.error("OpenRouter API key not provided")
+            raise ValueError("OpenRouter API key not provided")
+
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.stats = {"requests": 0, "retries": 0, "cancelled": 0}
+        # Вызывается с Retry-After (секунды или None) на каждый ответ 429;
+        # его устанавливает RequestScheduler, чтобы притормозить очередь.
+        self.on_rate_limited = None
+
+        # Сессия привязана к event loop, поэтому создаётся лениво внутри него.
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+        return self._session
+
+    async def _request(self, method: str, path: str, timeout: aiohttp.ClientTimeout,
+                       **kwargs) -> aiohttp.ClientResponse:
+        """
+        Запрос с повторами на 429/5xx и ошибках соединения.
+        Вызывающий код обязан закрыть ответ (async with response).
+        """
+        session = self._get_session()
+        url = f"{self.base_url}{path}"
+
+        for attempt in range(self.max_retries + 1):
+            self.stats["requests"] += 1
+            is_last = attempt == self.max_retries
+
+            try:
+                with tracer.span("http.request", method=method, path=path, attempt=attempt):
+                    response = await session.request(method, url, timeout=timeout, **kwargs)
+            except aiohttp.ClientConnectionError as error:
+                # POST повторяется, только если соединение не было установлено
+                # (ClientConnectorError): таймаут чтения или разрыв означают, что
+                # запрос уже отправлен, и повтор может привести к двойной оплате.
+                if is_last or (method != "GET" and not isinstance(error, aiohttp.ClientConnectorError)):
+                    raise
+                delay = compute_retry_delay(attempt, self.backoff_factor, self.backoff_max)
+            else:
+                if response.status == 429 and self.on_rate_limited is not None:
+                    self.on_rate_limited(parse_retry_after(response.headers.get("Retry-After")))
+                if response.status not in RETRY_STATUS_CODES or is_last:
+                    return response
+                delay = compute_retry_delay(
+                    attempt, self.backoff_factor, self.backoff_max,
+                    response.headers.get("Retry-After"),
+                )
+                response.release()
+
+            self.stats["retries"] += 1
+            self.logger.warning(
+                f"Retrying {method} {path} in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})"
+            )
+            await asyncio.sleep(delay)
+
+    async def send_message(self, message: str, model: str, messages: list | None = None,
+                           timeout: float | None = None) -> dict:
+        """
+        timeout ограничивает весь вызов: все попытки, паузы между ними и чтение ответа.
+        """
+        self.logger.debug("Sending async message to model: %s", model)
+
+        data = {
+            "model": model,
+            "messages": messages or [{"role": "user", "content": message}]
+        }
+        limit = timeout or DEFAULT_REQUEST_TIMEOUT
+
+        response = None
+
+        async def post():
+            nonlocal response
+            response = await self._request(
+                "POST", "/chat/completions",
+                timeout=aiohttp.ClientTimeout(total=limit),
+                json=data,
+            )
+            async with response:
+                response.raise_for_status()
+                with tracer.span("http.read_json"):
+                    return await response.json()
+
+        try:
+            result = await asyncio.wait_for(post(), limit)
+            self.logger.info("Successfully received response from API")
+            return result
+
+        except asyncio.CancelledError:
+            self._abort(response)
+            raise
+        except Exception as e:
+            error = _error_message(e, limit)
+            self.logger.error(f"API request failed: {error}", exc_info=True)
+            return {"error": error}
+
+    async def stream_message(self, message: str, model: str, messages: list | None = None,
+                             timeout: float | None = None):
+        """
+        Асинхронный аналог OpenRouterClient.stream_message: отдаёт
+        {"delta": "..."} по мере прихода токенов и итоговый ответ последним.
+
+        timeout ограничивает ожидание первых данных потока вместе с повторами;
+        дальше паузы между событиями ограничены DEFAULT_REQUEST_TIMEOUT.
+        """
+        self.logger.debug("Streaming async message to model: %s", model)
+
+        data = {
+            "model": model,
+            "messages": messages or [{"role": "user", "content": message}],
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+        content_parts = []
+        usage = {}
+        response = None
+        # Спан нельзя держать открытым поперёк yield, поэтому время разбора
+        # SSE копится здесь и записывается одной фазой в конце потока.
+        parse_time = 0.0
+        chunks = 0
+
+        loop = asyncio.get_running_loop()
+        limit = timeout or DEFAULT_REQUEST_TIMEOUT
+        deadline = loop.time() + limit
+
+        try:
+            response = await asyncio.wait_for(self._request(
+                "POST", "/chat/completions",
+                timeout=aiohttp.ClientTimeout(
+                    total=None, sock_connect=SERVICE_TIMEOUT, sock_read=DEFAULT_REQUEST_TIMEOUT
+                ),
+                json=data,
+            ), limit)
+            async with response:
+                response.raise_for_status()
+
+                while True:
+                    if chunks:
+                        raw_line = await response.content.readline()
+                    else:
+                        # Служебные комментарии (": ...") не считаются первыми данными.
+                        raw_line = await asyncio.wait_for(
+                            response.content.readline(), max(0.0, deadline - loop.time())
+                        )
+                    if not raw_line:
+                        break
+                    line = raw_line.decode("utf-8").strip()
+                    if not line or line.startswith(":"):
+                        continue
+                    if not line.startswith("data:"):
+                        continue
+
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
+                        break
+
+                    parse_start = time.perf_counter()
+                    chunk = json.loads(payload)
+                    parse_time += time.perf_counter() - parse_start
+                    chunks += 1
+                    if "error" in chunk:
+                        error = chunk["error"]
+                        raise RuntimeError(error.get("message", error) if isinstance(error, dict) else error)
+
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+
+                    for choice in chunk.get("choices") or []:
+                        delta = (choice.get("delta") or {}).get("content")
+                        if delta:
+                            content_parts.append(delta)
+                            yield {"delta": delta}
+
+            self.logger.info("Successfully received streamed response from API")
+            tracer.record("sse.parse", parse_time, chunks=chunks)
+            yield {
+                "choices": [{"message": {"role": "assistant", "content": "".join(content_parts)}}],
+                "usage": usage,
+            }
+
+        except (asyncio.CancelledError, GeneratorExit):
+            self._abort(response)
+            raise
+        except Exception as e:
+            error = _error_message(e, limit)
+            self.logger.error(f"API streaming request failed: {error}", exc_info=True)
+            yield {"error": error}
+
+    async def get_credits(self) -> float:
+        """
+        Доступный остаток в USD (total_credits - total_usage).
+        Исключение, если запрос не удался.
+        """
+        response = await self._request(
+            "GET", "/credits",
+            timeout=aiohttp.ClientTimeout(total=SERVICE_TIMEOUT),
+        )
+        async with response:
+            response.raise_for_status()
+            data = ((await response.json()) or {}).get('data')
+        if not data:
+            raise ValueError("Empty /credits response")
+        return data.get('total_credits', 0) - data.get('total_usage', 0)
+
+    async def get_balance(self) -> str:
+        try:
+            return f"${await self.get_credits():.2f}"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error_msg = f"API request failed: {str(e)}"
+            self.logger.error(error_msg, exc_info=True)
+            return "Ошибка"
+
+    def _abort(self, response: aiohttp.ClientResponse | None):
+        """
+        Разрывает соединение отменённого запроса, не дочитывая тело ответа.
+        """
+        self.stats["cancelled"] += 1
+        if response is not None:
+            response.close()
+        self.logger.info("API request cancelled")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from utils.logger import AppLogger
+
+
+class BalanceRefresher:
+    """
+    Баланс OpenRouter с фоновым обновлением и локальной оценкой расходов.
+
+    Остаток запрашивается через fetch() (корутина, возвращающая USD) не чаще
+    раза в ttl секунд: одновременные вызовы refresh() ждут один и тот же
+    запрос. Между запросами остаток уменьшается на оценку стоимости каждого
+    ответа (record_spend), поэтому метка баланса меняется сразу, а /credits
+    никогда не блокирует интерфейс. on_update(refresher) вызывается при
+    каждом изменении.
+    """
+
+    def __init__(self, fetch, ttl: float = 300.0, on_update=None):
+        self.logger = AppLogger("api")
+        self.fetch = fetch
+        self.ttl = ttl
+        self.on_update = on_update
+
+        self.available = None
+        self.fetched_at = None
+        self.failed = False
+        # Оценка расходов, ещё не отражённых в последнем ответе /credits.
+        self.spent_since = 0.0
+
+        self._inflight = None
+        self._loop_task = None
+
+    @classmethod
+    def from_env(cls, fetch, on_update=None) -> 'BalanceRefresher':
+        """
+        BALANCE_TTL — период проверки баланса на сервере (в секундах).
+        """
+        return cls(fetch, ttl=float(os.getenv("BALANCE_TTL", "300")), on_update=on_update)
+
+    @property
+    def estimate(self) -> float | None:
+        """
+        Текущий остаток: последнее значение сервера минус локальные расходы.
+        """
+        if self.available is None:
+            return None
+        return self.available - self.spent_since
+
+    @property
+    def is_estimated(self) -> bool:
+        return self.spent_since > 0
+
+    def is_fresh(self) -> bool:
+        return self.fetched_at is not None and time.monotonic() - self.fetched_at < self.ttl
+
+    def seed(self, available: float):
+        """
+        Принимает уже известный остаток (например, полученный при проверке ключа).
+        """
+        self.available = available
+        self.fetched_at = time.monotonic()
+        self.failed = False
+        self.spent_since = 0.0
+        self._notify()
+
+    def record_spend(self, cost: float | None):
+        if not cost:
+            return
+        self.spent_since += cost
+        self._notify()
+
+    async def refresh(self, force: bool = False) -> float | None:
+        """
+        Обновляет остаток, если он устарел (или force). Одновременные вызовы
+        получают результат одного запроса.
+        """
+        if self._inflight is None or self._inflight.done():
+            if self.is_fresh() and not force:
+                return self.estimate
+            self._inflight = asyncio.ensure_future(self._fetch())
+        # shield: отмена одного из ожидающих не прерывает общий запрос.
+        return await asyncio.shield(self._inflight)
+
+    async def _fetch(self) -> float | None:
+        # Расходы, учтённые до запроса, сервер уже видит; более поздние — нет.
+        spent_before = self.spent_since
+        try:
+            available = await self.fetch()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed = True
+            self.logger.warning("Balance refresh failed: %s", e)
+            self._notify()
+            return self.estimate
+
+        self.available = available
+        self.fetched_at = time.monotonic()
+        self.failed = False
+        self.spent_since = max(0.0, self.spent_since - spent_before)
+        self.logger.debug("Balance refreshed: $%.4f", available)
+        self._notify()
+        return self.estimate
+
+    def start(self):
+        """
+        Запускает периодическую проверку в текущем event loop.
+        """
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            age = time.monotonic() - self.fetched_at if self.fetched_at is not None else 0.0
+            # После ошибки повтор через ttl, а не сразу.
+            await asyncio.sleep(max(1.0, self.ttl - age) if not self.failed else self.ttl)
+
+    def stop(self):
+        for task in (self._loop_task, self._inflight):
+            if task is not None and not task.done():
+                task.cancel()
+        self._loop_task = None
+        self._inflight = None
+
+    def _notify(self):
+        if self.on_update is not None:
+            try:
+                self.on_update(self)
+            except Exception as e:
+                self.logger.error(f"Balance update callback failed: {e}")
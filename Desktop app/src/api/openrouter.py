@@ -1,15 +1,102 @@
+from __future__ import annotations
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 import os
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 from utils.logger import AppLogger
+from utils.tracing import tracer
 
 load_dotenv()
 
+# Коды ответа, при которых запрос имеет смысл повторить.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Тайм-ауты по умолчанию (в секундах): запрос к модели и служебные запросы.
+# Для моделей с накопленной статистикой ChatApp передаёт адаптивный тайм-аут.
+DEFAULT_REQUEST_TIMEOUT = 60
+SERVICE_TIMEOUT = 30
+
+# Через сколько секунд сохранённый каталог моделей считается устаревшим.
+MODEL_CATALOG_TTL = 6 * 60 * 60
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Разбирает заголовок Retry-After (секунды или HTTP-дата) в секунды ожидания.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def parse_pricing(pricing: dict | None) -> dict | None:
+    """
+    Цены каталога OpenRouter (строки, USD за токен) в виде чисел:
+    {"prompt": ..., "completion": ...}. None, если цены не указаны.
+    """
+    if not pricing:
+        return None
+    try:
+        return {
+            "prompt": float(pricing.get("prompt") or 0),
+            "completion": float(pricing.get("completion") or 0)
+        }
+    except (TypeError, ValueError):
+        return None
+
+
+def compute_retry_delay(attempt: int, backoff_factor: float, backoff_max: float,
+                        retry_after: str | None = None) -> float:
+    """
+    Задержка перед повтором: Retry-After, если сервер его прислал,
+    иначе экспоненциальный backoff с полным джиттером.
+    """
+    server_delay = parse_retry_after(retry_after)
+    if server_delay is not None:
+        return min(server_delay, backoff_max)
+    return random.uniform(0, min(backoff_max, backoff_factor * (2 ** attempt)))
+
+
+def is_connect_failure(error: Exception) -> bool:
+    """
+    Ошибка возникла до отправки запроса (соединение не установлено),
+    поэтому повтор безопасен и для POST.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # requests оборачивает MaxRetryError, а в нём — исходную ошибку urllib3.
+    reason = getattr(error.args[0], "reason", error.args[0])
+    return isinstance(reason, NewConnectionError)
+
 
 class OpenRouterClient:
 
-    def __init__(self, api_key: str | None = None, base_url: str | None = None):
-        self.logger = AppLogger()
+    def __init__(self, api_key: str | None = None, base_url: str | None = None,
+                 pool_size: int = 10, max_retries: int = 3,
+                 backoff_factor: float = 0.5, backoff_max: float = 30.0,
+                 cache=None, catalog_ttl: float = MODEL_CATALOG_TTL,
+                 on_models_updated=None, load_models: bool = True, refresh_runner=None):
+        self.logger = AppLogger("api")
         
         self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
         self.base_url = base_url or os.getenv("BASE_URL") or "https://openrouter.ai/api/v1"
@@ -23,30 +110,165 @@ class OpenRouterClient:
             "Content-Type": "application/json"
         }
 
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.stats = {"requests": 0, "retries": 0}
+        self.session = self._create_session(pool_size)
+
+        # Каталог моделей хранится в ChatCache и обновляется в фоне.
+        self.cache = cache
+        self.catalog_ttl = catalog_ttl
+        self.on_models_updated = on_models_updated
+        # refresh_runner(refresh_models) запускает фоновую перепроверку
+        # (например, через планировщик); без него — отдельный поток.
+        self.refresh_runner = refresh_runner
+        self._refresh_lock = threading.Lock()
+
         self.logger.info("OpenRouterClient initialized successfully")
-        self.available_models = self.get_models()
+        # load_models=False откладывает загрузку каталога: вызывающий код
+        # сам вызовет load_models(), например параллельно с другими запросами.
+        self.available_models = []
+        if load_models:
+            self.load_models()
+
+    def _create_session(self, pool_size: int) -> requests.Session:
+        """
+        Сессия с пулом keep-alive соединений: TCP+TLS рукопожатие
+        выполняется один раз, дальше соединения переиспользуются.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=0,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.headers)
+        session.headers["Connection"] = "keep-alive"
+        return session
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Запрос через пул соединений с повторами на 429/5xx и сетевых ошибках.
+        """
+        url = f"{self.base_url}{path}"
+
+        for attempt in range(self.max_retries + 1):
+            self.stats["requests"] += 1
+            is_last = attempt == self.max_retries
+
+            try:
+                with tracer.span("http.request", method=method, path=path, attempt=attempt):
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as error:
+                # POST повторяется, только если соединение не было установлено:
+                # иначе запрос мог дойти до сервера, а повтор — привести
+                # к двойной оплате генерации.
+                if is_last or (method != "GET" and not is_connect_failure(error)):
+                    raise
+                delay = compute_retry_delay(attempt, self.backoff_factor, self.backoff_max)
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or is_last:
+                    return response
+                delay = compute_retry_delay(
+                    attempt, self.backoff_factor, self.backoff_max,
+                    response.headers.get("Retry-After"),
+                )
+                response.close()
+
+            self.stats["retries"] += 1
+            self.logger.warning(
+                f"Retrying {method} {path} in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})"
+            )
+            time.sleep(delay)
+
+    def get_connection_stats(self) -> dict:
+        """
+        Счётчики переиспользования соединений пула.
+        """
+        adapter = self.session.get_adapter(self.base_url)
+        pools = adapter.poolmanager.pools
+
+        connections_opened = 0
+        pooled_requests = 0
+        for key in pools.keys():
+            pool = pools[key]
+            if pool is None:
+                continue
+            connections_opened += pool.num_connections
+            pooled_requests += pool.num_requests
+
+        return {
+            "requests": self.stats["requests"],
+            "retries": self.stats["retries"],
+            "connections_opened": connections_opened,
+            "connections_reused": max(0, pooled_requests - connections_opened),
+        }
+
+    def close(self):
+        self.session.close()
+
+    def load_models(self):
+        """
+        Отдаёт сохранённый каталог сразу, а устаревший — обновляет в фоне.
+        Сеть блокирует вызов только если каталога ещё нет на диске.
+        """
+        catalog = self.cache.get_model_catalog() if self.cache else None
+        if not catalog:
+            self.available_models = self.get_models()
+            return self.available_models
+
+        age = time.time() - catalog["fetched_at"]
+        self.logger.info(f"Loaded {len(catalog['models'])} models from cache (age {age:.0f}s)")
+
+        self.available_models = catalog["models"]
+        if age > self.catalog_ttl:
+            self.refresh_models_in_background()
+        return self.available_models
+
+    def _fetch_models(self, etag: str | None = None, last_modified: str | None = None):
+        """
+        Запрос каталога. С etag/last_modified выполняется условный запрос;
+        возвращает None, если каталог не изменился (304).
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        response = self._request("GET", "/models", headers=headers, timeout=SERVICE_TIMEOUT)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        models_data = response.json()
+
+        self.logger.info(f"Retrieved {len(models_data['data'])} models")
+
+        models = [
+            {
+                "id": model["id"],
+                "name": model.get("name", model["id"]),
+                "context_length": model.get("context_length"),
+                "pricing": parse_pricing(model.get("pricing"))
+            }
+            for model in models_data["data"]
+        ]
+        if self.cache:
+            self.cache.save_model_catalog(
+                models,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+        return models
 
     def get_models(self):
         self.logger.debug("Fetching available models")
         
         try:
-            response = requests.get(
-                f"{self.base_url}/models",
-                headers=self.headers,
-                timeout=30,
-            )
-            response.raise_for_status()
-            models_data = response.json()
-            
-            self.logger.info(f"Retrieved {len(models_data['data'])} models")
-            
-            return [
-                {
-                    "id": model["id"],
-                    "name": model.get("name", model["id"])
-                }
-                for model in models_data["data"]
-            ]
+            return self._fetch_models()
         except Exception as e:
             models_default = [
                 {"id": "deepseek-coder", "name": "DeepSeek"},
@@ -56,47 +278,158 @@ class OpenRouterClient:
             self.logger.info(f"Retrieved {len(models_default)} models with error: {e}")
             return models_default
 
-    def send_message(self, message: str, model: str):
-        self.logger.debug(f"Sending message to model: {model}")
+    def refresh_models(self) -> bool:
+        """
+        Условная перепроверка каталога (ETag / Last-Modified).
+        Возвращает True, если пришёл новый каталог.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+
+        try:
+            catalog = self.cache.get_model_catalog() if self.cache else None
+            models = self._fetch_models(
+                etag=catalog["etag"] if catalog else None,
+                last_modified=catalog["last_modified"] if catalog else None,
+            )
+
+            if models is None:
+                self.logger.debug("Model catalog not modified")
+                if self.cache:
+                    self.cache.touch_model_catalog()
+                return False
+
+            changed = models != self.available_models
+            self.available_models = models
+            if changed and self.on_models_updated:
+                self.on_models_updated(models)
+            return changed
+
+        except Exception as e:
+            self.logger.error(f"Model catalog refresh failed: {e}")
+            return False
+        finally:
+            self._refresh_lock.release()
+
+    def refresh_models_in_background(self):
+        if self.refresh_runner is not None:
+            self.refresh_runner(self.refresh_models)
+            return
+        threading.Thread(
+            target=self.refresh_models,
+            name="model-catalog-refresh",
+            daemon=True,
+        ).start()
+
+    def send_message(self, message: str, model: str, messages: list | None = None,
+                     timeout: float | None = None):
+        self.logger.debug("Sending message to model: %s", model)
         
         data = {
             "model": model,
-            "messages": [{"role": "user", "content": message}]
+            "messages": messages or [{"role": "user", "content": message}]
         }
         
         try:
             self.logger.debug("Making API request")
 
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=data,
-                timeout=60,
+            response = self._request(
+                "POST", "/chat/completions", json=data, timeout=timeout or DEFAULT_REQUEST_TIMEOUT
             )
             response.raise_for_status()
             
             self.logger.info("Successfully received response from API")
-            return response.json()
+            with tracer.span("http.parse_json"):
+                return response.json()
 
         except Exception as e:
             error_msg = f"API request failed: {str(e)}"
             self.logger.error(error_msg, exc_info=True)
             return {"error": str(e)}
 
+    def stream_message(self, message: str, model: str, messages: list | None = None,
+                       timeout: float | None = None):
+        """
+        Потоковая отправка сообщения (SSE, `stream: true`).
+
+        Генератор отдаёт словари {"delta": "..."} по мере прихода токенов,
+        а последним элементом — ответ в том же формате, что и send_message:
+        {"choices": [...], "usage": {...}} либо {"error": "..."}.
+        messages — готовый контекст диалога (ContextWindow.build);
+        без него отправляется одно сообщение message. timeout — ожидание
+        очередной порции данных (по умолчанию DEFAULT_REQUEST_TIMEOUT).
+        """
+        self.logger.debug("Streaming message to model: %s", model)
+
+        data = {
+            "model": model,
+            "messages": messages or [{"role": "user", "content": message}],
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+        content_parts = []
+        usage = {}
+
+        try:
+            with self._request(
+                "POST", "/chat/completions", json=data,
+                timeout=timeout or DEFAULT_REQUEST_TIMEOUT, stream=True
+            ) as response:
+                response.raise_for_status()
+
+                for line in response.iter_lines(decode_unicode=True):
+                    # Пустые строки разделяют события, строки с ":" — комментарии
+                    # (OpenRouter шлёт ": OPENROUTER PROCESSING" как keep-alive).
+                    if not line or line.startswith(":"):
+                        continue
+                    if not line.startswith("data:"):
+                        continue
+
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
+                        break
+
+                    chunk = json.loads(payload)
+                    if "error" in chunk:
+                        error = chunk["error"]
+                        raise RuntimeError(error.get("message", error) if isinstance(error, dict) else error)
+
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+
+                    for choice in chunk.get("choices") or []:
+                        delta = (choice.get("delta") or {}).get("content")
+                        if delta:
+                            content_parts.append(delta)
+                            yield {"delta": delta}
+
+            self.logger.info("Successfully received streamed response from API")
+            yield {
+                "choices": [{"message": {"role": "assistant", "content": "".join(content_parts)}}],
+                "usage": usage,
+            }
+
+        except Exception as e:
+            error_msg = f"API streaming request failed: {str(e)}"
+            self.logger.error(error_msg, exc_info=True)
+            yield {"error": str(e)}
+
+    def get_credits(self) -> float:
+        """
+        Доступный остаток в USD (total_credits - total_usage).
+        Исключение, если запрос не удался.
+        """
+        response = self._request("GET", "/credits", timeout=SERVICE_TIMEOUT)
+        response.raise_for_status()
+        data = (response.json() or {}).get('data')
+        if not data:
+            raise ValueError("Empty /credits response")
+        return data.get('total_credits', 0) - data.get('total_usage', 0)
+
     def get_balance(self):
         try:
-            response = requests.get(
-                f"{self.base_url}/credits",
-                headers=self.headers,
-                timeout=30,
-            )
-            response.raise_for_status()
-            data = response.json()
-            if not data:
-                return "Ошибка"
-            data = data.get('data') or {}
-            available = (data.get('total_credits', 0) - data.get('total_usage', 0))
-            return f"${available:.2f}"
+            return f"${self.get_credits():.2f}"
         except Exception as e:
             error_msg = f"API request failed: {str(e)}"
             self.logger.error(error_msg, exc_info=True)
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import time
+from bisect import insort
+from contextlib import asynccontextmanager
+from utils.logger import AppLogger
+from utils.sketch import QuantileSketch
+
+# Полосы приоритета: меньшее значение обслуживается раньше.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+LANE_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+
+class TokenBucket:
+    """
+    Ограничитель темпа: rate запросов в секунду со всплеском до capacity.
+    rate <= 0 отключает ограничение.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        Через сколько секунд будет доступен токен (0 — доступен сейчас).
+        """
+        blocked = max(0.0, self.blocked_until - now)
+        if self.rate <= 0:
+            return blocked
+        self._refill(now)
+        if self.tokens >= 1:
+            return blocked
+        return max(blocked, (1 - self.tokens) / self.rate)
+
+    def take(self, now: float):
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= 1
+
+    def pause(self, seconds: float, now: float):
+        """
+        Запрещает выдачу токенов на seconds (после ответа 429).
+        """
+        self.tokens = min(self.tokens, 0.0)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class RequestScheduler:
+    """
+    Планировщик запросов к OpenRouter перед AsyncOpenRouterClient.
+
+    Заявки встают в очередь с приоритетом (интерактивные раньше фоновых) и
+    получают один из max_concurrency слотов, только когда это позволяют
+    общий и помодельный token bucket'ы. Заявка, чья модель упёрлась в лимит,
+    не задерживает заявки к другим моделям. На ответ 429 клиент сообщает
+    через on_rate_limited, и общий bucket ставится на паузу по Retry-After.
+
+    send_message/stream_message возвращают то же, что и методы клиента.
+    Служебные запросы (баланс, проверка ключа, каталог моделей через
+    синхронный OpenRouterClient) идут через submit/run_blocking и делят с
+    чатом те же лимиты.
+    """
+
+    def __init__(self, client, max_concurrency: int = 4,
+                 global_rate: float = 2.0, global_burst: float = 10,
+                 model_rate: float = 1.0, model_burst: float = 5,
+                 rate_limit_pause: float = 1.0):
+        self.logger = AppLogger("api")
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.model_rate = model_rate
+        self.model_burst = model_burst
+        self.rate_limit_pause = rate_limit_pause
+
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.model_buckets = {}
+
+        # Ожидающие заявки, отсортированные по (приоритет, порядок поступления).
+        self._pending = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._wakeup = None
+        self._dispatcher = None
+
+        self.wait_sketches = {lane: QuantileSketch() for lane in LANE_NAMES}
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'cancelled': 0,
+            'rate_limited': 0,
+            'max_queue_depth': 0
+        }
+
+        client.on_rate_limited = self._on_rate_limited
+
+    @classmethod
+    def from_env(cls, client) -> 'RequestScheduler':
+        """
+        SCHEDULER_CONCURRENCY — число одновременных запросов;
+        RATE_LIMIT_RPS/RATE_LIMIT_BURST — общий лимит,
+        MODEL_RATE_LIMIT_RPS/MODEL_RATE_LIMIT_BURST — лимит на модель.
+        """
+        return cls(
+            client,
+            max_concurrency=int(os.getenv("SCHEDULER_CONCURRENCY", "4")),
+            global_rate=float(os.getenv("RATE_LIMIT_RPS", "2")),
+            global_burst=float(os.getenv("RATE_LIMIT_BURST", "10")),
+            model_rate=float(os.getenv("MODEL_RATE_LIMIT_RPS", "1")),
+            model_burst=float(os.getenv("MODEL_RATE_LIMIT_BURST", "5")),
+        )
+
+    # ---------- Публичный интерфейс ----------
+
+    async def send_message(self, message: str, model: str, messages: list | None = None,
+                           priority: int = INTERACTIVE, timeout: float | None = None) -> dict:
+        async with self.slot(model, priority):
+            return await self.client.send_message(message, model, messages, timeout=timeout)
+
+    async def stream_message(self, message: str, model: str, messages: list | None = None,
+                             priority: int = INTERACTIVE, timeout: float | None = None):
+        async with self.slot(model, priority):
+            stream = self.client.stream_message(message, model, messages, timeout=timeout)
+            try:
+                async for event in stream:
+                    yield event
+            finally:
+                await stream.aclose()
+
+    async def submit(self, factory, model: str | None = None, priority: int = BACKGROUND):
+        """
+        Выполняет произвольный запрос factory() (корутину клиента) через очередь.
+        """
+        async with self.slot(model, priority):
+            return await factory()
+
+    async def run_blocking(self, func, model: str | None = None, priority: int = BACKGROUND):
+        """
+        Выполняет блокирующий вызов func() (синхронного клиента) в executor'е через очередь.
+        """
+        loop = asyncio.get_running_loop()
+        return await self.submit(lambda: loop.run_in_executor(None, func), model, priority)
+
+    @asynccontextmanager
+    async def slot(self, model: str | None, priority: int = INTERACTIVE):
+        """
+        Занимает слот на время запроса к model (None — только общий лимит).
+        """
+        await self._acquire(model, priority)
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self.stats['completed'] += 1
+            self._wake()
+
+    def get_stats(self) -> dict:
+        depth = {name: 0 for name in LANE_NAMES.values()}
+        for priority, _, _, _, _ in self._pending:
+            depth[LANE_NAMES[priority]] += 1
+        return {
+            **self.stats,
+            'active': self._active,
+            'queue_depth': depth,
+            'wait': {
+                LANE_NAMES[lane]: sketch.percentiles()
+                for lane, sketch in self.wait_sketches.items()
+            }
+        }
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    # ---------- Очередь ----------
+
+    def _model_bucket(self, model: str) -> TokenBucket:
+        bucket = self.model_buckets.get(model)
+        if bucket is None:
+            bucket = TokenBucket(self.model_rate, self.model_burst)
+            self.model_buckets[model] = bucket
+        return bucket
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _acquire(self, model: str | None, priority: int):
+        loop = asyncio.get_running_loop()
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+        future = loop.create_future()
+        # Порядковый номер уникален, поэтому сравнение кортежей до future не доходит.
+        insort(self._pending, (priority, next(self._sequence), model, future, time.monotonic()))
+        self.stats['submitted'] += 1
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self._pending))
+        self._wake()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но ожидающий отменён — возвращаем его.
+                self._active -= 1
+                self._wake()
+            self.stats['cancelled'] += 1
+            raise
+
+    async def _dispatch(self):
+        """
+        Выдаёт слоты ожидающим заявкам в порядке приоритета с учётом лимитов.
+        Завершается, когда очередь пуста; _acquire() запускает его снова.
+        """
+        while True:
+            self._wakeup.clear()
+            delay = self._grant_ready()
+            if delay == 0:
+                continue
+            if not self._pending:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant_ready(self) -> float | None:
+        """
+        Выдаёт один слот, если это возможно, и возвращает 0; иначе — сколько
+        ждать до ближайшего освобождения лимита (None — ждать события).
+        """
+        self._pending = [item for item in self._pending if not item[3].cancelled()]
+        if not self._pending or self._active >= self.max_concurrency:
+            return None
+
+        now = time.monotonic()
+        global_delay = self.global_bucket.delay(now)
+        if global_delay > 0:
+            return global_delay
+
+        nearest = None
+        for index, (priority, _, model, future, enqueued_at) in enumerate(self._pending):
+            bucket = self._model_bucket(model) if model is not None else None
+            model_delay = bucket.delay(now) if bucket is not None else 0.0
+            if model_delay > 0:
+                nearest = model_delay if nearest is None else min(nearest, model_delay)
+                continue
+
+            del self._pending[index]
+            self.global_bucket.take(now)
+            if bucket is not None:
+                bucket.take(now)
+            self._active += 1
+
+            wait = now - enqueued_at
+            self.wait_sketches[priority].add(wait)
+            if wait > 1:
+                self.logger.debug(
+                    "Request to %s waited %.2fs in %s lane", model, wait, LANE_NAMES[priority]
+                )
+            future.set_result(None)
+            return 0
+        return nearest
+
+    def _on_rate_limited(self, retry_after: float | None):
+        self.stats['rate_limited'] += 1
+        pause = retry_after if retry_after is not None else self.rate_limit_pause
+        self.global_bucket.pause(pause, time.monotonic())
+        self.logger.warning("Rate limited by API, pausing new requests for %.2fs", pause)
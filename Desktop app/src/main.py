@@ -1,27 +1,56 @@
+from __future__ import annotations
+
 import flet as ft
 from api.openrouter import OpenRouterClient
+from api.async_openrouter import AsyncOpenRouterClient
+from api.scheduler import INTERACTIVE, RequestScheduler
+from api.balance import BalanceRefresher
 from ui.styles import AppStyles
-from ui.components import MessageBubble, ModelSelector
+from ui.components import MessageBubble, ModelSelector, ConversationSidebar, ComparisonView
 from utils.cache import ChatCache
 from utils.logger import AppLogger
 from utils.analytics import Analytics
 from utils.monitor import PerformanceMonitor
+from utils.export import HistoryExporter, ExportCancelled
+from utils.tracing import tracer
+from utils.context import ContextWindow, estimate_tokens, message_tokens
+from utils.pricing import PriceBook, format_cost
 import asyncio
+import threading
 import time
-import json
 from datetime import datetime
 import os
 import random
 
 
 class ChatApp:
+    STREAM_UPDATE_INTERVAL = 0.05
+    HISTORY_PAGE_SIZE = 25
+    HISTORY_SCROLL_THRESHOLD = 50
+    CONVERSATIONS_PAGE_SIZE = 50
+    # Сколько моделей можно сравнить за раз и сколько показать в списке выбора.
+    COMPARE_MAX_MODELS = 4
+    COMPARE_LIST_LIMIT = 50
+
     def __init__(self):
         self.cache = ChatCache()
         self.logger = AppLogger()
         self.analytics = Analytics(self.cache)
         self.monitor = PerformanceMonitor()
 
+        # Индексирование старой истории для поиска идёт в фоне порциями.
+        self.cache.start_search_backfill()
+
+        for migration in self.cache.migration_report:
+            self.logger.info(
+                f"Миграция схемы v{migration['version']} ({migration['name']}): "
+                f"{migration['duration'] * 1000:.0f}ms"
+            )
+
         self.api_client: OpenRouterClient | None = None
+        self.async_client: AsyncOpenRouterClient | None = None
+        self.scheduler: RequestScheduler | None = None
+        self.balance: BalanceRefresher | None = None
 
         self.balance_text = ft.Text(
             "Баланс: н/д",
@@ -31,19 +60,109 @@ class ChatApp:
         self.exports_dir = "exports"
         os.makedirs(self.exports_dir, exist_ok=True)
 
+        # Потоковый вывод ответа (SSE); STREAM_RESPONSES=0 возвращает
+        # прежний режим с ожиданием полного ответа.
+        self.streaming_enabled = os.getenv("STREAM_RESPONSES", "1") != "0"
+
+        # Трассировка отправки сообщений: TRACING=1 включает сбор фаз в памяти,
+        # TRACING_PERSIST=1 дополнительно сохраняет трассы в SQLite.
+        if os.getenv("TRACING", "0") == "1":
+            tracer.configure(
+                enabled=True,
+                sink=self.cache.save_trace if os.getenv("TRACING_PERSIST", "0") == "1" else None
+            )
+
+        # Предыдущие реплики отправляются в пределах бюджета токенов модели;
+        # CONTEXT_HISTORY=0 возвращает отправку одного сообщения.
+        self.context = ContextWindow.from_env(self.cache)
+        self.prices = PriceBook()
+        self.context_enabled = os.getenv("CONTEXT_HISTORY", "1") != "0"
+
+        # Кэш одинаковых запросов (модель + сообщения) включается RESPONSE_CACHE=1.
+        if os.getenv("RESPONSE_CACHE", "0") == "1":
+            self.cache.enable_response_cache()
+
+        self.page: ft.Page | None = None
+        self._login_started: float | None = None
         self.model_dropdown = None
+        self.history_search = None
         self.message_input = None
+        self.stop_button = None
+        # Запросы к API, которые можно прервать кнопкой «Стоп».
+        self._inflight = set()
+        # Задачи, прерванные кнопкой «Стоп» (в отличие от отмены самого обработчика).
+        self._stopped = set()
         self.chat_history = None
+        # Состояние постраничной подгрузки истории (см. _load_older_history).
+        self._history_cursor = None
+        self._history_exhausted = False
+        self._history_loading = False
         self.main_column = None
+        # Текущий диалог (None — новый, создаётся при первом сообщении).
+        self.conversation_id = None
+        self._pending_conversation = None
+        self.sidebar = None
+        self._conversations_cursor = None
 
     # ------------------------- АУТЕНТИФИКАЦИЯ -------------------------
 
     def _generate_pin(self) -> str:
         return f"{random.randint(0, 9999):04d}"
 
+    def _set_api_client(self, client: OpenRouterClient):
+        self.api_client = client
+        self.async_client = AsyncOpenRouterClient(
+            api_key=client.api_key,
+            base_url=client.base_url,
+        )
+        # Все запросы к API идут через очередь с лимитами и приоритетами.
+        self.scheduler = RequestScheduler.from_env(self.async_client)
+        # Баланс проверяется фоновым запросом раз в BALANCE_TTL, между проверками — оценка.
+        self.balance = BalanceRefresher.from_env(
+            lambda: self.scheduler.submit(self.async_client.get_credits),
+            on_update=self._show_balance
+        )
+
+    def _create_api_client(self, api_key: str) -> OpenRouterClient:
+        # Каталог загружается в _run_startup_pipeline через планировщик.
+        return OpenRouterClient(
+            api_key=api_key,
+            cache=self.cache,
+            on_models_updated=self._on_models_updated,
+            load_models=False,
+            refresh_runner=self._schedule_catalog_refresh,
+        )
+
+    def _schedule_catalog_refresh(self, refresh):
+        """
+        Фоновая перепроверка каталога занимает слот планировщика, как и
+        остальные запросы. Вызывается из потока executor'а.
+        """
+        self.page.run_task(self.scheduler.run_blocking, refresh)
+
+    async def _close_api_client(self):
+        if self.scheduler:
+            await self.scheduler.close()
+        if self.async_client:
+            await self.async_client.close()
+        if self.balance:
+            self.balance.stop()
+
+    def _on_models_updated(self, models: list):
+        """
+        Вызывается из фонового потока, когда пришёл обновлённый каталог моделей.
+        """
+        self.context.update_models(models)
+        self.prices.update_models(models)
+        if not self.model_dropdown or not self.page:
+            return
+        self.model_dropdown.update_models(models)
+        self.page.update()
+        self.logger.info(f"Список моделей обновлён: {len(models)}")
+
     def _init_api_client(self, api_key: str):
-        self.api_client = OpenRouterClient(api_key=api_key)
-        self.update_balance()
+        # Каталог и баланс загружаются параллельно в _run_startup_pipeline.
+        self._set_api_client(self._create_api_client(api_key))
 
     def _show_auth_screen_first_time(self, page: ft.Page):
         page.controls.clear()
@@ -58,7 +177,7 @@ class ChatApp:
         )
         status_text = ft.Text("", size=14)
 
-        def on_submit_key(e):
+        async def on_submit_key(e):
             api_key = api_key_field.value.strip()
             if not api_key:
                 status_text.value = "Пожалуйста, введите ключ."
@@ -71,19 +190,26 @@ class ChatApp:
             page.update()
 
             try:
-                temp_client = OpenRouterClient(api_key=api_key)
-                balance_str = temp_client.get_balance()
-
-                if balance_str == "Ошибка":
+                # Проверочный запрос идёт через планировщик нового клиента.
+                self._set_api_client(self._create_api_client(api_key))
+                try:
+                    available = await self.scheduler.submit(
+                        self.async_client.get_credits, priority=INTERACTIVE
+                    )
+                except Exception as credits_error:
+                    await self._close_api_client()
+                    self.api_client = self.async_client = self.scheduler = self.balance = None
                     raise ValueError(
                         "Не удалось проверить ключ. Убедитесь, что ключ введён правильно."
-                    )
+                    ) from credits_error
 
                 pin = self._generate_pin()
-                self.cache.save_auth(api_key=api_key, pin=pin)
+                await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: self.cache.save_auth(api_key=api_key, pin=pin)
+                )
 
-                self.api_client = temp_client
-                self.update_balance()
+                # Остаток уже получен при проверке ключа — повторный запрос не нужен.
+                self.balance.seed(available)
 
                 def close_and_open_chat(ev):
                     page.dialog.open = False
@@ -191,6 +317,8 @@ class ChatApp:
                 page.update()
                 return
 
+            self._login_started = time.perf_counter()
+
             try:
                 self._init_api_client(api_key)
             except Exception as ex:
@@ -249,32 +377,429 @@ class ChatApp:
 
     # ------------------------- ОСНОВНОЙ UI ЧАТА -------------------------
 
-    def load_chat_history(self):
+    def _render_history(self, history):
+        """
+        Вставляет страницу истории (новые первыми) в начало ленты чата
+        и запоминает курсор для подгрузки следующей, более старой страницы.
+        """
+        bubbles = []
+        for msg in reversed(history):
+            _, model, user_message, ai_response, timestamp, tokens = msg[:6]
+            bubbles.extend([
+                MessageBubble(message=user_message, is_user=True),
+                MessageBubble(message=ai_response, is_user=False)
+            ])
+        self.chat_history.controls[0:0] = bubbles
+
+        if history:
+            self._history_cursor = ChatCache.history_cursor(history[-1])
+        if len(history) < self.HISTORY_PAGE_SIZE:
+            self._history_exhausted = True
+
+    def _reset_history_paging(self):
+        self._history_cursor = None
+        self._history_exhausted = False
+        self._history_loading = False
+
+    async def _load_older_history(self, page: ft.Page):
+        if self._history_loading or self._history_exhausted or self._history_cursor is None:
+            return
+
+        self._history_loading = True
         try:
-            history = self.cache.get_chat_history()
-            for msg in reversed(history):
-                _, model, user_message, ai_response, timestamp, tokens = msg
-                self.chat_history.controls.extend([
-                    MessageBubble(message=user_message, is_user=True),
-                    MessageBubble(message=ai_response, is_user=False)
-                ])
+            loop = asyncio.get_running_loop()
+            conversation_id = self.conversation_id
+            history = await loop.run_in_executor(
+                None,
+                lambda: self.cache.get_chat_history_page(
+                    limit=self.HISTORY_PAGE_SIZE,
+                    before=self._history_cursor,
+                    conversation_id=conversation_id,
+                )
+            )
+            if conversation_id != self.conversation_id:
+                # Пока страница читалась, пользователь открыл другой диалог.
+                return
+            if history:
+                # Иначе auto_scroll перебросит ленту в конец после вставки сверху.
+                self.chat_history.auto_scroll = False
+            self._render_history(history)
+            page.update()
         except Exception as e:
             self.logger.error(f"Ошибка загрузки истории чата: {e}")
+        finally:
+            self._history_loading = False
 
-    def update_balance(self):
-        if not self.api_client:
-            self.balance_text.value = "Баланс: н/д"
-            self.balance_text.color = ft.Colors.RED_400
+    async def _on_history_scroll(self, e: ft.OnScrollEvent):
+        if e.pixels is None or e.min_scroll_extent is None:
             return
+        if e.pixels <= e.min_scroll_extent + self.HISTORY_SCROLL_THRESHOLD:
+            await self._load_older_history(e.page)
+
+    # ------------------------- ДИАЛОГИ -------------------------
+
+    async def _load_conversations(self, append: bool = False):
+        """
+        Загружает страницу списка диалогов в боковую панель.
+        """
+        before = self._conversations_cursor if append else None
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(
+            None,
+            lambda: self.cache.list_conversations(limit=self.CONVERSATIONS_PAGE_SIZE, before=before)
+        )
+        if rows:
+            self._conversations_cursor = ChatCache.conversation_cursor(rows[-1])
+        self.sidebar.set_conversations(
+            rows, has_more=len(rows) == self.CONVERSATIONS_PAGE_SIZE, append=append
+        )
+        self.sidebar.select(self.conversation_id)
+        return rows
+
+    async def _load_more_conversations(self):
+        await self._load_conversations(append=True)
+        self.page.update()
+
+    async def _open_conversation(self, conversation_id: int | None):
+        """
+        Показывает диалог: читается только первая страница его сообщений.
+        """
+        self.conversation_id = conversation_id
+        self.sidebar.select(conversation_id)
+        self.chat_history.controls.clear()
+        self.chat_history.auto_scroll = True
+        self._reset_history_paging()
+
+        if conversation_id is None:
+            self._history_exhausted = True
+        else:
+            loop = asyncio.get_running_loop()
+            history = await loop.run_in_executor(
+                None,
+                lambda: self.cache.get_chat_history_page(
+                    limit=self.HISTORY_PAGE_SIZE, conversation_id=conversation_id
+                )
+            )
+            if conversation_id != self.conversation_id:
+                return
+            self._render_history(history)
+        self.page.update()
+
+    async def _new_conversation(self):
+        # Сам диалог создаётся при первом сообщении, чтобы не копить пустые.
+        await self._open_conversation(None)
+
+    async def _create_conversation(self, title: str) -> int:
+        """
+        Создаёт диалог при первом сообщении. Запись идёт вне event loop;
+        одновременные отправки ждут одно и то же создание.
+        """
+        if self._pending_conversation is None:
+            self._pending_conversation = asyncio.ensure_future(self._insert_conversation(title))
+        return await asyncio.shield(self._pending_conversation)
+
+    async def _insert_conversation(self, title: str) -> int:
+        try:
+            conversation_id = await asyncio.get_running_loop().run_in_executor(
+                None, self.cache.create_conversation, title
+            )
+        finally:
+            self._pending_conversation = None
+        now = datetime.now()
+        self.sidebar.touch((conversation_id, title, now, now, 0))
+        # Пока шла запись, пользователь мог открыть другой диалог.
+        if self.conversation_id is None:
+            self.conversation_id = conversation_id
+            self.sidebar.select(conversation_id)
+        return conversation_id
+
+    def _touch_conversation(self, conversation_id: int):
+        """
+        Поднимает диалог в начало списка после нового сообщения.
+        """
+        row = self.sidebar.rows.get(conversation_id)
+        if row is not None:
+            self.sidebar.touch((row[0], row[1], row[2], datetime.now(), row[4] + 1))
+
+    async def _run_startup_pipeline(self, page: ft.Page, history_placeholder: ft.Control):
+        """
+        Параллельно загружает каталог моделей, баланс и историю чата,
+        заполняя уже отрисованный интерфейс по мере готовности каждой части.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def timed(name, awaitable):
+            phase_start = time.perf_counter()
+            try:
+                return await awaitable
+            finally:
+                self.monitor.record_phase(name, time.perf_counter() - phase_start)
+
+        async def load_models():
+            if self.api_client.available_models:
+                models = self.api_client.available_models
+            else:
+                models = await timed("models", self.scheduler.run_blocking(
+                    self.api_client.load_models, priority=INTERACTIVE
+                ))
+            self.context.update_models(models)
+            self.prices.update_models(models)
+            self.model_dropdown.hint_text = "Выбор модели"
+            self.model_dropdown.update_models(models)
+            page.update()
 
+        async def load_balance():
+            await timed("balance", self.balance.refresh())
+            self.balance.start()
+
+        async def load_history():
+            try:
+                # Открывается последний обновлённый диалог — читаются только его строки.
+                conversations = await timed("conversations", self._load_conversations())
+                if conversations:
+                    self.conversation_id = conversations[0][0]
+                    self.sidebar.select(self.conversation_id)
+                    history = await timed(
+                        "history", loop.run_in_executor(
+                            None, lambda: self.cache.get_chat_history_page(
+                                limit=self.HISTORY_PAGE_SIZE, conversation_id=self.conversation_id
+                            )
+                        )
+                    )
+                    self._render_history(history)
+                else:
+                    self._history_exhausted = True
+            finally:
+                if history_placeholder in self.chat_history.controls:
+                    self.chat_history.controls.remove(history_placeholder)
+                page.update()
+
+        results = await asyncio.gather(
+            load_models(), load_balance(), load_history(),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self.logger.error(f"Ошибка при запуске: {result}")
+
+        if self._login_started is not None:
+            self.monitor.record_phase(
+                "login_to_interactive", time.perf_counter() - self._login_started
+            )
+            self._login_started = None
+
+        report = self.monitor.get_startup_report()
+        phases = ", ".join(f"{name}={value * 1000:.0f}ms" for name, value in report['phases'].items())
+        self.logger.info(f"Фазы запуска: {phases}")
+        if not report['within_budget'] and 'login_to_interactive' in report['phases']:
+            self.logger.warning(f"Запуск превысил бюджет {report['budget']:.1f}s")
+
+    async def _run_cancellable(self, coro):
+        """
+        Выполняет запрос к API отдельной задачей, которую прерывает кнопка «Стоп».
+        Возвращает (результат, stopped); при остановке результат — None.
+        Отмена закрывает соединение и сразу освобождает слот планировщика.
+        """
+        task = asyncio.ensure_future(coro)
+        self._inflight.add(task)
+        self._set_generating(True)
         try:
-            balance = self.api_client.get_balance()
-            self.balance_text.value = f"Баланс: {balance}"
-            self.balance_text.color = ft.Colors.GREEN_400
+            return await task, False
+        except asyncio.CancelledError:
+            # Отменили сам обработчик (например, при закрытии окна), а не кнопкой.
+            if task not in self._stopped or not task.cancelled():
+                raise
+            return None, True
+        finally:
+            self._inflight.discard(task)
+            self._stopped.discard(task)
+            if not self._inflight:
+                self._set_generating(False)
+
+    def _set_generating(self, generating: bool):
+        if self.stop_button is not None and self.stop_button.visible != generating:
+            self.stop_button.visible = generating
+            if self.page:
+                self.page.update()
+
+    async def _stop_generation(self, e):
+        """
+        Прерывает все выполняющиеся запросы к API.
+        """
+        if not self._inflight:
+            return
+        self.logger.info("Генерация остановлена пользователем (%d запросов)", len(self._inflight))
+        for task in list(self._inflight):
+            self._stopped.add(task)
+            task.cancel()
+
+    @staticmethod
+    def _partial_response(text: str, messages: list) -> dict:
+        """
+        Ответ в формате API для остановленной генерации: полученный текст и
+        локальная оценка usage (итоговый usage сервер уже не пришлёт).
+        """
+        prompt_tokens = sum(message_tokens(message["content"]) for message in messages)
+        completion_tokens = estimate_tokens(text)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": text}}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            },
+            "stopped": True
+        }
+
+    async def _stream_response(self, page: ft.Page, user_message: str, model: str,
+                               bubble: MessageBubble, start_time: float, messages: list | None = None,
+                               timeout: float | None = None):
+        """
+        Читает потоковый ответ и дописывает дельты в bubble.
+        Возвращает итоговый ответ (формат send_message) и время до первого токена.
+        timeout — адаптивный тайм-аут ожидания данных для модели.
+        """
+        time_to_first_token = None
+        last_update = 0.0
+        response = {"error": "Пустой ответ от API"}
+
+        async for event in self.scheduler.stream_message(user_message, model, messages, timeout=timeout):
+            if "delta" not in event:
+                # Итоговый ответ последний: поток завершается сам и сразу освобождает слот.
+                response = event
+                continue
+
+            if time_to_first_token is None:
+                time_to_first_token = time.time() - start_time
+
+            bubble.append_text(event["delta"])
+
+            # Не перерисовываем страницу на каждый токен — не чаще ~20 раз в секунду.
+            now = time.time()
+            if now - last_update >= self.STREAM_UPDATE_INTERVAL:
+                last_update = now
+                with tracer.span("ui.stream_update"):
+                    page.update()
+
+        return response, time_to_first_token
+
+    async def _compare_models(self, page: ft.Page, user_message: str, models: list):
+        """
+        Отправляет один промпт нескольким моделям одновременно и показывает
+        ответы колонками по мере прихода. Запросы идут параллельно, поэтому
+        общее время близко ко времени самой медленной модели, а не к сумме.
+        Ответы попадают в аналитику, но не в историю диалога.
+        """
+        names = {option.key: option.text for option in self.model_dropdown.all_options}
+        view = ComparisonView([(model, names.get(model, model)) for model in models])
+
+        self.chat_history.auto_scroll = True
+        self.chat_history.controls.append(MessageBubble(message=user_message, is_user=True))
+        self.chat_history.controls.append(view)
+        page.update()
+
+        with tracer.trace("compare_message", models=len(models)):
+            start_time = time.time()
+            results = await asyncio.gather(*(
+                self._compare_one(page, user_message, model, view.panels[model], start_time)
+                for model in models
+            ))
+            wall_time = time.time() - start_time
+
+        view.set_summary(
+            f"Общее время: {wall_time:.2f} с (последовательно было бы ~{sum(results):.2f} с)"
+        )
+        self.monitor.log_metrics(self.logger)
+        page.update()
+        self.logger.info(
+            "Сравнение %d моделей: %.2f с, сумма времени ответов %.2f с",
+            len(models), wall_time, sum(results)
+        )
+
+    async def _compare_one(self, page: ft.Page, user_message: str, model: str,
+                           panel, start_time: float) -> float:
+        """
+        Запрос к одной модели в режиме сравнения; возвращает время ответа.
+        """
+        time_to_first_token = None
+        stopped = False
+        try:
+            messages = [{"role": "user", "content": user_message}]
+            if self.context_enabled and self.conversation_id is not None:
+                with tracer.span("context.build", model=model):
+                    messages, _ = await asyncio.get_running_loop().run_in_executor(
+                        None, self.context.build, model, user_message, self.conversation_id
+                    )
+
+            if self.streaming_enabled:
+                with tracer.span("api.stream", model=model):
+                    result, stopped = await self._run_cancellable(self._stream_response(
+                        page, user_message, model, panel, start_time, messages,
+                        timeout=self.analytics.get_request_timeout(model, 'time_to_first_token')
+                    ))
+                if not stopped:
+                    response, time_to_first_token = result
+            else:
+                with tracer.span("api.request", model=model):
+                    response, stopped = await self._run_cancellable(self.scheduler.send_message(
+                        user_message, model, messages,
+                        timeout=self.analytics.get_request_timeout(model)
+                    ))
+            if stopped:
+                response = self._partial_response(panel.text.value or "", messages)
         except Exception as e:
+            self.logger.error(f"Ошибка сравнения для {model}: {e}")
+            response = {"error": str(e)}
+
+        response_time = time.time() - start_time
+        if "error" in response:
+            tokens_used = 0
+            cost = None
+            panel.set_text(f"Ошибка: {response['error']}")
+            panel.set_metrics(f"{response_time:.2f} с", error=True)
+        else:
+            usage = response.get("usage") or {}
+            tokens_used = usage.get("total_tokens", 0)
+            cost = self.prices.cost(model, usage)
+            panel.set_text(response["choices"][0]["message"]["content"])
+            panel.set_metrics(
+                f"{response_time:.2f} с · {tokens_used} ток. · {format_cost(cost)}"
+                + (" · остановлено" if stopped else "")
+            )
+
+        self.analytics.track_message(
+            model=model,
+            message_length=len(user_message),
+            response_time=response_time,
+            tokens_used=tokens_used,
+            time_to_first_token=time_to_first_token,
+            error="error" in response,
+            cost=cost,
+            sample_latency=not stopped and "error" not in response,
+            completion_tokens=(response.get("usage") or {}).get("completion_tokens")
+        )
+        self.balance.record_spend(cost)
+        page.update()
+        return response_time
+
+    def _show_balance(self, balance: BalanceRefresher):
+        """
+        Обновляет метку баланса. После ответов остаток уменьшается на оценку
+        их стоимости ("≈") до следующей проверки на сервере.
+        """
+        estimate = balance.estimate
+        if estimate is None:
             self.balance_text.value = "Баланс: н/д"
             self.balance_text.color = ft.Colors.RED_400
-            self.logger.error(f"Ошибка обновления баланса: {e}")
+        else:
+            if balance.is_estimated:
+                self.balance_text.value = f"Баланс: ≈${estimate:.4f}"
+            else:
+                self.balance_text.value = f"Баланс: ${estimate:.2f}"
+            # Сервер сейчас недоступен — последняя известная оценка показывается приглушённо.
+            self.balance_text.color = ft.Colors.GREY_400 if balance.failed else ft.Colors.GREEN_400
+        if self.page:
+            self.page.update()
 
     def _build_chat_ui(self, page: ft.Page):
         page.controls.clear()
@@ -282,6 +807,8 @@ class ChatApp:
         models = self.api_client.available_models if self.api_client else []
         self.model_dropdown = ModelSelector(models)
         self.model_dropdown.value = models[0]["id"] if models else None
+        if not models:
+            self.model_dropdown.hint_text = "Загрузка моделей..."
 
         def show_error_snack(page, message: str):
             snack = ft.SnackBar(
@@ -304,92 +831,330 @@ class ChatApp:
                 show_error_snack(page, "API клиент не инициализирован.")
                 return
 
-            try:
-                self.message_input.border_color = ft.Colors.BLUE_400
-                page.update()
+            with tracer.trace("send_message") as root_span:
+                try:
+                    self.message_input.border_color = ft.Colors.BLUE_400
+                    page.update()
 
-                start_time = time.time()
-                user_message = self.message_input.value
-                self.message_input.value = ""
-                page.update()
+                    start_time = time.time()
+                    user_message = self.message_input.value
+                    self.message_input.value = ""
+                    page.update()
 
-                self.chat_history.controls.append(
-                    MessageBubble(message=user_message, is_user=True)
+                    self.chat_history.auto_scroll = True
+                    self.chat_history.controls.append(
+                        MessageBubble(message=user_message, is_user=True)
+                    )
+
+                    model = self.model_dropdown.value
+                    root_span.set(model=model)
+
+                    if self.conversation_id is None:
+                        title = " ".join(user_message.split())[:40] or "Новый чат"
+                        conversation_id = await self._create_conversation(title)
+                    else:
+                        conversation_id = self.conversation_id
+                    time_to_first_token = None
+                    ai_bubble = None
+                    stopped = False
+
+                    messages = [{"role": "user", "content": user_message}]
+                    context_info = None
+                    if self.context_enabled:
+                        with tracer.span("context.build"):
+                            messages, context_info = await asyncio.get_running_loop().run_in_executor(
+                                None, self.context.build, model, user_message, conversation_id
+                            )
+
+                    # Повторный промпт к той же модели берётся из кэша ответов.
+                    cache_key = None
+                    cached_response = None
+                    if self.cache.response_cache_enabled:
+                        cache_key = ChatCache.make_response_key(model, messages)
+                        with tracer.span("cache.lookup"):
+                            cached_response = self.cache.get_cached_response(cache_key)
+
+                    if cached_response is not None:
+                        response = cached_response
+                        self.analytics.track_cache_hit(
+                            model, (response.get("usage") or {}).get("total_tokens", 0)
+                        )
+                    elif self.streaming_enabled:
+                        ai_bubble = MessageBubble(message="", is_user=False)
+                        self.chat_history.controls.append(ai_bubble)
+                        page.update()
+
+                        with tracer.span("api.stream"):
+                            result, stopped = await self._run_cancellable(self._stream_response(
+                                page, user_message, model, ai_bubble, start_time, messages,
+                                timeout=self.analytics.get_request_timeout(model, 'time_to_first_token')
+                            ))
+                        if stopped:
+                            # Уже полученная часть ответа сохраняется.
+                            response = self._partial_response(ai_bubble.text.value or "", messages)
+                        else:
+                            response, time_to_first_token = result
+                    else:
+                        loading = ft.ProgressRing()
+                        self.chat_history.controls.append(loading)
+                        page.update()
+
+                        with tracer.span("api.request"):
+                            response, stopped = await self._run_cancellable(self.scheduler.send_message(
+                                user_message, model, messages,
+                                timeout=self.analytics.get_request_timeout(model)
+                            ))
+                        if stopped:
+                            response = self._partial_response("", messages)
+
+                        self.chat_history.controls.remove(loading)
+
+                    if stopped:
+                        root_span.set(stopped=True)
+
+                    if "error" in response:
+                        response_text = f"Ошибка: {response['error']}"
+                        tokens_used = 0
+                        cost = None
+                        self.logger.error(f"Ошибка API: {response['error']}")
+                    else:
+                        response_text = response["choices"][0]["message"]["content"]
+                        tokens_used = (response.get("usage") or {}).get("total_tokens", 0)
+                        cost = self.prices.cost(model, response.get("usage"))
+
+                    if cached_response is not None:
+                        tokens_used = 0
+                    elif cache_key is not None:
+                        self.analytics.track_cache_miss(model)
+                        if not stopped:
+                            self.cache.save_cached_response(cache_key, model, response)
+
+                    # Остановленный до первого токена запрос в историю не попадает.
+                    if response_text or not stopped:
+                        self.cache.save_message(
+                            model=model,
+                            user_message=user_message,
+                            ai_response=response_text,
+                            tokens_used=tokens_used,
+                            conversation_id=conversation_id
+                        )
+                        self.context.record_turn(user_message, response_text, conversation_id)
+                        self._touch_conversation(conversation_id)
+
+                    if context_info is not None:
+                        self.logger.info(
+                            "Контекст: %d пар, ~%d токенов промпта (бюджет %d, вся история ~%d, API: %s)",
+                            context_info['turns'], context_info['prompt_tokens'], context_info['budget'],
+                            context_info['full_tokens'],
+                            (response.get("usage") or {}).get("prompt_tokens", "н/д")
+                        )
+
+                    display_text = response_text
+                    if stopped:
+                        display_text = f"{response_text}\n\n[Генерация остановлена]".lstrip()
+
+                    if ai_bubble is None:
+                        self.chat_history.controls.append(
+                            MessageBubble(message=display_text, is_user=False)
+                        )
+                    else:
+                        ai_bubble.set_text(display_text)
+
+                    if cached_response is None:
+                        response_time = time.time() - start_time
+                        with tracer.span("analytics.track_message"):
+                            self.analytics.track_message(
+                                model=model,
+                                message_length=len(user_message),
+                                response_time=response_time,
+                                tokens_used=tokens_used,
+                                time_to_first_token=time_to_first_token,
+                                error="error" in response,
+                                cost=cost,
+                                sample_latency=not stopped and "error" not in response,
+                                completion_tokens=(response.get("usage") or {}).get("completion_tokens")
+                            )
+                        self.balance.record_spend(cost)
+
+                    with tracer.span("monitor.log_metrics"):
+                        self.monitor.log_metrics(self.logger)
+                    self.logger.debug(
+                        "HTTP connection stats: sync=%s, async=%s",
+                        self.api_client.get_connection_stats(), self.async_client.stats
+                    )
+                    self.logger.debug("Request scheduler stats: %s", self.scheduler.get_stats())
+                    self.logger.debug("SQLite writer stats: %s", self.cache.get_write_stats())
+                    with tracer.span("ui.update"):
+                        page.update()
+
+                except Exception as e:
+                    self.logger.error(f"Ошибка отправки сообщения: {e}")
+                    self.message_input.border_color = ft.Colors.RED_500
+
+                    snack = ft.SnackBar(
+                        content=ft.Text(
+                            str(e),
+                            color=ft.Colors.RED_500,
+                            weight=ft.FontWeight.BOLD
+                        ),
+                        bgcolor=ft.Colors.GREY_900,
+                        duration=5000,
+                    )
+                    page.overlay.append(snack)
+                    snack.open = True
+                    page.update()
+
+            trace = root_span.trace
+            if trace is not None:
+                phases = ", ".join(
+                    f"{name}={duration * 1000:.1f}ms" for name, duration in trace.breakdown().items()
                 )
+                self.logger.debug("Трасса send_message %.1fms: %s", trace.duration * 1000, phases)
 
-                loading = ft.ProgressRing()
-                self.chat_history.controls.append(loading)
-                page.update()
+        async def search_history(e):
+            query = (self.history_search.value or "").strip()
+            if not query:
+                return
 
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: self.api_client.send_message(
-                        user_message,
-                        self.model_dropdown.value
+            results_view = ft.ListView(**AppStyles.SEARCH_RESULTS)
+            status = ft.Text("", size=12, color=ft.Colors.GREY_400)
+            more_button = ft.TextButton("Показать ещё", visible=False)
+            state = {"cursor": None}
+
+            async def load_page(ev=None):
+                try:
+                    loop = asyncio.get_running_loop()
+                    found = await loop.run_in_executor(
+                        None,
+                        lambda: self.cache.search(query, limit=20, cursor=state["cursor"])
+                    )
+                except Exception as ex:
+                    self.logger.error(f"Ошибка поиска: {ex}")
+                    status.value = f"Ошибка поиска: {ex}"
+                    page.update()
+                    return
+
+                for item in found["results"]:
+                    results_view.controls.append(
+                        ft.ListTile(
+                            title=ft.Text(item["user_snippet"], size=14),
+                            subtitle=ft.Text(
+                                f"{item['ai_snippet']}\n{item['model']} · {str(item['timestamp'])[:16]}",
+                                size=12,
+                                color=ft.Colors.GREY_400,
+                            ),
+                        )
                     )
-                )
 
-                self.chat_history.controls.remove(loading)
+                state["cursor"] = found["next_cursor"]
+                more_button.visible = found["next_cursor"] is not None
 
-                if "error" in response:
-                    response_text = f"Ошибка: {response['error']}"
-                    tokens_used = 0
-                    self.logger.error(f"Ошибка API: {response['error']}")
-                else:
-                    response_text = response["choices"][0]["message"]["content"]
-                    tokens_used = response.get("usage", {}).get("total_tokens", 0)
-
-                self.cache.save_message(
-                    model=self.model_dropdown.value,
-                    user_message=user_message,
-                    ai_response=response_text,
-                    tokens_used=tokens_used
+                progress = self.cache.get_search_backfill_progress()
+                status.value = f"Найдено: {len(results_view.controls)}" + (
+                    f" (индексация истории: {progress * 100:.0f}%)" if progress < 1.0 else ""
                 )
+                page.update()
 
-                self.chat_history.controls.append(
-                    MessageBubble(message=response_text, is_user=False)
-                )
+            more_button.on_click = load_page
 
-                response_time = time.time() - start_time
-                self.analytics.track_message(
-                    model=self.model_dropdown.value,
-                    message_length=len(user_message),
-                    response_time=response_time,
-                    tokens_used=tokens_used
-                )
+            dialog = ft.AlertDialog(
+                title=ft.Text(f"Поиск: {query}"),
+                content=ft.Column(
+                    [status, results_view, more_button],
+                    tight=True,
+                    width=500,
+                ),
+                actions=[
+                    ft.TextButton("Закрыть", on_click=lambda e: close_dialog(dialog)),
+                ],
+            )
 
-                self.monitor.log_metrics(self.logger)
-                page.update()
+            page.overlay.append(dialog)
+            dialog.open = True
+            page.update()
+            await load_page()
 
-            except Exception as e:
-                self.logger.error(f"Ошибка отправки сообщения: {e}")
-                self.message_input.border_color = ft.Colors.RED_500
-
-                snack = ft.SnackBar(
-                    content=ft.Text(
-                        str(e),
-                        color=ft.Colors.RED_500,
-                        weight=ft.FontWeight.BOLD
-                    ),
-                    bgcolor=ft.Colors.GREY_900,
-                    duration=5000,
-                )
-                page.overlay.append(snack)
-                snack.open = True
-                page.update()
+        def format_percentiles(values: dict | None, unit: str, precision: int = 2) -> str:
+            if not values:
+                return "н/д"
+            return "/".join(
+                f"{values[key]:.{precision}f}" for key in ('p50', 'p90', 'p99')
+            ) + f" {unit}"
 
         async def show_analytics(e):
             stats = self.analytics.get_statistics()
+            context_stats = self.context.get_stats()
+            scheduler_stats = self.scheduler.get_stats() if self.scheduler else {'rate_limited': 0, 'wait': {}}
+            queue_wait = scheduler_stats['wait'].get('interactive')
+            if queue_wait and not queue_wait['count']:
+                queue_wait = None
+
+            # Перцентили по моделям: p50/p90/p99 из скетчей, без пересчёта истории.
+            latency_rows = []
+            for model, metrics in sorted(self.analytics.get_latency_percentiles().items()):
+                latency_rows.extend([
+                    ft.Text(model, weight=ft.FontWeight.BOLD, size=13),
+                    ft.Text(
+                        f"Ответ p50/p90/p99: {format_percentiles(metrics.get('response_time'), 'с')}",
+                        size=12,
+                    ),
+                    ft.Text(
+                        f"Первый токен: {format_percentiles(metrics.get('time_to_first_token'), 'с')}",
+                        size=12,
+                    ),
+                    ft.Text(
+                        f"Токенов/с: {format_percentiles(metrics.get('tokens_per_second'), '', 1)}",
+                        size=12,
+                    ),
+                    ft.Text(
+                        f"Расходы: {format_cost(stats['model_usage'].get(model, {}).get('cost'))}",
+                        size=12,
+                    ),
+                ])
 
             dialog = ft.AlertDialog(
                 title=ft.Text("Аналитика"),
                 content=ft.Column([
                     ft.Text(f"Всего сообщений: {stats['total_messages']}"),
                     ft.Text(f"Всего токенов: {stats['total_tokens']}"),
+                    ft.Text(f"Оценка расходов: {format_cost(stats['total_cost'])}"),
                     ft.Text(f"Среднее токенов/сообщение: {stats['tokens_per_message']:.2f}"),
-                    ft.Text(f"Сообщений в минуту: {stats['messages_per_minute']:.2f}")
-                ]),
+                    ft.Text(f"Сообщений в минуту (за час): {stats['messages_per_minute']:.2f}"),
+                    ft.Text(
+                        "Сообщений/мин 5м/1ч/24ч: " + "/".join(
+                            f"{rate['messages_per_minute']:.2f}" for rate in stats['rates'].values()
+                        ),
+                        size=12,
+                    ),
+                    ft.Text(
+                        "Токенов/мин 5м/1ч/24ч: " + "/".join(
+                            f"{rate['tokens_per_minute']:.0f}" for rate in stats['rates'].values()
+                        ),
+                        size=12,
+                    ),
+                    ft.Text(
+                        "Ошибок 5м/1ч/24ч: " + "/".join(
+                            f"{rate['errors']}" for rate in stats['rates'].values()
+                        ),
+                        size=12,
+                    ),
+                    ft.Text(
+                        f"Ответов из кэша: {stats['cache_hits']} "
+                        f"({stats['cache_hit_rate'] * 100:.0f}%), "
+                        f"сэкономлено токенов: {stats['tokens_saved']}"
+                    ),
+                    ft.Text(
+                        f"Контекст: ~{context_stats['avg_prompt_tokens']:.0f} токенов на запрос, "
+                        f"бюджет сэкономил ~{context_stats['saved_tokens']}"
+                    ),
+                    ft.Text(
+                        f"Очередь API: ожидание p50/p90/p99 {format_percentiles(queue_wait, 'с')}, "
+                        f"ответов 429: {scheduler_stats['rate_limited']}"
+                    ),
+                    ft.Divider(),
+                    ft.Text("Задержки по моделям", weight=ft.FontWeight.BOLD),
+                    ft.Column(latency_rows, scroll=ft.ScrollMode.AUTO, height=250),
+                ], tight=True),
                 actions=[
                     ft.TextButton("Закрыть", on_click=lambda e: close_dialog(dialog)),
                 ],
@@ -399,11 +1164,86 @@ class ChatApp:
             dialog.open = True
             page.update()
 
+        async def show_compare_dialog(e):
+            user_message = (self.message_input.value or "").strip()
+            if not user_message:
+                show_error_snack(page, "Введите сообщение для сравнения.")
+                return
+            if not self.api_client:
+                show_error_snack(page, "API клиент не инициализирован.")
+                return
+
+            selected = [self.model_dropdown.value] if self.model_dropdown.value else []
+            model_list = ft.ListView(**AppStyles.COMPARE_MODEL_LIST)
+            counter = ft.Text("", size=12, color=ft.Colors.GREY_400)
+            search = ft.TextField(hint_text="Поиск модели", autofocus=True)
+
+            def toggle(ev):
+                model = ev.control.data
+                if ev.control.value and model not in selected:
+                    if len(selected) >= self.COMPARE_MAX_MODELS:
+                        ev.control.value = False
+                    else:
+                        selected.append(model)
+                elif not ev.control.value and model in selected:
+                    selected.remove(model)
+                render()
+
+            def render(ev=None):
+                # Каталог мог обновиться, пока диалог открыт, — берётся текущий.
+                options = self.model_dropdown.search_options(
+                    search.value or "", limit=self.COMPARE_LIST_LIMIT
+                )
+                model_list.controls = [
+                    ft.Checkbox(
+                        label=option.text,
+                        data=option.key,
+                        value=option.key in selected,
+                        on_change=toggle
+                    )
+                    for option in options
+                ]
+                counter.value = f"Выбрано моделей: {len(selected)} из {self.COMPARE_MAX_MODELS}"
+                page.update()
+
+            async def start_compare(ev):
+                if len(selected) < 2:
+                    counter.value = "Выберите хотя бы две модели."
+                    page.update()
+                    return
+                close_dialog(dialog)
+                self.message_input.value = ""
+                try:
+                    await self._compare_models(page, user_message, list(selected))
+                except Exception as ex:
+                    self.logger.error(f"Ошибка сравнения моделей: {ex}")
+                    show_error_snack(page, f"Ошибка сравнения: {str(ex)}")
+
+            search.on_change = render
+            dialog = ft.AlertDialog(
+                modal=True,
+                title=ft.Text("Сравнение моделей"),
+                content=ft.Column([search, counter, model_list], tight=True),
+                actions=[
+                    ft.TextButton("Отмена", on_click=lambda ev: close_dialog(dialog)),
+                    ft.TextButton("Сравнить", on_click=start_compare),
+                ],
+                actions_alignment=ft.MainAxisAlignment.END,
+            )
+
+            page.overlay.append(dialog)
+            dialog.open = True
+            render()
+
         async def clear_history(e):
             try:
                 self.cache.clear_history()
                 self.analytics.clear_data()
+                self.context.forget()
+                self.conversation_id = None
+                self.sidebar.set_conversations([])
                 self.chat_history.controls.clear()
+                self._history_cursor = None
             except Exception as e:
                 self.logger.error(f"Ошибка очистки истории: {e}")
                 show_error_snack(page, f"Ошибка очистки истории: {str(e)}")
@@ -437,55 +1277,181 @@ class ChatApp:
             dialog.open = True
             page.update()
 
+        async def rename_conversation(conversation_id, title):
+            title_field = ft.TextField(value=title, autofocus=True, width=300)
+
+            async def save_title(e):
+                new_title = (title_field.value or "").strip()
+                if new_title:
+                    try:
+                        loop = asyncio.get_running_loop()
+                        await loop.run_in_executor(
+                            None, self.cache.rename_conversation, conversation_id, new_title
+                        )
+                        row = self.sidebar.rows.get(conversation_id)
+                        if row is not None:
+                            self.sidebar.rows[conversation_id] = (row[0], new_title, *row[2:])
+                            for tile in self.sidebar.list_view.controls:
+                                if tile.data == conversation_id:
+                                    tile.title.value = new_title
+                    except Exception as ex:
+                        self.logger.error(f"Ошибка переименования диалога: {ex}")
+                        show_error_snack(page, f"Ошибка переименования: {str(ex)}")
+                close_dialog(dialog)
+
+            title_field.on_submit = save_title
+            dialog = ft.AlertDialog(
+                modal=True,
+                title=ft.Text("Название диалога"),
+                content=title_field,
+                actions=[
+                    ft.TextButton("Отмена", on_click=lambda e: close_dialog(dialog)),
+                    ft.TextButton("Сохранить", on_click=save_title),
+                ],
+                actions_alignment=ft.MainAxisAlignment.END,
+            )
+
+            page.overlay.append(dialog)
+            dialog.open = True
+            page.update()
+
+        async def delete_conversation(conversation_id):
+            async def delete_confirmed(e):
+                close_dialog(dialog)
+                try:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, self.cache.delete_conversation, conversation_id)
+                    self.context.forget()
+                    self.sidebar.remove(conversation_id)
+                    if conversation_id == self.conversation_id:
+                        remaining = self.sidebar.list_view.controls
+                        await self._open_conversation(remaining[0].data if remaining else None)
+                    else:
+                        page.update()
+                except Exception as ex:
+                    self.logger.error(f"Ошибка удаления диалога: {ex}")
+                    show_error_snack(page, f"Ошибка удаления диалога: {str(ex)}")
+
+            dialog = ft.AlertDialog(
+                modal=True,
+                title=ft.Text("Удалить диалог?"),
+                content=ft.Text("Все сообщения диалога будут удалены. Это действие нельзя отменить!"),
+                actions=[
+                    ft.TextButton("Отмена", on_click=lambda e: close_dialog(dialog)),
+                    ft.TextButton("Удалить", on_click=delete_confirmed),
+                ],
+                actions_alignment=ft.MainAxisAlignment.END,
+            )
+
+            page.overlay.append(dialog)
+            dialog.open = True
+            page.update()
+
         async def save_dialog(e):
-            try:
-                history = self.cache.get_chat_history()
-
-                dialog_data = []
-                for msg in history:
-                    dialog_data.append({
-                        "timestamp": msg[4],
-                        "model": msg[1],
-                        "user_message": msg[2],
-                        "ai_response": msg[3],
-                        "tokens_used": msg[5]
-                    })
-
-                filename = f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                filepath = os.path.join(self.exports_dir, filename)
+            format_group = ft.RadioGroup(
+                value="json",
+                content=ft.Row([
+                    ft.Radio(value="json", label="JSON"),
+                    ft.Radio(value="ndjson", label="NDJSON"),
+                ]),
+            )
+            compress_checkbox = ft.Checkbox(label="Сжать (gzip)", value=False)
+            progress_bar = ft.ProgressBar(value=0, width=400, visible=False)
+            progress_text = ft.Text("", size=12, color=ft.Colors.GREY_400)
+            cancel_event = threading.Event()
+
+            def on_progress(written, total):
+                # Вызывается из рабочего потока экспорта.
+                progress_bar.value = written / total if total else None
+                progress_text.value = f"Сохранено {written} из {total}"
+                page.update()
 
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    json.dump(dialog_data, f, ensure_ascii=False, indent=2, default=str)
+            def cancel_export(ev):
+                cancel_event.set()
+                close_dialog(dialog)
 
-                dialog = ft.AlertDialog(
-                    modal=True,
-                    title=ft.Text("Диалог сохранен"),
-                    content=ft.Column([
-                        ft.Text("Путь сохранения:"),
-                        ft.Text(filepath, selectable=True, weight=ft.FontWeight.BOLD),
-                    ]),
-                    actions=[
-                        ft.TextButton("OK", on_click=lambda e: close_dialog(dialog)),
-                        ft.TextButton("Открыть папку",
-                            on_click=lambda e: os.startfile(self.exports_dir)
-                        ),
-                    ],
+            async def start_export(ev):
+                fmt = format_group.value
+                compress = bool(compress_checkbox.value)
+                filename = (
+                    f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                    f"{HistoryExporter.file_extension(fmt, compress)}"
                 )
+                filepath = os.path.join(self.exports_dir, filename)
 
-                page.overlay.append(dialog)
-                dialog.open = True
+                export_button.disabled = True
+                format_group.disabled = True
+                compress_checkbox.disabled = True
+                progress_bar.visible = True
                 page.update()
 
-            except Exception as e:
-                self.logger.error(f"Ошибка сохранения: {e}")
-                show_error_snack(page, f"Ошибка сохранения: {str(e)}")
+                try:
+                    loop = asyncio.get_running_loop()
+                    written = await loop.run_in_executor(
+                        None,
+                        lambda: HistoryExporter(self.cache).export(
+                            filepath, fmt=fmt, compress=compress,
+                            progress=on_progress, cancel_event=cancel_event,
+                        )
+                    )
+                except ExportCancelled:
+                    self.logger.info("Экспорт истории отменён")
+                    return
+                except Exception as ex:
+                    self.logger.error(f"Ошибка сохранения: {ex}")
+                    close_dialog(dialog)
+                    show_error_snack(page, f"Ошибка сохранения: {str(ex)}")
+                    return
+
+                self.logger.info(f"История экспортирована: {filepath} ({written} записей)")
+                dialog.title = ft.Text("Диалог сохранен")
+                dialog.content = ft.Column([
+                    ft.Text(f"Сохранено записей: {written}"),
+                    ft.Text("Путь сохранения:"),
+                    ft.Text(filepath, selectable=True, weight=ft.FontWeight.BOLD),
+                ], tight=True)
+                dialog.actions = [
+                    ft.TextButton("OK", on_click=lambda e: close_dialog(dialog)),
+                    ft.TextButton("Открыть папку",
+                        on_click=lambda e: os.startfile(self.exports_dir)
+                    ),
+                ]
+                page.update()
+
+            export_button = ft.TextButton("Экспорт", on_click=start_export)
+
+            dialog = ft.AlertDialog(
+                modal=True,
+                title=ft.Text("Экспорт истории"),
+                content=ft.Column([
+                    ft.Text("Формат файла:"),
+                    format_group,
+                    compress_checkbox,
+                    progress_bar,
+                    progress_text,
+                ], tight=True),
+                actions=[
+                    ft.TextButton("Отмена", on_click=cancel_export),
+                    export_button,
+                ],
+            )
+
+            page.overlay.append(dialog)
+            dialog.open = True
+            page.update()
 
         # --- построение layout ---
 
         self.message_input = ft.TextField(**AppStyles.MESSAGE_INPUT)
-        self.chat_history = ft.ListView(**AppStyles.CHAT_HISTORY)
+        self.chat_history = ft.ListView(
+            on_scroll=self._on_history_scroll,
+            **AppStyles.CHAT_HISTORY
+        )
+        self._reset_history_paging()
 
-        self.load_chat_history()
+        # Оболочка чата отрисовывается сразу, данные подгружаются параллельно.
+        history_placeholder = ft.ProgressRing()
+        self.chat_history.controls.append(history_placeholder)
 
         save_button = ft.ElevatedButton(
             on_click=save_dialog,
@@ -502,15 +1468,27 @@ class ChatApp:
             **AppStyles.SEND_BUTTON
         )
 
+        # Видна, пока выполняется хотя бы один запрос к API.
+        self.stop_button = ft.ElevatedButton(
+            on_click=self._stop_generation,
+            **AppStyles.STOP_BUTTON
+        )
+
         analytics_button = ft.ElevatedButton(
             on_click=show_analytics,
             **AppStyles.ANALYTICS_BUTTON
         )
 
+        compare_button = ft.ElevatedButton(
+            on_click=show_compare_dialog,
+            **AppStyles.COMPARE_BUTTON
+        )
+
         control_buttons = ft.Row(
             controls=[
                 save_button,
                 analytics_button,
+                compare_button,
                 clear_button
             ],
             **AppStyles.CONTROL_BUTTONS_ROW
@@ -519,7 +1497,8 @@ class ChatApp:
         input_row = ft.Row(
             controls=[
                 self.message_input,
-                send_button
+                send_button,
+                self.stop_button
             ],
             **AppStyles.INPUT_ROW
         )
@@ -537,11 +1516,18 @@ class ChatApp:
             **AppStyles.BALANCE_CONTAINER
         )
 
+        self.history_search = ft.TextField(
+            on_submit=search_history,
+            hint_text="Поиск по истории",
+            **AppStyles.HISTORY_SEARCH_FIELD
+        )
+
         model_selection = ft.Column(
             controls=[
                 self.model_dropdown.search_field,
                 self.model_dropdown,
-                balance_container
+                balance_container,
+                self.history_search
             ],
             **AppStyles.MODEL_SELECTION_COLUMN
         )
@@ -555,18 +1541,55 @@ class ChatApp:
             **AppStyles.MAIN_COLUMN
         )
 
-        page.add(self.main_column)
-        self.monitor.get_metrics()
+        if self.balance_text.value == "Баланс: н/д":
+            self.balance_text.value = "Баланс: загрузка..."
+            self.balance_text.color = ft.Colors.GREY_400
+
+        self.sidebar = ConversationSidebar(
+            on_select=self._open_conversation,
+            on_create=self._new_conversation,
+            on_rename=rename_conversation,
+            on_delete=delete_conversation,
+            on_load_more=self._load_more_conversations,
+        )
+
+        page.add(ft.Row(
+            controls=[self.sidebar, self.main_column],
+            **AppStyles.APP_ROW
+        ))
+        if self._login_started is not None:
+            self.monitor.record_phase("login_to_shell", time.perf_counter() - self._login_started)
+        page.run_task(self._run_startup_pipeline, page, history_placeholder)
+
+        # PERF_SAMPLE_INTERVAL (секунды) включает фоновый сбор метрик;
+        # без него метрики снимаются только при log_metrics.
+        sample_interval = float(os.getenv("PERF_SAMPLE_INTERVAL", "0") or 0)
+        if sample_interval > 0:
+            self.monitor.start_sampling(sample_interval)
+        else:
+            self.monitor.get_metrics()
         self.logger.info("Приложение запущено")
 
     # ------------------------- ТОЧКА ВХОДА FLET -------------------------
 
     def main(self, page: ft.Page):
+        self.page = page
+
         for key, value in AppStyles.PAGE_SETTINGS.items():
             setattr(page, key, value)
 
         AppStyles.set_window_size(page)
 
+        async def on_disconnect(e):
+            await self._close_api_client()
+            self.monitor.stop_sampling()
+            if not self.cache.flush():
+                self.logger.error(
+                    f"Не все записи сохранены: {self.cache.get_write_stats()['last_error']}"
+                )
+
+        page.on_disconnect = on_disconnect
+
         auth_data = self.cache.get_auth()
 
         if not auth_data:
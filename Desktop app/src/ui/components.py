@@ -1,5 +1,8 @@
+from __future__ import annotations
+
 import flet as ft
 from ui.styles import AppStyles
+from utils.model_search import ModelSearchIndex
 import asyncio
 
 class MessageBubble(ft.Container):
@@ -23,24 +26,43 @@ class MessageBubble(ft.Container):
             bottom=5
         )
         
+        self.text = ft.Text(
+            value=message,
+            color=ft.Colors.WHITE,
+            size=16,
+            selectable=True,
+            weight=ft.FontWeight.W_400
+        )
+
         self.content = ft.Column(
-            controls=[
-                ft.Text(
-                    value=message,
-                    color=ft.Colors.WHITE,
-                    size=16,
-                    selectable=True,
-                    weight=ft.FontWeight.W_400
-                )
-            ],
+            controls=[self.text],
             tight=True
         )
 
+    def append_text(self, delta: str):
+        """
+        Дописывает фрагмент текста (используется при потоковом ответе).
+        """
+        self.text.value = (self.text.value or "") + delta
+
+    def set_text(self, message: str):
+        """
+        Полностью заменяет текст сообщения.
+        """
+        self.text.value = message
+
 
 class ModelSelector(ft.Dropdown):
     """
     Выпадающий список для выбора AI модели с функцией поиска.
+
+    Поиск идёт по ModelSearchIndex, построенному один раз на каталог;
+    ввод обрабатывается с задержкой SEARCH_DEBOUNCE, и обновляется только
+    сам список, а не вся страница.
     """
+    # Пауза после последнего нажатия клавиши перед фильтрацией (в секундах).
+    SEARCH_DEBOUNCE = 0.15
+
     def __init__(self, models: list):
         super().__init__()
         
@@ -50,14 +72,9 @@ class ModelSelector(ft.Dropdown):
         self.label = None
         self.hint_text = "Выбор модели"
         
-        self.options = [
-            ft.dropdown.Option(
-                key=model['id'],
-                text=model['name']
-            ) for model in models
-        ]
-        
-        self.all_options = self.options.copy()
+        self._set_catalog(models)
+        self.options = self.all_options
+        self._search_generation = 0
         
         self.value = models[0]['id'] if models else None
         
@@ -67,18 +84,225 @@ class ModelSelector(ft.Dropdown):
             **AppStyles.MODEL_SEARCH_FIELD
         )
 
-    def filter_options(self, e):
+    def _set_catalog(self, models: list):
+        options = [
+            ft.dropdown.Option(
+                key=model['id'],
+                text=model['name']
+            ) for model in models
+        ]
+        # Список и индекс заменяются одним присваиванием: каталог обновляется
+        # из фонового потока, и номера из нового индекса не должны попасть
+        # в старый список.
+        search_index = ModelSearchIndex([(option.key, option.text) for option in options])
+        self._catalog = (options, search_index)
+
+    @property
+    def all_options(self) -> list:
+        return self._catalog[0]
+
+    def search_options(self, query: str, limit: int | None = None) -> list:
         """
-        Фильтрация списка моделей на основе введенного текста поиска.
+        Варианты каталога, подходящие под query, лучшие первыми.
+        """
+        options, search_index = self._catalog
+        return [options[index] for index in search_index.search(query, limit=limit)]
+
+    def update_models(self, models: list):
         """
-        search_text = self.search_field.value.lower() if self.search_field.value else ""
+        Заменяет каталог моделей на месте, сохраняя выбор и текущий фильтр.
+        """
+        self._set_catalog(models)
+
+        keys = {model['id'] for model in models}
+        if self.value not in keys:
+            self.value = models[0]['id'] if models else None
+
+        self._apply_filter()
+
+    def _apply_filter(self):
+        search_text = self.search_field.value or ""
         
-        if not search_text:
+        if not search_text.strip():
             self.options = self.all_options
         else:
-            self.options = [
-                opt for opt in self.all_options
-                if search_text in opt.text.lower() or search_text in opt.key.lower()
-            ]
-        
-        e.page.update()
+            self.options = self.search_options(search_text)
+
+    async def filter_options(self, e):
+        """
+        Фильтрация списка моделей на основе введенного текста поиска.
+        """
+        self._search_generation += 1
+        generation = self._search_generation
+        await asyncio.sleep(self.SEARCH_DEBOUNCE)
+        if generation != self._search_generation:
+            # Пользователь продолжил ввод — отфильтруем по последнему значению.
+            return
+
+        self._apply_filter()
+        self.update()
+
+
+class ComparisonPanel(ft.Container):
+    """
+    Ответ одной модели в режиме сравнения: название, текст и метрики запроса.
+    """
+    def __init__(self, title: str):
+        super().__init__()
+
+        for key, value in AppStyles.COMPARISON_PANEL.items():
+            setattr(self, key, value)
+
+        self.text = ft.Text(value="", color=ft.Colors.WHITE, size=14, selectable=True)
+        self.metrics = ft.Text(value="Ожидание ответа...", size=12, color=ft.Colors.GREY_400)
+
+        self.content = ft.Column(
+            controls=[
+                ft.Text(title, weight=ft.FontWeight.BOLD, size=13, color=ft.Colors.BLUE_200),
+                self.text,
+                self.metrics
+            ],
+            tight=True
+        )
+
+    def append_text(self, delta: str):
+        self.text.value = (self.text.value or "") + delta
+
+    def set_text(self, message: str):
+        self.text.value = message
+
+    def set_metrics(self, text: str, error: bool = False):
+        self.metrics.value = text
+        self.metrics.color = ft.Colors.RED_400 if error else ft.Colors.GREY_400
+
+
+class ComparisonView(ft.Column):
+    """
+    Ответы нескольких моделей на один промпт — колонками рядом друг с другом.
+    models — пары (id, название); панели доступны в panels по id модели.
+    """
+    def __init__(self, models: list):
+        super().__init__()
+
+        self.panels = {model_id: ComparisonPanel(name) for model_id, name in models}
+        self.summary = ft.Text(
+            f"Сравнение моделей: {len(self.panels)}", size=12, color=ft.Colors.GREY_400
+        )
+        self.controls = [
+            ft.Row(controls=list(self.panels.values()), **AppStyles.COMPARISON_ROW),
+            self.summary
+        ]
+        self.tight = True
+
+    def set_summary(self, text: str):
+        self.summary.value = text
+
+
+class ConversationSidebar(ft.Container):
+    """
+    Боковая панель со списком диалогов.
+
+    Обработчики on_select(conversation_id), on_create(), on_rename(conversation_id, title)
+    и on_delete(conversation_id) — корутины ChatApp; панель только отображает
+    список и сообщает о действиях пользователя.
+    """
+    def __init__(self, on_select, on_create, on_rename, on_delete, on_load_more=None):
+        super().__init__()
+
+        for key, value in AppStyles.SIDEBAR.items():
+            setattr(self, key, value)
+
+        self.on_select = on_select
+        self.on_create = on_create
+        self.on_rename = on_rename
+        self.on_delete = on_delete
+        self.on_load_more = on_load_more
+
+        self.selected_id = None
+        self.rows = {}
+
+        self.list_view = ft.ListView(**AppStyles.CONVERSATION_LIST)
+        self.more_button = ft.TextButton(
+            "Показать ещё",
+            visible=False,
+            on_click=self._load_more_click
+        )
+
+        self.content = ft.Column(
+            controls=[
+                ft.ElevatedButton(
+                    on_click=self._create_click,
+                    **AppStyles.NEW_CONVERSATION_BUTTON
+                ),
+                self.list_view,
+                self.more_button
+            ],
+            expand=True
+        )
+
+    def set_conversations(self, rows: list, has_more: bool = False, append: bool = False):
+        """
+        Показывает строки ChatCache.list_conversations (append — следующая страница).
+        """
+        if not append:
+            self.rows.clear()
+            self.list_view.controls.clear()
+        for row in rows:
+            self.rows[row[0]] = row
+            self.list_view.controls.append(self._tile(row))
+        self.more_button.visible = has_more
+
+    def select(self, conversation_id):
+        self.selected_id = conversation_id
+        for tile in self.list_view.controls:
+            tile.selected = tile.data == conversation_id
+
+    def touch(self, row):
+        """
+        Обновляет диалог после нового сообщения и поднимает его в начало списка.
+        """
+        self.rows[row[0]] = row
+        self.list_view.controls = [
+            tile for tile in self.list_view.controls if tile.data != row[0]
+        ]
+        self.list_view.controls.insert(0, self._tile(row))
+
+    def remove(self, conversation_id):
+        self.rows.pop(conversation_id, None)
+        self.list_view.controls = [
+            tile for tile in self.list_view.controls if tile.data != conversation_id
+        ]
+
+    def _tile(self, row) -> ft.ListTile:
+        conversation_id, title, _, _, message_count = row
+        return ft.ListTile(
+            data=conversation_id,
+            title=ft.Text(title, no_wrap=True, overflow=ft.TextOverflow.ELLIPSIS),
+            subtitle=ft.Text(f"Сообщений: {message_count}", size=12, color=ft.Colors.GREY_400),
+            selected=conversation_id == self.selected_id,
+            on_click=self._select_click,
+            trailing=ft.PopupMenuButton(
+                items=[
+                    ft.PopupMenuItem(text="Переименовать", data=conversation_id, on_click=self._rename_click),
+                    ft.PopupMenuItem(text="Удалить", data=conversation_id, on_click=self._delete_click),
+                ]
+            ),
+            **AppStyles.CONVERSATION_TILE
+        )
+
+    async def _select_click(self, e):
+        await self.on_select(e.control.data)
+
+    async def _create_click(self, e):
+        await self.on_create()
+
+    async def _rename_click(self, e):
+        row = self.rows.get(e.control.data)
+        await self.on_rename(e.control.data, row[1] if row else "")
+
+    async def _delete_click(self, e):
+        await self.on_delete(e.control.data)
+
+    async def _load_more_click(self, e):
+        if self.on_load_more:
+            await self.on_load_more()
@@ -16,6 +16,7 @@ class AppStyles:
         "height": 400,
         "auto_scroll": True,
         "padding": 20,
+        "on_scroll_interval": 100,
     }
 
     MESSAGE_INPUT = {
@@ -46,6 +47,20 @@ class AppStyles:
         "width": 130,
     }
 
+    STOP_BUTTON = {
+        "text": "Стоп",
+        "icon": ft.icons.STOP,
+        "style": ft.ButtonStyle(
+            color=ft.Colors.WHITE,
+            bgcolor=ft.Colors.RED_700,
+            padding=10,
+        ),
+        "tooltip": "Остановить генерацию ответа",
+        "height": 40,
+        "width": 100,
+        "visible": False,
+    }
+
     SAVE_BUTTON = {
         "text": "Сохранить",
         "icon": ft.icons.SAVE,
@@ -126,6 +141,29 @@ class AppStyles:
         "height": 45,
     }
 
+    HISTORY_SEARCH_FIELD = {
+        "width": 400,
+        "border_radius": 8,
+        "bgcolor": ft.Colors.GREY_900,
+        "border_color": ft.Colors.GREY_700,
+        "color": ft.Colors.WHITE,
+        "content_padding": 10,
+        "cursor_color": ft.Colors.WHITE,
+        "focused_border_color": ft.Colors.BLUE_400,
+        "focused_bgcolor": ft.Colors.GREY_800,
+        "hint_style": ft.TextStyle(
+            color=ft.Colors.GREY_400,
+            size=14,
+        ),
+        "prefix_icon": ft.icons.MANAGE_SEARCH,
+        "height": 45,
+    }
+
+    SEARCH_RESULTS = {
+        "spacing": 5,
+        "height": 400,
+    }
+
     MODEL_DROPDOWN = {
         "width": 400,
         "height": 45,
@@ -158,8 +196,79 @@ class AppStyles:
         "border": ft.border.all(1, ft.Colors.GREY_700),
     }
 
+    SIDEBAR = {
+        "width": 240,
+        "padding": 10,
+        "bgcolor": ft.Colors.GREY_900,
+        "border_radius": 8,
+        "border": ft.border.all(1, ft.Colors.GREY_700),
+    }
+
+    CONVERSATION_LIST = {
+        "expand": True,
+        "spacing": 2,
+    }
+
+    CONVERSATION_TILE = {
+        "dense": True,
+        "selected_color": ft.Colors.WHITE,
+        "selected_tile_color": ft.Colors.BLUE_900,
+        "content_padding": ft.padding.only(left=10, right=0),
+    }
+
+    NEW_CONVERSATION_BUTTON = {
+        "text": "Новый чат",
+        "icon": ft.icons.ADD,
+        "style": ft.ButtonStyle(
+            color=ft.Colors.WHITE,
+            bgcolor=ft.Colors.BLUE_700,
+            padding=10,
+        ),
+        "tooltip": "Начать новый диалог",
+        "height": 40,
+        "width": 220,
+    }
+
+    COMPARE_BUTTON = {
+        "text": "Сравнить",
+        "icon": ft.icons.COMPARE_ARROWS,
+        "style": ft.ButtonStyle(
+            color=ft.Colors.WHITE,
+            bgcolor=ft.Colors.PURPLE_700,
+            padding=10,
+        ),
+        "tooltip": "Отправить сообщение нескольким моделям",
+        "width": 130,
+        "height": 40,
+    }
+
+    COMPARE_MODEL_LIST = {
+        "height": 300,
+        "width": 400,
+        "spacing": 0,
+    }
+
+    COMPARISON_ROW = {
+        "spacing": 10,
+        "vertical_alignment": ft.CrossAxisAlignment.START,
+    }
+
+    COMPARISON_PANEL = {
+        "expand": True,
+        "padding": 10,
+        "border_radius": 10,
+        "bgcolor": ft.Colors.GREY_800,
+        "margin": ft.margin.only(top=5, bottom=5),
+    }
+
+    APP_ROW = {
+        "expand": True,
+        "spacing": 10,
+        "vertical_alignment": ft.CrossAxisAlignment.START,
+    }
+
     @staticmethod
     def set_window_size(page: ft.Page):
-        page.window.width = 600
+        page.window.width = 860
         page.window.height = 800
         page.window.resizable = False
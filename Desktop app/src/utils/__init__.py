@@ -4,12 +4,15 @@ Contains utility modules for the application.
 """
 from .analytics import Analytics
 from .cache import ChatCache
+from .export import HistoryExporter, ExportCancelled
 from .logger import AppLogger
 from .monitor import PerformanceMonitor
 
 __all__ = [
     'Analytics',
     'ChatCache',
+    'HistoryExporter',
+    'ExportCancelled',
     'AppLogger',
     'PerformanceMonitor'
 ]
@@ -1,69 +1,205 @@
+from __future__ import annotations
+
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+from utils.columnar import MessageColumns
+from utils.rollups import UsageRollups, WINDOWS, naive_epoch
+from utils.sketch import QuantileSketch, LATENCY_METRICS, latency_samples
 
 class Analytics:
     """
     Класс для сбора и анализа данных об использовании приложения.
     """
 
+    # Адаптивный тайм-аут: p99 наблюдаемой задержки модели с запасом,
+    # в пределах TIMEOUT_BOUNDS; до TIMEOUT_MIN_SAMPLES замеров — значение по умолчанию.
+    TIMEOUT_MULTIPLIER = 3.0
+    TIMEOUT_MIN_SAMPLES = 20
+    TIMEOUT_BOUNDS = (15.0, 180.0)
+
     def __init__(self, cache):
         self.cache = cache
         self.start_time = time.time()
         self.model_usage = {}
-        self.session_data = []
+        # Сырые записи загружаются лениво, при первом обращении к session_data.
+        self._session_data = None
+        # Скетчи перцентилей: {model: {metric: QuantileSketch}}.
+        self.latency_sketches = {}
+        # Скользящие окна за последние сутки (поминутные корзины в памяти).
+        self.rollups = UsageRollups()
+        # Обращения к кэшу ответов учитываются отдельно от запросов к API.
+        self.cache_stats = {
+            'hits': 0,
+            'misses': 0,
+            'tokens_saved': 0
+        }
         
         self._load_historical_data()
         
     def _load_historical_data(self):
         """
-        Обновляет статистику использования моделей и сессионные данные.
+        Загружает агрегированную статистику использования моделей.
+        Агрегаты считаются в SQLite (таблица analytics_model_usage),
+        поэтому время запуска не зависит от объёма истории.
         """
-        history = self.cache.get_analytics_history()
-        
-        for record in history:
-            timestamp, model, message_length, response_time, tokens_used = record
-            
-            if model not in self.model_usage:
-                self.model_usage[model] = {
-                    'count': 0,
-                    'tokens': 0
-                }
-            self.model_usage[model]['count'] += 1
-            self.model_usage[model]['tokens'] += tokens_used
-            
-            self.session_data.append({
-                'timestamp': datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S.%f'),
-                'model': model,
-                'message_length': message_length,
+        for model, count, tokens, response_time, cost in self.cache.get_model_usage_summary():
+            self.model_usage[model] = {
+                'count': count,
+                'tokens': tokens,
                 'response_time': response_time,
-                'tokens_used': tokens_used
-            })
+                'cost': cost
+            }
+
+        for model, metric, data in self.cache.get_latency_sketches():
+            self.latency_sketches.setdefault(model, {})[metric] = QuantileSketch.from_json(data)
+
+        # Окна восстанавливаются из минутных корзин usage_rollups — не больше суток строк.
+        since = naive_epoch(datetime.now()) - self.rollups.size * 60
+        for bucket_start, messages, tokens, errors, latency in self.cache.get_usage_rollups('minute', since):
+            self.rollups.load_bucket(bucket_start, messages, tokens, errors, latency)
+
+    @property
+    def session_data(self) -> MessageColumns:
+        """
+        Подробные записи по каждому сообщению в колоночном виде;
+        читаются из базы при первом обращении.
+        """
+        if self._session_data is None:
+            self._session_data = self._load_session_data()
+        return self._session_data
+
+    def _load_session_data(self) -> MessageColumns:
+        # Записи, ещё стоящие в очереди на запись, тоже должны попасть в выборку.
+        self.cache.flush()
+
+        session_data = MessageColumns()
+        for record in self.cache.iter_analytics_history():
+            timestamp, model, message_length, response_time, tokens_used, time_to_first_token, is_error = record
+            session_data.append(
+                datetime.fromisoformat(str(timestamp)), model, message_length,
+                response_time, tokens_used, time_to_first_token, is_error
+            )
+        return session_data
 
-    def track_message(self, model: str, message_length: int, response_time: float, tokens_used: int):
+    def track_message(self, model: str, message_length: int, response_time: float, tokens_used: int,
+                      time_to_first_token: float | None = None, error: bool = False,
+                      cost: float | None = None, sample_latency: bool = True,
+                      completion_tokens: int | None = None):
         """
         Сохраняет подробную информацию о каждом сообщении и обновляет
         общую статистику использования моделей.
+
+        time_to_first_token — время до первого токена для потоковых ответов
+        (None, если ответ был получен целиком); error — запрос завершился ошибкой;
+        cost — оценка стоимости в USD по ценам каталога (None, если цена неизвестна);
+        sample_latency=False не учитывает время в перцентилях (остановленная генерация),
+        ответы с ошибкой в перцентили не попадают никогда; completion_tokens —
+        токены ответа для скорости генерации (None — скорость не учитывается).
         """
         timestamp = datetime.now()
         
-        self.cache.save_analytics(timestamp, model, message_length, response_time, tokens_used)
+        self.cache.save_analytics(
+            timestamp, model, message_length, response_time, tokens_used,
+            time_to_first_token=time_to_first_token, is_error=error, cost=cost
+        )
+        self.rollups.add(timestamp, tokens_used, response_time, error)
         
         if model not in self.model_usage:
             self.model_usage[model] = {
                 'count': 0,
-                'tokens': 0
+                'tokens': 0,
+                'response_time': 0.0,
+                'cost': 0.0
             }
 
         self.model_usage[model]['count'] += 1
         self.model_usage[model]['tokens'] += tokens_used
+        self.model_usage[model]['response_time'] += response_time
+        self.model_usage[model]['cost'] += cost or 0.0
+
+        if sample_latency and not error:
+            self._update_latency_sketches(model, response_time, completion_tokens, time_to_first_token)
+
+        if self._session_data is None:
+            return
+
+        self._session_data.append(
+            timestamp, model, message_length, response_time, tokens_used,
+            time_to_first_token, error
+        )
+
+    def _update_latency_sketches(self, model, response_time, completion_tokens, time_to_first_token):
+        model_sketches = self.latency_sketches.setdefault(model, {})
+        rows = []
+        for metric, value in latency_samples(response_time, completion_tokens, time_to_first_token).items():
+            sketch = model_sketches.setdefault(metric, QuantileSketch())
+            sketch.add(value)
+            rows.append((model, metric, sketch.to_json()))
+        self.cache.save_latency_sketches(rows)
+
+    def get_latency_percentiles(self, model: str | None = None) -> dict:
+        """
+        p50/p90/p99 по метрикам LATENCY_METRICS без пересчёта истории.
+        Без model возвращает словарь по всем моделям.
+        """
+        if model is not None:
+            model_sketches = self.latency_sketches.get(model, {})
+            return {
+                metric: model_sketches[metric].percentiles()
+                for metric in LATENCY_METRICS
+                if metric in model_sketches
+            }
 
-        self.session_data.append({
-            'timestamp': timestamp,
-            'model': model,
-            'message_length': message_length,
-            'response_time': response_time,
-            'tokens_used': tokens_used
-        })
+        return {name: self.get_latency_percentiles(name) for name in self.latency_sketches}
+
+    def get_request_timeout(self, model: str, metric: str = 'response_time',
+                            default: float | None = None) -> float | None:
+        """
+        Тайм-аут запроса к model по скетчу metric ('response_time' — весь ответ,
+        'time_to_first_token' — ожидание данных в потоке). None/default, если
+        статистики пока мало.
+        """
+        sketch = self.latency_sketches.get(model, {}).get(metric)
+        if sketch is None or sketch.count < self.TIMEOUT_MIN_SAMPLES:
+            return default
+
+        low, high = self.TIMEOUT_BOUNDS
+        return min(high, max(low, sketch.quantile(0.99) * self.TIMEOUT_MULTIPLIER))
+
+    def get_window_rates(self) -> dict:
+        """
+        Темпы за последние 5 минут, час и сутки: {'5m': {...}, '1h': {...}, '24h': {...}}.
+        """
+        now = datetime.now()
+        return {name: self.rollups.window(name, now) for name in WINDOWS}
+
+    def get_usage_trend(self, granularity: str = 'hour', since: datetime | None = None) -> list:
+        """
+        Агрегаты по корзинам ('minute', 'hour', 'day') из usage_rollups,
+        без обращения к сырым записям.
+        """
+        self.cache.flush()
+        rows = self.cache.get_usage_rollups(granularity, naive_epoch(since) if since else None)
+        return [
+            {
+                'bucket_start': datetime.fromtimestamp(bucket_start, timezone.utc).replace(tzinfo=None),
+                'messages': messages,
+                'tokens': tokens,
+                'errors': errors,
+                'avg_latency': latency / messages if messages else 0
+            }
+            for bucket_start, messages, tokens, errors, latency in rows
+        ]
+
+    def track_cache_hit(self, model: str, tokens_saved: int):
+        """
+        Учитывает ответ, взятый из кэша вместо платного запроса к API.
+        """
+        self.cache_stats['hits'] += 1
+        self.cache_stats['tokens_saved'] += tokens_saved
+
+    def track_cache_miss(self, model: str):
+        self.cache_stats['misses'] += 1
 
     def get_statistics(self) -> dict:
         """
@@ -76,21 +212,46 @@ class Analytics:
         
         total_messages = sum(model['count'] for model in self.model_usage.values())
 
+        total_response_time = sum(model['response_time'] for model in self.model_usage.values())
+
+        total_cost = sum(model['cost'] for model in self.model_usage.values())
+
+        cache_lookups = self.cache_stats['hits'] + self.cache_stats['misses']
+
+        rates = self.get_window_rates()
+
         return {
             'total_messages': total_messages,
             'total_tokens': total_tokens,
             'session_duration': total_time,
             
-            'messages_per_minute': (total_messages * 60) / total_time if total_time > 0 else 0,
+            # Темп за последний час, а не за всё время, делённое на аптайм сессии.
+            'messages_per_minute': rates['1h']['messages_per_minute'],
+            'rates': rates,
             
             'tokens_per_message': total_tokens / total_messages if total_messages > 0 else 0,
+
+            'avg_response_time': total_response_time / total_messages if total_messages > 0 else 0,
+
+            'total_cost': total_cost,
             
-            'model_usage': self.model_usage
+            'model_usage': self.model_usage,
+
+            'cache_hits': self.cache_stats['hits'],
+            'cache_misses': self.cache_stats['misses'],
+            'cache_hit_rate': self.cache_stats['hits'] / cache_lookups if cache_lookups > 0 else 0,
+            'tokens_saved': self.cache_stats['tokens_saved']
         }
 
     def export_data(self) -> list:
-        return self.session_data
+        """
+        Записи в виде словарей, как раньше хранились в session_data.
+        """
+        return list(self.session_data.to_dicts())
 
     def clear_data(self):
         self.model_usage.clear()
-        self.session_data.clear()
+        self._session_data = MessageColumns()
+        self.rollups = UsageRollups()
+        for key in self.cache_stats:
+            self.cache_stats[key] = 0
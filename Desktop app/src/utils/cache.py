@@ -1,7 +1,13 @@
 import sqlite3
 import json
+import hashlib
+from collections import OrderedDict
 from datetime import datetime
 import threading
+import time
+from utils.migrations import run_migrations
+from utils.db_writer import DatabaseWriter
+from utils.tracing import tracer
 
 
 class ChatCache:
@@ -13,126 +19,728 @@ class ChatCache:
         self.db_name = 'chat_cache.db'
         
         self.local = threading.local()
+
+        # Кэш ответов модели выключен, пока не вызван enable_response_cache().
+        self.response_cache_enabled = False
+        self.response_cache_ttl = 24 * 60 * 60
+        self.response_cache_max_bytes = 50 * 1024 * 1024
+        self.response_cache_memory_entries = 128
+        self._memory_responses = OrderedDict()
+        self._memory_lock = threading.Lock()
         
         self.create_tables()
 
+        # Записи сообщений и аналитики идут через фоновый поток пачками (WAL),
+        # чтобы обработчики UI платили только за постановку в очередь.
+        self.writer = DatabaseWriter(self.db_name)
+
     def get_connection(self):
         if not hasattr(self.local, 'connection'):
             self.local.connection = sqlite3.connect(self.db_name)
+            self.local.connection.execute('PRAGMA busy_timeout=5000')
         return self.local.connection
 
+    def flush(self, timeout=None):
+        """
+        Дожидается записи всех операций, поставленных в очередь.
+        False — запись не подтверждена (см. DatabaseWriter.flush).
+        """
+        return self.writer.flush(timeout)
+
+    def get_write_stats(self):
+        return self.writer.get_stats()
+
     def create_tables(self):
-        conn = sqlite3.connect(self.db_name)
+        """
+        Создаёт и обновляет схему базы через миграции (см. utils.migrations).
+        """
+        self.migration_report = run_migrations(self.db_name)
+
+    # ---------- Сообщения чата ----------
+
+    def save_message(self, model, user_message, ai_response, tokens_used, conversation_id=None):
+        with tracer.span("cache.save_message"):
+            self.writer.submit('''
+                INSERT INTO messages (model, user_message, ai_response, timestamp, tokens_used, conversation_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (model, user_message, ai_response, datetime.now(), tokens_used, conversation_id))
+
+    def get_chat_history(self, limit=50):
+        return self.get_chat_history_page(limit=limit)
+
+    def get_chat_history_page(self, limit=50, before=None, conversation_id=None):
+        """
+        Страница истории от новых к старым (keyset-пагинация по (timestamp, id)).
+        before — курсор (timestamp, id) последней строки предыдущей страницы;
+        стоимость запроса не зависит от того, насколько глубоко листают историю.
+        С conversation_id читаются только строки этого диалога (индекс
+        idx_messages_conversation), без него — вся история.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if conversation_id is not None and before is None:
+            cursor.execute('''
+                SELECT * FROM messages
+                WHERE conversation_id = ?
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', (conversation_id, limit))
+        elif conversation_id is not None:
+            cursor.execute('''
+                SELECT * FROM messages
+                WHERE conversation_id = ? AND (timestamp, id) < (?, ?)
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', (conversation_id, before[0], before[1], limit))
+        elif before is None:
+            cursor.execute('''
+                SELECT * FROM messages 
+                ORDER BY timestamp DESC, id DESC 
+                LIMIT ?
+            ''', (limit,))
+        else:
+            cursor.execute('''
+                SELECT * FROM messages 
+                WHERE (timestamp, id) < (?, ?)
+                ORDER BY timestamp DESC, id DESC 
+                LIMIT ?
+            ''', (before[0], before[1], limit))
+        return cursor.fetchall()
+
+    @staticmethod
+    def history_cursor(row):
+        """
+        Курсор для get_chat_history_page по строке таблицы messages.
+        """
+        return (row[4], row[0])
+
+    def get_messages_range(self, after_id, upto_id, conversation_id=None):
+        """
+        Сообщения с after_id < id <= upto_id по возрастанию id
+        (только диалога conversation_id, если он задан).
+        """
+        conn = self.get_connection()
         cursor = conn.cursor()
-        
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                model TEXT,
-                user_message TEXT,
-                ai_response TEXT,
-                timestamp DATETIME,
-                tokens_used INTEGER
-            )
-        ''')
-        
+            SELECT * FROM messages
+            WHERE id > ? AND id <= ? AND (? IS NULL OR conversation_id = ?)
+            ORDER BY id ASC
+        ''', (after_id, upto_id, conversation_id, conversation_id))
+        return cursor.fetchall()
+
+    def get_history_size(self, exclude_prefix=None, conversation_id=None):
+        """
+        Суммарный размер текста истории в байтах UTF-8 и число пар реплик.
+        Строки, ответ которых начинается с exclude_prefix, не учитываются.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analytics_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME,
-                model TEXT,
-                message_length INTEGER,
-                response_time FLOAT,
-                tokens_used INTEGER
-            )
-        ''')
+            SELECT
+                COALESCE(SUM(LENGTH(CAST(user_message AS BLOB)) + LENGTH(CAST(ai_response AS BLOB))), 0),
+                COUNT(*)
+            FROM messages
+            WHERE (? IS NULL OR ai_response NOT LIKE ? || '%')
+              AND (? IS NULL OR conversation_id = ?)
+        ''', (exclude_prefix, exclude_prefix, conversation_id, conversation_id))
+        return cursor.fetchone()
 
+    def get_context_summary(self, upto_id, conversation_id=None):
+        """
+        Ближайшая сохранённая выжимка, охватывающая сообщения до upto_id:
+        (upto_id, summary) или None.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS auth (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                api_key TEXT NOT NULL,
-                pin TEXT NOT NULL
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+            SELECT upto_id, summary FROM context_summaries
+            WHERE upto_id <= ? AND conversation_id IS ?
+            ORDER BY upto_id DESC
+            LIMIT 1
+        ''', (upto_id, conversation_id))
+        return cursor.fetchone()
 
-    # ---------- Сообщения чата ----------
+    def save_context_summary(self, upto_id, summary, conversation_id=None):
+        self.writer.submit(
+            '''
+            INSERT OR REPLACE INTO context_summaries (upto_id, summary, created_at, conversation_id)
+            VALUES (?, ?, ?, ?)
+            ''',
+            (upto_id, summary, time.time(), conversation_id)
+        )
+
+    # ---------- Диалоги ----------
 
-    def save_message(self, model, user_message, ai_response, tokens_used):
+    def create_conversation(self, title):
+        """
+        Создаёт диалог и возвращает его id.
+        """
+        now = datetime.now()
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO messages (model, user_message, ai_response, timestamp, tokens_used)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (model, user_message, ai_response, datetime.now(), tokens_used))
+        cursor.execute(
+            'INSERT INTO conversations (title, created_at, updated_at) VALUES (?, ?, ?)',
+            (title, now, now)
+        )
         conn.commit()
+        return cursor.lastrowid
 
-    def get_chat_history(self, limit=50):
+    def get_conversation(self, conversation_id):
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT * FROM messages 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        ''', (limit,))
+            SELECT id, title, created_at, updated_at, message_count
+            FROM conversations WHERE id = ?
+        ''', (conversation_id,))
+        return cursor.fetchone()
+
+    def list_conversations(self, limit=50, before=None):
+        """
+        Диалоги от недавно обновлённых к старым: (id, title, created_at, updated_at, message_count).
+        before — курсор (updated_at, id) последней строки предыдущей страницы.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if before is None:
+            cursor.execute('''
+                SELECT id, title, created_at, updated_at, message_count
+                FROM conversations
+                ORDER BY updated_at DESC, id DESC
+                LIMIT ?
+            ''', (limit,))
+        else:
+            cursor.execute('''
+                SELECT id, title, created_at, updated_at, message_count
+                FROM conversations
+                WHERE (updated_at, id) < (?, ?)
+                ORDER BY updated_at DESC, id DESC
+                LIMIT ?
+            ''', (before[0], before[1], limit))
         return cursor.fetchall()
 
+    @staticmethod
+    def conversation_cursor(row):
+        return (row[3], row[0])
+
+    def rename_conversation(self, conversation_id, title):
+        self.writer.submit(
+            'UPDATE conversations SET title = ? WHERE id = ?', (title, conversation_id)
+        )
+        self.flush()
+
+    def delete_conversation(self, conversation_id):
+        """
+        Удаляет диалог вместе с его сообщениями и выжимками.
+        """
+        self.writer.submit('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
+        self.writer.submit(
+            'DELETE FROM context_summaries WHERE conversation_id = ?', (conversation_id,)
+        )
+        self.writer.submit('DELETE FROM conversations WHERE id = ?', (conversation_id,))
+        self.flush()
+
     def clear_history(self):
+        # Через ту же очередь, чтобы ещё не записанные сообщения не пережили очистку.
+        self.writer.submit('DELETE FROM messages')
+        self.writer.submit('DELETE FROM context_summaries')
+        self.writer.submit('DELETE FROM conversations')
+        self.flush()
+
+    def get_formatted_history(self):
+        return list(self.iter_formatted_history())
+
+    def iter_formatted_history(self, chunk_size=1000):
+        """
+        Вся история от старых к новым в виде словарей.
+        Читает порциями по chunk_size (keyset по (timestamp, id)),
+        поэтому потребление памяти не зависит от размера истории.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM messages')
-        conn.commit()
+        last = None
 
-    def get_formatted_history(self):
+        while True:
+            if last is None:
+                cursor.execute('''
+                    SELECT id, model, user_message, ai_response, timestamp, tokens_used
+                    FROM messages 
+                    ORDER BY timestamp ASC, id ASC
+                    LIMIT ?
+                ''', (chunk_size,))
+            else:
+                cursor.execute('''
+                    SELECT id, model, user_message, ai_response, timestamp, tokens_used
+                    FROM messages 
+                    WHERE (timestamp, id) > (?, ?)
+                    ORDER BY timestamp ASC, id ASC
+                    LIMIT ?
+                ''', (last[0], last[1], chunk_size))
+
+            rows = cursor.fetchall()
+            for row in rows:
+                yield {
+                    "id": row[0],
+                    "model": row[1],
+                    "user_message": row[2],
+                    "ai_response": row[3],
+                    "timestamp": row[4],
+                    "tokens_used": row[5]
+                }
+
+            if len(rows) < chunk_size:
+                return
+            last = (rows[-1][4], rows[-1][0])
+
+    def count_messages(self):
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT 
-                id,
-                model,
-                user_message,
-                ai_response,
-                timestamp,
-                tokens_used
-            FROM messages 
-            ORDER BY timestamp ASC
-        ''')
-        
-        history = []
-        for row in cursor.fetchall():
-            history.append({
+        cursor.execute('SELECT COUNT(*) FROM messages')
+        return cursor.fetchone()[0]
+
+    # ---------- Поиск ----------
+
+    def has_search_index(self):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        )
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def _fts_query(query):
+        """
+        Превращает пользовательский ввод в безопасный запрос FTS5:
+        каждое слово ищется как префикс, все слова должны встретиться.
+        """
+        terms = [term.replace('"', '') for term in query.split()]
+        return ' '.join(f'"{term}"*' for term in terms if term)
+
+    def search(self, query, limit=20, cursor=None):
+        """
+        Поиск по истории сообщений, результаты упорядочены по релевантности (bm25).
+        cursor — значение next_cursor из предыдущего вызова.
+        """
+        offset = cursor or 0
+        fts_query = self._fts_query(query)
+        if not fts_query:
+            return {"results": [], "next_cursor": None}
+
+        conn = self.get_connection()
+        db_cursor = conn.cursor()
+
+        if self.has_search_index():
+            db_cursor.execute('''
+                SELECT m.id, m.model, m.timestamp,
+                       snippet(messages_fts, 0, '[', ']', '…', 12),
+                       snippet(messages_fts, 1, '[', ']', '…', 12)
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE messages_fts MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            ''', (fts_query, limit + 1, offset))
+        else:
+            pattern = f"%{query.strip()}%"
+            db_cursor.execute('''
+                SELECT id, model, timestamp, substr(user_message, 1, 120), substr(ai_response, 1, 120)
+                FROM messages
+                WHERE user_message LIKE ? OR ai_response LIKE ?
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ? OFFSET ?
+            ''', (pattern, pattern, limit + 1, offset))
+
+        rows = db_cursor.fetchall()
+        results = [
+            {
                 "id": row[0],
                 "model": row[1],
-                "user_message": row[2],
-                "ai_response": row[3],
-                "timestamp": row[4],
-                "tokens_used": row[5]
-            })
-        return history
+                "timestamp": row[2],
+                "user_snippet": row[3],
+                "ai_snippet": row[4]
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = offset + limit if len(rows) > limit else None
+        return {"results": results, "next_cursor": next_cursor}
+
+    def get_search_backfill_progress(self):
+        """
+        Доля строк, существовавших до появления индекса, которые уже проиндексированы.
+        """
+        if not self.has_search_index():
+            return 1.0
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT last_id, target_id FROM fts_backfill WHERE id = 1')
+        row = cursor.fetchone()
+        if not row or row[1] == 0 or row[0] >= row[1]:
+            return 1.0
+        return row[0] / row[1]
+
+    def _backfill_search_chunk(self, cursor, chunk_size):
+        cursor.execute('SELECT last_id, target_id FROM fts_backfill WHERE id = 1')
+        row = cursor.fetchone()
+        if not row or row[0] >= row[1]:
+            return
+        last_id, target_id = row
+
+        cursor.execute('''
+            SELECT MAX(id) FROM (
+                SELECT id FROM messages
+                WHERE id > ? AND id <= ?
+                ORDER BY id
+                LIMIT ?
+            )
+        ''', (last_id, target_id, chunk_size))
+        chunk_end = cursor.fetchone()[0] or target_id
+
+        # Часть строк порции уже могла попасть в индекс (триггером или прерванной
+        # порцией), поэтому порция сначала очищается — повтор идемпотентен.
+        cursor.execute(
+            'DELETE FROM messages_fts WHERE rowid > ? AND rowid <= ?', (last_id, chunk_end)
+        )
+        cursor.execute('''
+            INSERT INTO messages_fts (rowid, user_message, ai_response)
+            SELECT id, user_message, ai_response FROM messages
+            WHERE id > ? AND id <= ?
+        ''', (last_id, chunk_end))
+        cursor.execute('UPDATE fts_backfill SET last_id = ? WHERE id = 1', (chunk_end,))
+
+    def start_search_backfill(self, chunk_size=2000, pause=0.05, max_failures=5,
+                              retry_delay=0.5):
+        """
+        Индексирует старую историю в фоне порциями по chunk_size строк,
+        каждая порция — отдельная короткая транзакция писателя.
+        После ошибки записи пауза удваивается начиная с retry_delay, а после
+        max_failures ошибок подряд индексация прекращается до следующего запуска.
+        """
+        if not self.has_search_index() or self.get_search_backfill_progress() >= 1.0:
+            return
+
+        def run():
+            failures = 0
+            while self.get_search_backfill_progress() < 1.0:
+                self.writer.submit_call(
+                    lambda cursor: self._backfill_search_chunk(cursor, chunk_size)
+                )
+                if self.flush():
+                    failures = 0
+                    time.sleep(pause)
+                    continue
+                failures += 1
+                if failures >= max_failures:
+                    return
+                time.sleep(min(30.0, retry_delay * 2 ** (failures - 1)))
+
+        threading.Thread(target=run, name="fts-backfill", daemon=True).start()
 
     # ---------- Аналитика ----------
 
-    def save_analytics(self, timestamp, model, message_length, response_time, tokens_used):
+    def save_analytics(self, timestamp, model, message_length, response_time, tokens_used,
+                       time_to_first_token=None, is_error=False, cost=None):
+        with tracer.span("cache.save_analytics"):
+            self.writer.submit('''
+                INSERT INTO analytics_messages 
+                (timestamp, model, message_length, response_time, tokens_used, time_to_first_token,
+                 is_error, cost)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (timestamp, model, message_length, response_time, tokens_used, time_to_first_token,
+                  int(bool(is_error)), cost))
+
+    def get_model_usage_summary(self):
+        """
+        Агрегаты по моделям: (model, count, tokens, response_time_sum, cost_sum).
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO analytics_messages 
-            (timestamp, model, message_length, response_time, tokens_used)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (timestamp, model, message_length, response_time, tokens_used))
-        conn.commit()
+            SELECT model, count, tokens, response_time, cost
+            FROM analytics_model_usage
+            WHERE count > 0
+        ''')
+        return cursor.fetchall()
+
+    def get_usage_rollups(self, granularity, since=None, until=None):
+        """
+        Корзины usage_rollups ('minute', 'hour' или 'day') по возрастанию времени:
+        список (bucket_start, messages, tokens, errors, latency_sum).
+        since/until — границы bucket_start в секундах эпохи.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT bucket_start, messages, tokens, errors, latency_sum
+            FROM usage_rollups
+            WHERE granularity = ? AND bucket_start >= ? AND bucket_start <= ?
+            ORDER BY bucket_start ASC
+        ''', (granularity, since if since is not None else 0,
+              until if until is not None else 2 ** 62))
+        return cursor.fetchall()
+
+    def get_latency_sketches(self):
+        """
+        Сохранённые скетчи задержек: список (model, metric, data).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT model, metric, data FROM latency_sketches')
+        return cursor.fetchall()
+
+    def save_latency_sketches(self, rows):
+        """
+        rows — список (model, metric, data); записывается через очередь писателя.
+        """
+        self.writer.submit_many(
+            'INSERT OR REPLACE INTO latency_sketches (model, metric, data) VALUES (?, ?, ?)',
+            rows
+        )
 
     def get_analytics_history(self):
+        return list(self.iter_analytics_history())
+
+    def iter_analytics_history(self, chunk_size=5000):
+        """
+        Записи аналитики от старых к новым: кортежи (timestamp, model, message_length,
+        response_time, tokens_used, time_to_first_token, is_error), читаемые порциями.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT timestamp, model, message_length, response_time, tokens_used
+            SELECT timestamp, model, message_length, response_time, tokens_used,
+                   time_to_first_token, is_error
             FROM analytics_messages
             ORDER BY timestamp ASC
         ''')
-        return cursor.fetchall()
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield from rows
+
+    # ---------- Трассировка ----------
+
+    def save_trace(self, trace, keep=1000):
+        """
+        Сохраняет трассу (Trace.to_dict()) и оставляет не больше keep последних.
+        """
+        self.writer.submit('''
+            INSERT INTO traces (name, started_at, duration, attrs, spans) VALUES (?, ?, ?, ?, ?)
+        ''', (
+            trace['name'],
+            trace['started_at'],
+            trace['duration'],
+            json.dumps(trace['attrs'], ensure_ascii=False, default=str),
+            json.dumps(trace['spans'], ensure_ascii=False, default=str)
+        ))
+        self.writer.submit(
+            'DELETE FROM traces WHERE id <= (SELECT MAX(id) FROM traces) - ?', (keep,)
+        )
+
+    def get_traces(self, limit=100):
+        """
+        Последние сохранённые трассы, от новых к старым.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT name, started_at, duration, attrs, spans
+            FROM traces
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (limit,))
+        return [
+            {
+                'name': name,
+                'started_at': started_at,
+                'duration': duration,
+                'attrs': json.loads(attrs),
+                'spans': json.loads(spans)
+            }
+            for name, started_at, duration, attrs, spans in cursor.fetchall()
+        ]
+
+    # ---------- Каталог моделей ----------
+
+    def save_model_catalog(self, models, etag=None, last_modified=None):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            INSERT OR REPLACE INTO model_catalog (id, models, etag, last_modified, fetched_at)
+            VALUES (1, ?, ?, ?, ?)
+            ''',
+            (json.dumps(models, ensure_ascii=False), etag, last_modified, time.time()),
+        )
+        conn.commit()
+
+    def touch_model_catalog(self):
+        """
+        Продлевает срок жизни каталога после ответа 304 Not Modified.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('UPDATE model_catalog SET fetched_at = ? WHERE id = 1', (time.time(),))
+        conn.commit()
+
+    def get_model_catalog(self):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT models, etag, last_modified, fetched_at FROM model_catalog WHERE id = 1'
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            "models": json.loads(row[0]),
+            "etag": row[1],
+            "last_modified": row[2],
+            "fetched_at": row[3],
+        }
+
+    # ---------- Кэш ответов ----------
+
+    def enable_response_cache(self, ttl=None, max_bytes=None, memory_entries=None):
+        """
+        Включает кэш ответов: LRU в памяти поверх таблицы response_cache.
+        """
+        self.response_cache_enabled = True
+        if ttl is not None:
+            self.response_cache_ttl = ttl
+        if max_bytes is not None:
+            self.response_cache_max_bytes = max_bytes
+        if memory_entries is not None:
+            self.response_cache_memory_entries = memory_entries
+
+    @staticmethod
+    def make_response_key(model, messages, params=None):
+        """
+        Ключ кэша: хэш модели, списка сообщений и параметров генерации.
+        """
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params or {}},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _remember_response(self, key, response, created_at):
+        with self._memory_lock:
+            self._memory_responses[key] = (response, created_at)
+            self._memory_responses.move_to_end(key)
+            while len(self._memory_responses) > self.response_cache_memory_entries:
+                self._memory_responses.popitem(last=False)
+
+    def get_cached_response(self, key):
+        if not self.response_cache_enabled:
+            return None
+
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory_responses.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.response_cache_ttl:
+                    self._memory_responses.move_to_end(key)
+                else:
+                    del self._memory_responses[key]
+                    entry = None
+
+        if entry is None:
+            with tracer.span("cache.lookup_db"):
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT response, created_at FROM response_cache WHERE key = ?', (key,)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                if now - row[1] > self.response_cache_ttl:
+                    self.writer.submit('DELETE FROM response_cache WHERE key = ?', (key,))
+                    return None
+                entry = (json.loads(row[0]), row[1])
+                self._remember_response(key, *entry)
+
+        self.writer.submit(
+            'UPDATE response_cache SET hits = hits + 1, last_accessed = ? WHERE key = ?',
+            (now, key),
+        )
+        return entry[0]
+
+    def save_cached_response(self, key, model, response):
+        if not self.response_cache_enabled or "error" in response:
+            return
+
+        with tracer.span("cache.serialize_response"):
+            data = json.dumps(response, ensure_ascii=False)
+        tokens_used = (response.get("usage") or {}).get("total_tokens", 0)
+        now = time.time()
+
+        def write(cursor):
+            cursor.execute(
+                '''
+                INSERT OR REPLACE INTO response_cache
+                (key, model, response, tokens_used, size, hits, created_at, last_accessed)
+                VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+                ''',
+                (key, model, data, tokens_used, len(data), now, now),
+            )
+            self._evict_responses(cursor, now)
+
+        self._remember_response(key, response, now)
+        self.writer.submit_call(write)
+
+    def _evict_responses(self, cursor, now):
+        """
+        Удаляет просроченные записи, затем самые давно использованные,
+        пока общий размер не уложится в response_cache_max_bytes.
+        """
+        cursor.execute(
+            'DELETE FROM response_cache WHERE created_at < ?',
+            (now - self.response_cache_ttl,),
+        )
+
+        cursor.execute('SELECT COALESCE(SUM(size), 0) FROM response_cache')
+        excess = cursor.fetchone()[0] - self.response_cache_max_bytes
+        if excess <= 0:
+            return
+
+        cursor.execute('SELECT key, size FROM response_cache ORDER BY last_accessed ASC')
+        evicted = []
+        for key, size in cursor.fetchall():
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+
+        cursor.executemany('DELETE FROM response_cache WHERE key = ?', evicted)
+        with self._memory_lock:
+            for (key,) in evicted:
+                self._memory_responses.pop(key, None)
+
+    def get_response_cache_stats(self):
+        self.flush()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0),
+                   COALESCE(SUM(hits * tokens_used), 0)
+            FROM response_cache
+        ''')
+        entries, size, hits, tokens_saved = cursor.fetchone()
+        return {
+            "entries": entries,
+            "size": size,
+            "hits": hits,
+            "tokens_saved": tokens_saved,
+        }
+
+    def clear_response_cache(self):
+        with self._memory_lock:
+            self._memory_responses.clear()
+        self.writer.submit('DELETE FROM response_cache')
+        self.flush()
 
     # ---------- Авторизация ----------
 
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import os
+import threading
+
+# Служебные токены на одно сообщение (роль, разделители).
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Контекст модели, если каталог не сообщает context_length.
+DEFAULT_CONTEXT_LENGTH = 8192
+
+# Заголовок системного сообщения с выжимкой вытесненной истории.
+SUMMARY_HEADER = "Краткое содержание более ранней части диалога:"
+
+# Префикс сохранённых ответов с ошибкой — такие пары в контекст не попадают.
+ERROR_PREFIX = "Ошибка:"
+
+
+def estimate_tokens(text: str | None) -> int:
+    """
+    Быстрая локальная оценка числа токенов без токенизатора.
+
+    BPE-токенизаторы дают в среднем ~4 байта UTF-8 на токен: для латиницы
+    это ~4 символа, для кириллицы (2 байта на символ) — ~2 символа.
+    """
+    if not text:
+        return 0
+    return (len(text.encode('utf-8')) + 3) // 4
+
+
+def message_tokens(text: str | None) -> int:
+    return estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+def extractive_summary(previous: str | None, rows: list, max_chars: int = 160) -> str:
+    """
+    Локальная выжимка вытесненных реплик: начало каждого вопроса и ответа.
+    previous — выжимка более ранней части, к которой дописываются rows.
+    """
+    def clip(text):
+        text = " ".join((text or "").split())
+        return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+    lines = previous.split("\n") if previous else []
+    for row in rows:
+        lines.append(f"- Пользователь: {clip(row[2])} / Ассистент: {clip(row[3])}")
+    return "\n".join(lines)
+
+
+class ContextWindow:
+    """
+    Сборка многоходового контекста под бюджет токенов модели.
+
+    Предыдущие реплики читаются из ChatCache от новых к старым (keyset-страницы),
+    пока не исчерпан бюджет; всё, что не поместилось, вытесняется целиком,
+    начиная со старых. Оценки токенов запоминаются по id сообщения, поэтому
+    каждая строка истории токенизируется один раз за время работы.
+
+    Если задан summarizer, вытесненная часть заменяется выжимкой. Выжимки
+    хранятся в SQLite по id последнего охваченного сообщения и достраиваются
+    инкрементально: при сдвиге границы обрабатываются только новые строки.
+    """
+
+    PAGE_SIZE = 50
+
+    def __init__(self, cache, max_tokens: int = 4000, response_reserve: float = 0.25,
+                 summarizer=None, summary_share: float = 0.2):
+        self.cache = cache
+        self.max_tokens = max_tokens
+        self.response_reserve = response_reserve
+        self.summarizer = summarizer
+        self.summary_share = summary_share
+
+        self.context_lengths = {}
+        self._token_counts = {}
+        # Оценка размера истории по диалогам: считается один раз, затем ведётся по record_turn().
+        self._history_tokens = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'prompt_tokens': 0,
+            'saved_tokens': 0,
+            'evicted_requests': 0,
+            'summaries_built': 0,
+            'summary_hits': 0
+        }
+
+    @classmethod
+    def from_env(cls, cache) -> 'ContextWindow':
+        """
+        CONTEXT_MAX_TOKENS — верхняя граница промпта, CONTEXT_SUMMARIES=1 включает выжимки.
+        """
+        return cls(
+            cache,
+            max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "4000")),
+            summarizer=extractive_summary if os.getenv("CONTEXT_SUMMARIES", "0") == "1" else None
+        )
+
+    def update_models(self, models: list):
+        """
+        Запоминает context_length моделей из каталога.
+        """
+        self.context_lengths = {
+            model["id"]: model["context_length"]
+            for model in models
+            if model.get("context_length")
+        }
+
+    def budget_for(self, model: str) -> int:
+        """
+        Бюджет промпта: часть окна модели (остальное — под ответ), не больше max_tokens.
+        """
+        context_length = self.context_lengths.get(model, DEFAULT_CONTEXT_LENGTH)
+        return min(self.max_tokens, int(context_length * (1 - self.response_reserve)))
+
+    def _row_tokens(self, row) -> int:
+        tokens = self._token_counts.get(row[0])
+        if tokens is None:
+            tokens = message_tokens(row[2]) + message_tokens(row[3])
+            self._token_counts[row[0]] = tokens
+        return tokens
+
+    def forget(self):
+        """
+        Сбрасывает запомненные оценки (после очистки истории).
+        """
+        with self._lock:
+            self._token_counts.clear()
+            self._history_tokens.clear()
+
+    def record_turn(self, user_message: str, ai_response: str, conversation_id: int | None = None):
+        """
+        Учитывает сохранённую пару реплик в оценке размера истории диалога.
+        """
+        if conversation_id in self._history_tokens and not (ai_response or "").startswith(ERROR_PREFIX):
+            self._history_tokens[conversation_id] += message_tokens(user_message) + message_tokens(ai_response)
+
+    def history_tokens(self, conversation_id: int | None = None) -> int:
+        """
+        Сколько токенов заняла бы вся история диалога без бюджета (оценка).
+        """
+        if conversation_id not in self._history_tokens:
+            total_bytes, rows = self.cache.get_history_size(
+                exclude_prefix=ERROR_PREFIX, conversation_id=conversation_id
+            )
+            self._history_tokens[conversation_id] = (
+                (total_bytes + 3) // 4 + 2 * rows * MESSAGE_OVERHEAD_TOKENS
+            )
+        return self._history_tokens[conversation_id]
+
+    def build(self, model: str, user_message: str,
+              conversation_id: int | None = None) -> tuple[list, dict]:
+        """
+        Возвращает (messages, info): список сообщений для API, заканчивающийся
+        user_message, и сведения о бюджете — prompt_tokens, turns, evicted и т.д.
+        Реплики берутся только из диалога conversation_id (если он задан).
+        """
+        # Предыдущая пара реплик могла ещё стоять в очереди записи.
+        self.cache.flush()
+
+        budget = self.budget_for(model)
+        used = message_tokens(user_message)
+        summary_budget = int(budget * self.summary_share) if self.summarizer else 0
+
+        kept = []
+        boundary = None
+        before = None
+
+        with self._lock:
+            while boundary is None:
+                rows = self.cache.get_chat_history_page(
+                    limit=self.PAGE_SIZE, before=before, conversation_id=conversation_id
+                )
+                for row in rows:
+                    if (row[3] or "").startswith(ERROR_PREFIX):
+                        continue
+                    tokens = self._row_tokens(row)
+                    if used + tokens > budget - summary_budget:
+                        boundary = row
+                        break
+                    used += tokens
+                    kept.append(row)
+                if len(rows) < self.PAGE_SIZE:
+                    break
+                before = self.cache.history_cursor(rows[-1])
+
+        messages = []
+        summary_tokens = 0
+        if boundary is not None and self.summarizer:
+            summary = self._fit_summary(
+                self._summary_upto(boundary[0], conversation_id) or "", summary_budget
+            )
+            if summary:
+                content = f"{SUMMARY_HEADER}\n{summary}"
+                summary_tokens = message_tokens(content)
+                messages.append({"role": "system", "content": content})
+
+        for row in reversed(kept):
+            messages.append({"role": "user", "content": row[2]})
+            messages.append({"role": "assistant", "content": row[3]})
+        messages.append({"role": "user", "content": user_message})
+
+        # Без бюджета в запрос ушла бы вся история и новое сообщение.
+        if boundary is not None:
+            full_tokens = self.history_tokens(conversation_id) + message_tokens(user_message)
+        else:
+            full_tokens = used
+
+        info = {
+            'budget': budget,
+            'prompt_tokens': used + summary_tokens,
+            'full_tokens': full_tokens,
+            'turns': len(kept),
+            'evicted': boundary is not None,
+            'summary_tokens': summary_tokens
+        }
+
+        self.stats['requests'] += 1
+        self.stats['prompt_tokens'] += info['prompt_tokens']
+        self.stats['saved_tokens'] += max(0, full_tokens - info['prompt_tokens'])
+        if boundary is not None:
+            self.stats['evicted_requests'] += 1
+        return messages, info
+
+    def _summary_upto(self, upto_id: int, conversation_id: int | None = None) -> str | None:
+        """
+        Выжимка всех сообщений с id <= upto_id: готовая из кэша или
+        достроенная из ближайшей предыдущей и новых строк.
+        """
+        previous = self.cache.get_context_summary(upto_id, conversation_id)
+        if previous and previous[0] == upto_id:
+            self.stats['summary_hits'] += 1
+            return previous[1]
+
+        after_id = previous[0] if previous else 0
+        rows = [
+            row for row in self.cache.get_messages_range(after_id, upto_id, conversation_id)
+            if not (row[3] or "").startswith(ERROR_PREFIX)
+        ]
+        summary = self.summarizer(previous[1] if previous else None, rows)
+        # Хранимая выжимка ограничена наибольшим возможным бюджетом, чтобы не расти с историей.
+        summary = self._fit_summary(summary, int(self.max_tokens * self.summary_share))
+        self.cache.save_context_summary(upto_id, summary, conversation_id)
+        self.stats['summaries_built'] += 1
+        return summary
+
+    @staticmethod
+    def _fit_summary(summary: str, budget: int) -> str:
+        """
+        Обрезает выжимку под бюджет, отбрасывая самые старые строки.
+        """
+        kept = []
+        used = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(SUMMARY_HEADER)
+        for line in reversed(summary.split("\n")):
+            tokens = estimate_tokens(line) + 1
+            if used + tokens > budget:
+                break
+            kept.append(line)
+            used += tokens
+        return "\n".join(reversed(kept))
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats['avg_prompt_tokens'] = (
+            stats['prompt_tokens'] / stats['requests'] if stats['requests'] else 0
+        )
+        return stats
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+
+
+class _FlushRequest:
+    """
+    Метка flush в очереди: поток-писатель сообщает через неё число ошибок.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.failed = 0
+
+
+class DatabaseWriter:
+    """
+    Фоновый поток записи в SQLite (write-behind).
+
+    Вызовы submit() только кладут операцию в очередь; поток-писатель
+    забирает всё накопившееся и выполняет одной транзакцией, поэтому
+    fsync оплачивается один раз на пачку, а не на каждую строку.
+    База переводится в режим WAL, чтобы чтение не ждало запись.
+
+    Очередь сбрасывается при flush(), close() и при выходе из процесса.
+    Всё, что подтверждено flush() (результат True), гарантированно
+    закоммичено; операции, ещё лежащие в очереди при аварийном завершении,
+    теряются, но сама база остаётся согласованной (каждая пачка — атомарная
+    транзакция).
+    """
+
+    def __init__(self, db_name: str, batch_size: int = 200):
+        self.db_name = db_name
+        self.batch_size = batch_size
+
+        self._queue = queue.Queue()
+        self._closed = False
+        # Операции, упавшие после последней обработанной метки flush.
+        self._failed_since_flush = 0
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'batches': 0,
+            'operations': 0,
+            'errors': 0,
+            'last_commit_latency': 0.0,
+            'max_commit_latency': 0.0,
+            'total_commit_latency': 0.0,
+            'last_error': None
+        }
+
+        # Режим WAL хранится в самой базе. Он включается синхронно, до запуска
+        # потока: смена режима при чужой открытой записи сразу падает с
+        # "database is locked" (без busy_timeout) и остановила бы писателя.
+        conn = sqlite3.connect(self.db_name)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+        finally:
+            conn.close()
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name="sqlite-writer",
+            daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---------- Публичный API ----------
+
+    def submit(self, sql: str, params=()):
+        """
+        Ставит в очередь один SQL-запрос.
+        """
+        self._put(('sql', sql, params))
+
+    def submit_many(self, sql: str, seq_of_params):
+        self._put(('many', sql, list(seq_of_params)))
+
+    def submit_call(self, func):
+        """
+        Ставит в очередь функцию func(cursor), выполняемую внутри транзакции писателя.
+        """
+        self._put(('call', func, None))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Ждёт, пока всё, что было поставлено в очередь до вызова, будет закоммичено.
+
+        False — запись не подтверждена: истёк timeout, поток-писатель
+        остановился или какая-то операция после предыдущего flush() завершилась
+        ошибкой (текст последней — в get_stats()['last_error']).
+        """
+        if self._closed:
+            return True
+        if not self._thread.is_alive():
+            return False
+        request = _FlushRequest()
+        self._queue.put(('flush', request, None))
+        if not request.done.wait(timeout):
+            return False
+        return request.failed == 0
+
+    def close(self, timeout: float | None = 10.0):
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        self._queue.put(('stop', None, None))
+        self._thread.join(timeout)
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_commit_latency'] = (
+            stats['total_commit_latency'] / stats['batches'] if stats['batches'] else 0.0
+        )
+        return stats
+
+    # ---------- Поток-писатель ----------
+
+    def _put(self, item):
+        if self._closed:
+            raise RuntimeError("DatabaseWriter is closed")
+        self._queue.put(item)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, isolation_level=None)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                operations = [item for item in batch if item[0] in ('sql', 'many', 'call')]
+                if operations:
+                    self._failed_since_flush += self._commit(conn, operations)
+
+                stop = False
+                flushed = False
+                for kind, payload, _ in batch:
+                    if kind == 'flush':
+                        payload.failed = self._failed_since_flush
+                        payload.done.set()
+                        flushed = True
+                    elif kind == 'stop':
+                        stop = True
+                if flushed:
+                    self._failed_since_flush = 0
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit(self, conn, operations) -> int:
+        """
+        Выполняет пачку одной транзакцией; возвращает число упавших операций.
+        """
+        start = time.perf_counter()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for operation in operations:
+                self._execute(cursor, operation)
+            cursor.execute('COMMIT')
+            failed = 0
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            # Одна некорректная операция не должна терять всю пачку:
+            # повторяем по одной, пропуская только упавшие.
+            failed = self._commit_individually(conn, cursor, operations)
+
+        latency = time.perf_counter() - start
+        with self._stats_lock:
+            self.stats['batches'] += 1
+            self.stats['operations'] += len(operations) - failed
+            self.stats['errors'] += failed
+            self.stats['last_commit_latency'] = latency
+            self.stats['max_commit_latency'] = max(self.stats['max_commit_latency'], latency)
+            self.stats['total_commit_latency'] += latency
+        return failed
+
+    def _commit_individually(self, conn, cursor, operations) -> int:
+        failed = 0
+        for operation in operations:
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                self._execute(cursor, operation)
+                cursor.execute('COMMIT')
+            except Exception as e:
+                if conn.in_transaction:
+                    cursor.execute('ROLLBACK')
+                failed += 1
+                with self._stats_lock:
+                    self.stats['last_error'] = str(e)
+        return failed
+
+    @staticmethod
+    def _execute(cursor, operation):
+        kind, payload, params = operation
+        if kind == 'sql':
+            cursor.execute(payload, params)
+        elif kind == 'many':
+            cursor.executemany(payload, params)
+        else:
+            payload(cursor)
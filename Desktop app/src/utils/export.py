@@ -0,0 +1,91 @@
+import functools
+import gzip
+import json
+import os
+
+
+class ExportCancelled(Exception):
+    """
+    Экспорт был отменён пользователем.
+    """
+
+
+class HistoryExporter:
+    """
+    Потоковый экспорт истории чата в JSON или NDJSON (опционально gzip).
+
+    Записи читаются из ChatCache.iter_formatted_history порциями и сразу
+    пишутся в файл, поэтому память не растёт вместе с историей. Экспорт
+    выполняется в вызывающем потоке — из UI его запускают в executor'е.
+    Файл пишется во временный *.part и переименовывается только после
+    успешного завершения.
+    """
+
+    FORMATS = ('json', 'ndjson')
+
+    def __init__(self, cache, chunk_size: int = 1000):
+        self.cache = cache
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def file_extension(fmt: str, compress: bool) -> str:
+        return f".{fmt}.gz" if compress else f".{fmt}"
+
+    def export(self, path: str, fmt: str = 'ndjson', compress: bool = False,
+               progress=None, cancel_event=None) -> int:
+        """
+        Записывает историю в path и возвращает число записей.
+
+        progress(written, total) вызывается после каждой порции;
+        установленный cancel_event прерывает экспорт с ExportCancelled.
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+
+        # Сообщения, ещё стоящие в очереди записи, тоже должны попасть в файл.
+        if not self.cache.flush():
+            raise RuntimeError(
+                f"History writes were not committed: {self.cache.get_write_stats()['last_error']}"
+            )
+        total = self.cache.count_messages()
+
+        tmp_path = f"{path}.part"
+        # Уровень 6 заметно быстрее максимального при почти том же размере.
+        opener = functools.partial(gzip.open, compresslevel=6) if compress else open
+        written = 0
+
+        try:
+            with opener(tmp_path, 'wt', encoding='utf-8') as f:
+                if fmt == 'json':
+                    f.write('[')
+
+                for record in self.cache.iter_formatted_history(self.chunk_size):
+                    if fmt == 'json':
+                        f.write(',\n  ' if written else '\n  ')
+                        f.write(
+                            json.dumps(record, ensure_ascii=False, indent=2, default=str)
+                            .replace('\n', '\n  ')
+                        )
+                    else:
+                        f.write(json.dumps(record, ensure_ascii=False, default=str))
+                        f.write('\n')
+
+                    written += 1
+                    if written % self.chunk_size == 0:
+                        if cancel_event is not None and cancel_event.is_set():
+                            raise ExportCancelled()
+                        if progress:
+                            progress(written, total)
+
+                if fmt == 'json':
+                    f.write('\n]\n' if written else ']\n')
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if progress:
+            progress(written, max(total, written))
+        return written
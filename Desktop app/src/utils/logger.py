@@ -1,59 +1,159 @@
+from __future__ import annotations
+
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 from datetime import datetime
 
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который откладывает форматирование на поток-слушатель.
+
+    Аргументы подставляются в сообщение сразу, при вызове: среди них бывают
+    изменяемые объекты (словари статистики), и к моменту записи они уже
+    могли измениться. Дата, уровень и traceback оформляются форматтером
+    в потоке-слушателе.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 class AppLogger:
     """
     Класс для логирования работы приложения.
+
+    Экземпляры кэшируются по имени модуля (AppLogger() — общий логгер
+    приложения, AppLogger("api") — дочерний 'ChatApp.api'), а обработчики
+    настраиваются один раз. Вызовы только кладут запись в очередь: запись
+    в файл с ротацией и в консоль выполняет фоновый QueueListener.
+
+    Переменные окружения:
+    LOG_LEVEL — общий уровень (по умолчанию DEBUG);
+    LOG_LEVELS — уровни модулей, например "api=WARNING,cache=INFO";
+    LOG_ROTATION — "size" (по умолчанию, LOG_MAX_BYTES/LOG_BACKUP_COUNT) или "midnight".
     """
-    
-    def __init__(self):
-        self.logs_dir = "logs"
-        if not os.path.exists(self.logs_dir):
-            os.makedirs(self.logs_dir)
-            
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        log_file = os.path.join(self.logs_dir, f"chat_app_{current_date}.log")
-        
+
+    ROOT_NAME = 'ChatApp'
+
+    _instances = {}
+    _lock = threading.Lock()
+    _listener = None
+
+    def __new__(cls, name: str | None = None):
+        with cls._lock:
+            instance = cls._instances.get(name)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance._setup(name)
+                cls._instances[name] = instance
+            return instance
+
+    def _setup(self, name: str | None):
+        root = logging.getLogger(self.ROOT_NAME)
+        if AppLogger._listener is None:
+            self._configure_root(root)
+
+        self.logger = root if name is None else root.getChild(name)
+        if name is not None:
+            level = self._module_levels().get(name)
+            if level:
+                self.logger.setLevel(level)
+
+    @staticmethod
+    def _module_levels() -> dict:
+        levels = {}
+        for item in os.getenv("LOG_LEVELS", "").split(","):
+            module, _, level = item.partition("=")
+            if module.strip() and level.strip():
+                levels[module.strip()] = level.strip().upper()
+        return levels
+
+    @classmethod
+    def _configure_root(cls, root: logging.Logger):
+        logs_dir = "logs"
+        os.makedirs(logs_dir, exist_ok=True)
+
         formatter = logging.Formatter(
-            '%(asctime)s - %(levelname)s - %(message)s',
+            '%(asctime)s - %(levelname)s - %(name)s - %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
         )
-        
-        file_handler = logging.FileHandler(
-            log_file,
-            encoding='utf-8'
-        )
+
+        if os.getenv("LOG_ROTATION", "size") == "midnight":
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                os.path.join(logs_dir, "chat_app.log"),
+                when='midnight',
+                backupCount=int(os.getenv("LOG_BACKUP_COUNT", "14")),
+                encoding='utf-8'
+            )
+        else:
+            current_date = datetime.now().strftime("%Y-%m-%d")
+            file_handler = logging.handlers.RotatingFileHandler(
+                os.path.join(logs_dir, f"chat_app_{current_date}.log"),
+                maxBytes=int(os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024))),
+                backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+                encoding='utf-8'
+            )
         file_handler.setFormatter(formatter)
-        
+
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(formatter)
-        
-        self.logger = logging.getLogger('ChatApp')
-        self.logger.setLevel(logging.DEBUG)
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
-    
-    def info(self, message: str):
+
+        # Обработчики от прежних конфигураций (например, после перезагрузки модуля)
+        # снимаются, чтобы каждая запись попадала в вывод ровно один раз.
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+
+        log_queue = queue.SimpleQueue()
+        root.addHandler(_DeferredQueueHandler(log_queue))
+        root.setLevel(os.getenv("LOG_LEVEL", "DEBUG").upper())
+        root.propagate = False
+
+        cls._listener = logging.handlers.QueueListener(
+            log_queue, file_handler, console_handler, respect_handler_level=True
+        )
+        cls._listener.start()
+        atexit.register(cls.shutdown)
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Дописывает оставшиеся в очереди записи и останавливает фоновый поток.
+        """
+        with cls._lock:
+            listener, cls._listener = cls._listener, None
+        if listener is not None:
+            listener.stop()
+
+    def set_level(self, level):
+        self.logger.setLevel(level)
+
+    def info(self, message: str, *args):
         """
         Логирование информационного сообщения.
         """
-        self.logger.info(message)
-    
-    def error(self, message: str, exc_info=None):
+        self.logger.info(message, *args)
+
+    def error(self, message: str, *args, exc_info=None):
         """
         Логирование ошибки.
         """
-        self.logger.error(message, exc_info=exc_info)
-    
-    def debug(self, message: str):
+        self.logger.error(message, *args, exc_info=exc_info)
+
+    def debug(self, message: str, *args):
         """
         Логирование отладочной информации.
         """
-        self.logger.debug(message)
-    
-    def warning(self, message: str):
+        self.logger.debug(message, *args)
+
+    def warning(self, message: str, *args):
         """
         Логирование предупреждения.
         """
-        self.logger.warning(message)
+        self.logger.warning(message, *args)
@@ -0,0 +1,582 @@
+import sqlite3
+import time
+from datetime import datetime
+from utils.rollups import GRANULARITIES
+from utils.sketch import QuantileSketch, latency_samples
+
+
+def _ensure_column(cursor, table, column, column_type):
+    cursor.execute(f'PRAGMA table_info({table})')
+    columns = {row[1] for row in cursor.fetchall()}
+    if column not in columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+
+def _table_exists(cursor, table):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,))
+    return cursor.fetchone() is not None
+
+
+def _base_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model TEXT,
+            user_message TEXT,
+            ai_response TEXT,
+            timestamp DATETIME,
+            tokens_used INTEGER
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME,
+            model TEXT,
+            message_length INTEGER,
+            response_time FLOAT,
+            tokens_used INTEGER
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS auth (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            api_key TEXT NOT NULL,
+            pin TEXT NOT NULL
+        )
+    ''')
+
+
+def _time_to_first_token(cursor):
+    _ensure_column(cursor, 'analytics_messages', 'time_to_first_token', 'FLOAT')
+
+
+def _model_catalog(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS model_catalog (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            models TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL
+        )
+    ''')
+
+
+def _response_cache(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT NOT NULL,
+            tokens_used INTEGER,
+            size INTEGER NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_accessed REAL NOT NULL
+        )
+    ''')
+
+
+def _history_indexes(cursor):
+    # (timestamp, id) покрывает ORDER BY timestamp и keyset-пагинацию истории.
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp, id)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_messages_model ON messages (model)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_analytics_timestamp ON analytics_messages (timestamp)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_analytics_model ON analytics_messages (model)'
+    )
+
+
+def _messages_fts(cursor):
+    # Полнотекстовый индекс хранит собственную копию текста (rowid = messages.id),
+    # поэтому удаление ещё не проиндексированной строки безопасно.
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                user_message,
+                ai_response,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        # Сборка SQLite без FTS5: поиск работает через LIKE.
+        return
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, user_message, ai_response)
+            VALUES (new.id, new.user_message, new.ai_response);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            DELETE FROM messages_fts WHERE rowid = old.id;
+        END
+    ''')
+    # Только изменения текста: UPDATE служебных колонок (например,
+    # conversation_id в миграции 12) не должен индексировать историю синхронно.
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update
+        AFTER UPDATE OF user_message, ai_response ON messages BEGIN
+            DELETE FROM messages_fts WHERE rowid = old.id;
+            INSERT INTO messages_fts (rowid, user_message, ai_response)
+            VALUES (new.id, new.user_message, new.ai_response);
+        END
+    ''')
+
+    # Строки, существовавшие до миграции, индексируются в фоне порциями
+    # (ChatCache.start_search_backfill); новые попадают в индекс через триггеры.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fts_backfill (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_id INTEGER NOT NULL,
+            target_id INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO fts_backfill (id, last_id, target_id)
+        SELECT 1, 0, COALESCE(MAX(id), 0) FROM messages
+    ''')
+
+
+def _analytics_model_rollup(cursor):
+    # Агрегаты по моделям поддерживаются триггерами при вставке, поэтому
+    # запуск Analytics читает одну строку на модель, а не всю историю.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_model_usage (
+            model TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            response_time FLOAT NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('DELETE FROM analytics_model_usage')
+    cursor.execute('''
+        INSERT INTO analytics_model_usage (model, count, tokens, response_time)
+        SELECT model, COUNT(*), COALESCE(SUM(tokens_used), 0), COALESCE(SUM(response_time), 0)
+        FROM analytics_messages
+        GROUP BY model
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS analytics_model_usage_insert
+        AFTER INSERT ON analytics_messages BEGIN
+            INSERT INTO analytics_model_usage (model, count, tokens, response_time)
+            VALUES (new.model, 1, COALESCE(new.tokens_used, 0), COALESCE(new.response_time, 0))
+            ON CONFLICT (model) DO UPDATE SET
+                count = count + 1,
+                tokens = tokens + excluded.tokens,
+                response_time = response_time + excluded.response_time;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS analytics_model_usage_delete
+        AFTER DELETE ON analytics_messages BEGIN
+            UPDATE analytics_model_usage SET
+                count = count - 1,
+                tokens = tokens - COALESCE(old.tokens_used, 0),
+                response_time = response_time - COALESCE(old.response_time, 0)
+            WHERE model IS old.model;
+        END
+    ''')
+
+
+def _latency_sketches(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS latency_sketches (
+            model TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (model, metric)
+        )
+    ''')
+
+    # Однократное построение скетчей по уже накопленной аналитике.
+    sketches = {}
+    cursor.execute('''
+        SELECT model, response_time, tokens_used, time_to_first_token
+        FROM analytics_messages
+    ''')
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        for model, response_time, tokens_used, time_to_first_token in rows:
+            if response_time is None:
+                continue
+            samples = latency_samples(response_time, tokens_used, time_to_first_token)
+            for metric, value in samples.items():
+                sketches.setdefault((model, metric), QuantileSketch()).add(value)
+
+    cursor.executemany(
+        'INSERT OR REPLACE INTO latency_sketches (model, metric, data) VALUES (?, ?, ?)',
+        [(model, metric, sketch.to_json()) for (model, metric), sketch in sketches.items()]
+    )
+
+
+def _usage_rollups(cursor):
+    _ensure_column(cursor, 'analytics_messages', 'is_error', 'INTEGER NOT NULL DEFAULT 0')
+
+    # Поминутные/почасовые/суточные корзины; bucket_start — секунды эпохи
+    # локального времени (как в ChatCache.save_analytics), кратные размеру корзины.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usage_rollups (
+            granularity TEXT NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            messages INTEGER NOT NULL DEFAULT 0,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0,
+            latency_sum FLOAT NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket_start)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('DELETE FROM usage_rollups')
+
+    for granularity, size in GRANULARITIES.items():
+        bucket = f"CAST(strftime('%s', substr(timestamp, 1, 19)) AS INTEGER) / {size} * {size}"
+        cursor.execute(f'''
+            INSERT INTO usage_rollups (granularity, bucket_start, messages, tokens, errors, latency_sum)
+            SELECT '{granularity}', {bucket}, COUNT(*), COALESCE(SUM(tokens_used), 0),
+                   SUM(is_error), COALESCE(SUM(response_time), 0)
+            FROM analytics_messages
+            WHERE timestamp IS NOT NULL
+            GROUP BY 2
+        ''')
+
+        new_bucket = bucket.replace('timestamp', 'new.timestamp')
+        old_bucket = bucket.replace('timestamp', 'old.timestamp')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS usage_rollups_{granularity}_insert
+            AFTER INSERT ON analytics_messages WHEN new.timestamp IS NOT NULL BEGIN
+                INSERT INTO usage_rollups (granularity, bucket_start, messages, tokens, errors, latency_sum)
+                VALUES ('{granularity}', {new_bucket}, 1, COALESCE(new.tokens_used, 0),
+                        new.is_error, COALESCE(new.response_time, 0))
+                ON CONFLICT (granularity, bucket_start) DO UPDATE SET
+                    messages = messages + 1,
+                    tokens = tokens + excluded.tokens,
+                    errors = errors + excluded.errors,
+                    latency_sum = latency_sum + excluded.latency_sum;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS usage_rollups_{granularity}_delete
+            AFTER DELETE ON analytics_messages WHEN old.timestamp IS NOT NULL BEGIN
+                UPDATE usage_rollups SET
+                    messages = messages - 1,
+                    tokens = tokens - COALESCE(old.tokens_used, 0),
+                    errors = errors - old.is_error,
+                    latency_sum = latency_sum - COALESCE(old.response_time, 0)
+                WHERE granularity = '{granularity}' AND bucket_start = {old_bucket};
+            END
+        ''')
+
+
+def _traces(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS traces (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            started_at DATETIME NOT NULL,
+            duration FLOAT,
+            attrs TEXT,
+            spans TEXT NOT NULL
+        )
+    ''')
+
+
+def _context_summaries(cursor):
+    # Выжимки вытесненной из контекста истории: upto_id — последний охваченный messages.id.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS context_summaries (
+            upto_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+
+
+def _conversations(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations (updated_at, id)'
+    )
+
+    _ensure_column(cursor, 'messages', 'conversation_id', 'INTEGER')
+    _ensure_column(cursor, 'context_summaries', 'conversation_id', 'INTEGER')
+
+    # Накопленная до миграции история становится одним диалогом. Базы, где
+    # миграция 6 создала триггер на любой UPDATE, сначала получают узкий
+    # триггер, иначе заполнение conversation_id проиндексирует всю историю
+    # до открытия окна.
+    _narrow_fts_update_trigger(cursor)
+    cursor.execute('SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM messages')
+    count, first, last = cursor.fetchone()
+    if count:
+        cursor.execute(
+            'INSERT INTO conversations (title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?)',
+            ('Основной чат', first, last, count)
+        )
+        conversation_id = cursor.lastrowid
+        cursor.execute(
+            'UPDATE messages SET conversation_id = ? WHERE conversation_id IS NULL', (conversation_id,)
+        )
+        cursor.execute(
+            'UPDATE context_summaries SET conversation_id = ? WHERE conversation_id IS NULL',
+            (conversation_id,)
+        )
+
+    # Страница диалога читается по индексу только из его строк.
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation
+        ON messages (conversation_id, timestamp, id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_context_summaries_conversation
+        ON context_summaries (conversation_id, upto_id)
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS conversations_message_insert
+        AFTER INSERT ON messages WHEN new.conversation_id IS NOT NULL BEGIN
+            UPDATE conversations SET
+                message_count = message_count + 1,
+                updated_at = new.timestamp
+            WHERE id = new.conversation_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS conversations_message_delete
+        AFTER DELETE ON messages WHEN old.conversation_id IS NOT NULL BEGIN
+            UPDATE conversations SET message_count = message_count - 1
+            WHERE id = old.conversation_id;
+        END
+    ''')
+
+
+def _analytics_cost(cursor):
+    # Оценка стоимости запроса (USD) по ценам каталога; NULL — цена неизвестна.
+    _ensure_column(cursor, 'analytics_messages', 'cost', 'REAL')
+    _ensure_column(cursor, 'analytics_model_usage', 'cost', 'REAL NOT NULL DEFAULT 0')
+
+    cursor.execute('DROP TRIGGER IF EXISTS analytics_model_usage_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS analytics_model_usage_delete')
+    cursor.execute('''
+        CREATE TRIGGER analytics_model_usage_insert
+        AFTER INSERT ON analytics_messages BEGIN
+            INSERT INTO analytics_model_usage (model, count, tokens, response_time, cost)
+            VALUES (new.model, 1, COALESCE(new.tokens_used, 0), COALESCE(new.response_time, 0),
+                    COALESCE(new.cost, 0))
+            ON CONFLICT (model) DO UPDATE SET
+                count = count + 1,
+                tokens = tokens + excluded.tokens,
+                response_time = response_time + excluded.response_time,
+                cost = cost + excluded.cost;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER analytics_model_usage_delete
+        AFTER DELETE ON analytics_messages BEGIN
+            UPDATE analytics_model_usage SET
+                count = count - 1,
+                tokens = tokens - COALESCE(old.tokens_used, 0),
+                response_time = response_time - COALESCE(old.response_time, 0),
+                cost = cost - COALESCE(old.cost, 0)
+            WHERE model IS old.model;
+        END
+    ''')
+
+
+def _analytics_model_usage_not_null(cursor):
+    # В PRIMARY KEY не-INTEGER столбца SQLite допускает NULL, и ON CONFLICT (model)
+    # не срабатывал для записей без модели: каждая добавляла новую строку.
+    # Таблица пересобирается по analytics_messages, NULL хранится как ''.
+    cursor.execute('DROP TRIGGER IF EXISTS analytics_model_usage_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS analytics_model_usage_delete')
+    cursor.execute('DROP TABLE IF EXISTS analytics_model_usage')
+    cursor.execute('''
+        CREATE TABLE analytics_model_usage (
+            model TEXT NOT NULL PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            response_time FLOAT NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO analytics_model_usage (model, count, tokens, response_time, cost)
+        SELECT COALESCE(model, ''), COUNT(*), COALESCE(SUM(tokens_used), 0),
+               COALESCE(SUM(response_time), 0), COALESCE(SUM(cost), 0)
+        FROM analytics_messages
+        GROUP BY COALESCE(model, '')
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER analytics_model_usage_insert
+        AFTER INSERT ON analytics_messages BEGIN
+            INSERT INTO analytics_model_usage (model, count, tokens, response_time, cost)
+            VALUES (COALESCE(new.model, ''), 1, COALESCE(new.tokens_used, 0),
+                    COALESCE(new.response_time, 0), COALESCE(new.cost, 0))
+            ON CONFLICT (model) DO UPDATE SET
+                count = count + 1,
+                tokens = tokens + excluded.tokens,
+                response_time = response_time + excluded.response_time,
+                cost = cost + excluded.cost;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER analytics_model_usage_delete
+        AFTER DELETE ON analytics_messages BEGIN
+            UPDATE analytics_model_usage SET
+                count = count - 1,
+                tokens = tokens - COALESCE(old.tokens_used, 0),
+                response_time = response_time - COALESCE(old.response_time, 0),
+                cost = cost - COALESCE(old.cost, 0)
+            WHERE model = COALESCE(old.model, '');
+        END
+    ''')
+
+
+def _latency_sketches_rebuild(cursor):
+    # Скорость генерации считалась по total_tokens (вместе с промптом), а в
+    # скетчи попадали ответы с ошибкой. Токены ответа в истории не хранятся,
+    # поэтому tokens_per_second накапливается заново, а время ответа и до
+    # первого токена пересчитываются по успешным запросам.
+    cursor.execute('DELETE FROM latency_sketches')
+
+    sketches = {}
+    cursor.execute('''
+        SELECT COALESCE(model, ''), response_time, time_to_first_token
+        FROM analytics_messages
+        WHERE is_error = 0 AND response_time IS NOT NULL
+    ''')
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        for model, response_time, time_to_first_token in rows:
+            for metric, value in latency_samples(response_time, None, time_to_first_token).items():
+                sketches.setdefault((model, metric), QuantileSketch()).add(value)
+
+    cursor.executemany(
+        'INSERT INTO latency_sketches (model, metric, data) VALUES (?, ?, ?)',
+        [(model, metric, sketch.to_json()) for (model, metric), sketch in sketches.items()]
+    )
+
+
+def _narrow_fts_update_trigger(cursor):
+    if not _table_exists(cursor, 'messages_fts'):
+        return
+    cursor.execute('DROP TRIGGER IF EXISTS messages_fts_update')
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_update
+        AFTER UPDATE OF user_message, ai_response ON messages BEGIN
+            DELETE FROM messages_fts WHERE rowid = old.id;
+            INSERT INTO messages_fts (rowid, user_message, ai_response)
+            VALUES (new.id, new.user_message, new.ai_response);
+        END
+    ''')
+
+
+def _messages_fts_update_on_text(cursor):
+    # Базы, прошедшие миграции 6 и 12 с прежним триггером на любой UPDATE.
+    # Порции backfill идемпотентны, так что уже занесённые строки не мешают.
+    _narrow_fts_update_trigger(cursor)
+
+
+# Миграции применяются строго по возрастанию версии.
+# Уже выпущенные миграции не меняются, изменения схемы добавляются в конец.
+MIGRATIONS = [
+    (1, 'base_schema', _base_schema),
+    (2, 'analytics_time_to_first_token', _time_to_first_token),
+    (3, 'model_catalog', _model_catalog),
+    (4, 'response_cache', _response_cache),
+    (5, 'history_indexes', _history_indexes),
+    (6, 'messages_fts', _messages_fts),
+    (7, 'analytics_model_rollup', _analytics_model_rollup),
+    (8, 'latency_sketches', _latency_sketches),
+    (9, 'usage_rollups', _usage_rollups),
+    (10, 'traces', _traces),
+    (11, 'context_summaries', _context_summaries),
+    (12, 'conversations', _conversations),
+    (13, 'analytics_cost', _analytics_cost),
+    (14, 'analytics_model_usage_not_null', _analytics_model_usage_not_null),
+    (15, 'latency_sketches_rebuild', _latency_sketches_rebuild),
+    (16, 'messages_fts_update_on_text', _messages_fts_update_on_text),
+]
+
+
+def get_schema_version(conn) -> int:
+    cursor = conn.cursor()
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+
+def _ensure_version_table(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at DATETIME NOT NULL,
+            duration FLOAT NOT NULL
+        )
+    ''')
+
+
+def run_migrations(db_name: str) -> list:
+    """
+    Приводит схему базы к последней версии.
+
+    Каждая миграция выполняется в отдельной транзакции вместе с записью
+    в schema_version, поэтому прерванный запуск продолжится с той же миграции.
+    Возвращает список применённых миграций с длительностью в секундах.
+    """
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    applied = []
+
+    try:
+        _ensure_version_table(conn)
+        current = get_schema_version(conn)
+        cursor = conn.cursor()
+
+        for version, name, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+
+            start = time.perf_counter()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                migrate(cursor)
+                duration = time.perf_counter() - start
+                cursor.execute(
+                    'INSERT INTO schema_version (version, name, applied_at, duration) VALUES (?, ?, ?, ?)',
+                    (version, name, datetime.now(), duration),
+                )
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+
+            applied.append({'version': version, 'name': name, 'duration': duration})
+
+        if applied:
+            cursor.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+
+    return applied
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import heapq
+import re
+from bisect import bisect_left
+
+# Буквенные и цифровые серии: "gpt-4o" -> gpt, 4, o; "sonnet35" -> sonnet, 35.
+_TOKEN_RE = re.compile(r"[^\W\d_]+|\d+")
+
+# Доля триграмм запроса, которая должна найтись в названии при нечётком поиске.
+TRIGRAM_THRESHOLD = 0.6
+
+# Веса совпадений при ранжировании.
+EXACT_TOKEN_SCORE = 3
+PREFIX_TOKEN_SCORE = 2
+SUBSTRING_BONUS = 2
+
+
+def tokenize(text: str) -> list:
+    """
+    Нормализованные токены: нижний регистр, буквы и цифры раздельно.
+    """
+    return _TOKEN_RE.findall(text.lower())
+
+
+def compact(text: str) -> str:
+    """
+    Строка без пробелов и знаков: "Claude 3.5 Sonnet" -> "claude35sonnet".
+    """
+    return "".join(tokenize(text))
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ModelSearchIndex:
+    """
+    Поисковый индекс каталога моделей, строится один раз на каталог.
+
+    Названия и id разбиваются на токены (цифры, разделённые точкой, дополнительно
+    склеиваются: "3.5" даёт и "3", "5", и "35"). Токены лежат в отсортированном
+    списке — все токены с нужным префиксом находятся бинарным поиском, — а
+    триграммы «сжатых» строк служат для нечёткого поиска при опечатках.
+
+    Каждый токен запроса должен быть префиксом какого-то токена модели. Вес
+    совпадения берётся прямо из списков записей по токенам, без перебора
+    токенов каждой модели. Если новый запрос продолжает предыдущий,
+    учитываются только прежние кандидаты: такое расширение может лишь сузить
+    множество совпадений.
+    """
+
+    def __init__(self, entries: list):
+        """
+        entries — пары (key, text) в порядке отображения.
+        """
+        self.size = len(entries)
+        self._compact = []
+        postings = {}
+        trigram_postings = {}
+
+        for doc_id, (key, text) in enumerate(entries):
+            tokens = set()
+            for source in (text, key):
+                tokens.update(tokenize(source))
+                tokens.update(self._merged_numbers(source))
+
+            name, compact_key = compact(text), compact(key)
+            self._compact.append((name, compact_key))
+            for token in tokens:
+                postings.setdefault(token, []).append(doc_id)
+            for trigram in trigrams(name) | trigrams(compact_key):
+                trigram_postings.setdefault(trigram, []).append(doc_id)
+
+        self._tokens = sorted(postings)
+        self._postings = postings
+        self._trigram_postings = trigram_postings
+
+        self._last_tokens = None
+        self._last_candidates = None
+
+    def _extends_last(self, query_tokens: list) -> bool:
+        """
+        Запрос продолжает предыдущий: те же токены, последний лишь дописан.
+        """
+        last = self._last_tokens
+        if not last or len(query_tokens) < len(last):
+            return False
+        head = len(last) - 1
+        return query_tokens[:head] == last[:head] and query_tokens[head].startswith(last[head])
+
+    @staticmethod
+    def _merged_numbers(text: str) -> list:
+        """
+        Версии вида "3.5" или "3-5" как один токен "35".
+        """
+        return [
+            re.sub(r"\D", "", match)
+            for match in re.findall(r"\d+(?:[.\-_]\d+)+", text)
+        ]
+
+    def _prefix_scores(self, prefix: str) -> dict:
+        """
+        {doc_id: вес} для записей, у которых есть токен с префиксом prefix.
+        """
+        scores = {}
+        tokens = self._tokens
+        index = bisect_left(tokens, prefix)
+        while index < len(tokens) and tokens[index].startswith(prefix):
+            token = tokens[index]
+            if token == prefix:
+                # Точное совпадение перекрывает префиксное.
+                scores.update(dict.fromkeys(self._postings[token], EXACT_TOKEN_SCORE))
+            else:
+                for doc_id in self._postings[token]:
+                    scores.setdefault(doc_id, PREFIX_TOKEN_SCORE)
+            index += 1
+        return scores
+
+    def _token_scores(self, query_tokens: list, candidates: set | None) -> dict:
+        """
+        Сумма весов по токенам запроса для записей, где найдены все токены.
+        """
+        scores = None
+        for query_token in query_tokens:
+            token_scores = self._prefix_scores(query_token)
+            if scores is None:
+                scores = token_scores
+                if candidates is not None:
+                    scores = {doc_id: score for doc_id, score in scores.items() if doc_id in candidates}
+            else:
+                scores = {
+                    doc_id: score + token_scores[doc_id]
+                    for doc_id, score in scores.items()
+                    if doc_id in token_scores
+                }
+            if not scores:
+                break
+        return scores
+
+    def _fuzzy(self, query: str) -> list:
+        """
+        Нечёткие совпадения по триграммам: (score, doc_id), score < 1.
+        """
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+
+        counts = {}
+        for trigram in query_trigrams:
+            for doc_id in self._trigram_postings.get(trigram, ()):
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+
+        required = TRIGRAM_THRESHOLD * len(query_trigrams)
+        return [
+            (count / len(query_trigrams), doc_id)
+            for doc_id, count in counts.items()
+            if count >= required
+        ]
+
+    def search(self, query: str, limit: int | None = None) -> list:
+        """
+        Индексы подходящих записей, лучшие первыми; для пустого запроса — все.
+        limit — вернуть только limit лучших (без полной сортировки).
+        """
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            self._last_tokens = None
+            self._last_candidates = None
+            return list(range(self.size if limit is None else min(limit, self.size)))
+
+        query_compact = "".join(query_tokens)
+        candidates = self._last_candidates if self._extends_last(query_tokens) else None
+        scores = self._token_scores(query_tokens, candidates)
+
+        compact_names = self._compact
+        scored = []
+        for doc_id, score in scores.items():
+            name, key = compact_names[doc_id]
+            if query_compact in name or query_compact in key:
+                score += SUBSTRING_BONUS
+            scored.append((-score, doc_id))
+
+        self._last_tokens = query_tokens
+        self._last_candidates = set(scores)
+
+        if not scored:
+            scored = [(-score, doc_id) for score, doc_id in self._fuzzy(query_compact)]
+
+        if limit is not None and limit < len(scored):
+            return [doc_id for _, doc_id in heapq.nsmallest(limit, scored)]
+        scored.sort()
+        return [doc_id for _, doc_id in scored]
@@ -1,16 +1,23 @@
+from __future__ import annotations
+
 import psutil
 import time
+from array import array
 from datetime import datetime
 import threading
 
 class PerformanceMonitor:
     """
     Класс для мониторинга производительности приложения.
+
+    Замеры хранятся в заранее выделенном кольцевом буфере на history_size
+    записей; для средних поддерживаются текущие суммы. Фоновый сэмплер
+    (start_sampling) опрашивает psutil с заданным интервалом, а горячие
+    пути читают только последний снимок через latest().
     """
     
-    def __init__(self):
+    def __init__(self, history_size: int = 1000):
         self.start_time = time.time()
-        self.metrics_history = []
         self.process = psutil.Process()
         
         self.thresholds = {
@@ -19,9 +26,29 @@ class PerformanceMonitor:
             'thread_count': 50
         }
 
+        # Кольцевой буфер замеров: по массиву на метрику, запись по индексу _next.
+        self.history_size = history_size
+        self._timestamps = array('d', [0.0] * history_size)
+        self._cpu = array('d', [0.0] * history_size)
+        self._memory = array('d', [0.0] * history_size)
+        self._threads = array('I', [0] * history_size)
+        self._next = 0
+        self._count = 0
+        self._sums = {'cpu_percent': 0.0, 'memory_percent': 0.0, 'thread_count': 0}
+        self._latest = None
+        self._lock = threading.Lock()
+
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+        self.sample_interval = None
+
+        # Длительности фаз запуска (секунды), например login_to_interactive.
+        self.startup_phases = {}
+        self.startup_budget = 2.0
+
     def get_metrics(self) -> dict:
         """
-        Получение текущих метрик производительности.
+        Получение текущих метрик производительности (новый замер psutil).
         """
         try:
             metrics = {
@@ -32,10 +59,7 @@ class PerformanceMonitor:
                 'uptime': time.time() - self.start_time
             }
             
-            self.metrics_history.append(metrics)
-            
-            if len(self.metrics_history) > 1000:
-                self.metrics_history.pop(0)
+            self._record(metrics)
                 
             return metrics
             
@@ -45,11 +69,93 @@ class PerformanceMonitor:
                 'timestamp': datetime.now()
             }
 
-    def check_health(self) -> dict:
+    def _record(self, metrics: dict) -> None:
+        with self._lock:
+            slot = self._next
+            if self._count == self.history_size:
+                # Перезаписываемый замер выпадает из текущих сумм.
+                self._sums['cpu_percent'] -= self._cpu[slot]
+                self._sums['memory_percent'] -= self._memory[slot]
+                self._sums['thread_count'] -= self._threads[slot]
+            else:
+                self._count += 1
+
+            self._timestamps[slot] = metrics['timestamp'].timestamp()
+            self._cpu[slot] = metrics['cpu_percent']
+            self._memory[slot] = metrics['memory_percent']
+            self._threads[slot] = metrics['thread_count']
+            self._sums['cpu_percent'] += metrics['cpu_percent']
+            self._sums['memory_percent'] += metrics['memory_percent']
+            self._sums['thread_count'] += metrics['thread_count']
+
+            self._next = (slot + 1) % self.history_size
+            self._latest = metrics
+
+    def latest(self) -> dict:
+        """
+        Последний снимок метрик без обращения к psutil.
+        Если замеров ещё не было, выполняется один.
+        """
+        latest = self._latest
+        if latest is None:
+            return self.get_metrics()
+        return dict(latest, uptime=time.time() - self.start_time)
+
+    @property
+    def metrics_history(self) -> list:
+        """
+        Замеры из кольцевого буфера от старых к новым.
+        """
+        with self._lock:
+            first = (self._next - self._count) % self.history_size
+            slots = [(first + i) % self.history_size for i in range(self._count)]
+            return [
+                {
+                    'timestamp': datetime.fromtimestamp(self._timestamps[slot]),
+                    'cpu_percent': self._cpu[slot],
+                    'memory_percent': self._memory[slot],
+                    'thread_count': self._threads[slot]
+                }
+                for slot in slots
+            ]
+
+    # ---------- Фоновый сэмплер ----------
+
+    def start_sampling(self, interval: float = 5.0) -> None:
+        """
+        Запускает фоновый поток, снимающий метрики каждые interval секунд.
+        """
+        if self._sampler is not None and self._sampler.is_alive():
+            return
+
+        self.sample_interval = interval
+        self._stop_sampling.clear()
+
+        def run():
+            while not self._stop_sampling.is_set():
+                self.get_metrics()
+                self._stop_sampling.wait(self.sample_interval)
+
+        self._sampler = threading.Thread(target=run, name="perf-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop_sampling(self) -> None:
+        self._stop_sampling.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1.0)
+            self._sampler = None
+
+    @property
+    def is_sampling(self) -> bool:
+        return self._sampler is not None and self._sampler.is_alive()
+
+    def check_health(self, metrics: dict | None = None) -> dict:
         """
         Проверка состояния системы на основе пороговых значений.
+        Без metrics проверяется последний снимок.
         """
-        metrics = self.get_metrics()
+        if metrics is None:
+            metrics = self.latest()
         
         if 'error' in metrics:
             return {'status': 'error', 'error': metrics['error']}
@@ -80,28 +186,79 @@ class PerformanceMonitor:
             
         return health_status
 
+    def record_phase(self, name: str, duration: float) -> None:
+        """
+        Сохранение длительности фазы запуска.
+        """
+        self.startup_phases[name] = duration
+
+    def get_startup_report(self) -> dict:
+        """
+        Длительности фаз запуска и укладывается ли вход в бюджет.
+        """
+        total = self.startup_phases.get('login_to_interactive')
+        return {
+            'phases': dict(self.startup_phases),
+            'budget': self.startup_budget,
+            'within_budget': total is not None and total <= self.startup_budget
+        }
+
     def get_average_metrics(self) -> dict:
         """
-        Расчет средних показателей за всю историю наблюдений.
+        Средние показатели по кольцевому буферу (по текущим суммам, O(1)).
         """
-        if not self.metrics_history:
+        with self._lock:
+            count = self._count
+            sums = dict(self._sums)
+
+        if not count:
             return {"error": "No metrics available"}
             
         avg_metrics = {
-            'avg_cpu': sum(m['cpu_percent'] for m in self.metrics_history) / len(self.metrics_history),
-            'avg_memory': sum(m['memory_percent'] for m in self.metrics_history) / len(self.metrics_history),
-            'avg_threads': sum(m['thread_count'] for m in self.metrics_history) / len(self.metrics_history),
-            'samples_count': len(self.metrics_history)
+            'avg_cpu': sums['cpu_percent'] / count,
+            'avg_memory': sums['memory_percent'] / count,
+            'avg_threads': sums['thread_count'] / count,
+            'samples_count': count
         }
         
         return avg_metrics
 
+    def get_rolling_stats(self, window: int | None = None) -> dict:
+        """
+        Среднее, минимум и максимум по последним window замерам
+        (по всему буферу, если window не задан).
+        """
+        with self._lock:
+            count = min(window or self._count, self._count)
+            if not count:
+                return {"error": "No metrics available"}
+
+            first = (self._next - count) % self.history_size
+            columns = {
+                'cpu_percent': self._cpu,
+                'memory_percent': self._memory,
+                'thread_count': self._threads
+            }
+            stats = {'samples_count': count}
+            for name, column in columns.items():
+                if first + count <= self.history_size:
+                    values = column[first:first + count]
+                else:
+                    values = column[first:] + column[:first + count - self.history_size]
+                stats[name] = {
+                    'avg': sum(values) / count,
+                    'min': min(values),
+                    'max': max(values)
+                }
+        return stats
+
     def log_metrics(self, logger) -> None:
         """
         Логирование текущих метрик и состояния системы.
         """
-        metrics = self.get_metrics()
-        health = self.check_health()
+        # Один замер на вызов: при работающем сэмплере берётся готовый снимок.
+        metrics = self.latest() if self.is_sampling else self.get_metrics()
+        health = self.check_health(metrics)
         
         if 'error' not in metrics:
             logger.info(
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+class PriceBook:
+    """
+    Цены моделей из каталога и оценка стоимости запроса по usage ответа.
+
+    Каталог хранит цены в USD за токен отдельно для промпта и ответа;
+    если в usage есть только total_tokens, он считается по цене промпта.
+    """
+
+    def __init__(self):
+        self.prices = {}
+
+    def update_models(self, models: list):
+        """
+        Запоминает цены моделей из каталога (записи без pricing пропускаются).
+        """
+        self.prices = {
+            model["id"]: model["pricing"]
+            for model in models
+            if model.get("pricing")
+        }
+
+    def has_price(self, model: str) -> bool:
+        return model in self.prices
+
+    def cost(self, model: str, usage: dict | None) -> float | None:
+        """
+        Стоимость запроса в USD; None, если цена модели неизвестна.
+        """
+        pricing = self.prices.get(model)
+        if pricing is None:
+            return None
+
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        if prompt_tokens is None and completion_tokens is None:
+            return (usage.get("total_tokens") or 0) * pricing["prompt"]
+        return (
+            (prompt_tokens or 0) * pricing["prompt"]
+            + (completion_tokens or 0) * pricing["completion"]
+        )
+
+
+def format_cost(cost: float | None) -> str:
+    if cost is None:
+        return "н/д"
+    if cost and cost < 0.01:
+        return f"${cost:.5f}"
+    return f"${cost:.4f}"
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import calendar
+from array import array
+from datetime import datetime
+
+# Размеры корзин агрегатов usage_rollups (в секундах).
+GRANULARITIES = {
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60
+}
+
+# Скользящие окна для оценки текущей нагрузки (в минутах).
+WINDOWS = {
+    '5m': 5,
+    '1h': 60,
+    '24h': 24 * 60
+}
+
+
+def naive_epoch(timestamp: datetime) -> int:
+    """
+    Секунды эпохи для «наивного» локального времени, трактуемого как UTC —
+    так же, как strftime('%s', ...) в триггере usage_rollups.
+    """
+    return calendar.timegm(timestamp.timetuple())
+
+
+class UsageRollups:
+    """
+    Поминутные счётчики за последние сутки и скользящие окна над ними.
+
+    Корзины лежат в кольцевых массивах на WINDOWS['24h'] минут, а для
+    каждого окна поддерживаются текущие суммы: add() и window() работают
+    за амортизированное O(1) независимо от объёма истории. Постоянное
+    хранение (минуты/часы/сутки) ведёт SQLite-триггер на analytics_messages.
+    """
+
+    FIELDS = ('messages', 'tokens', 'errors', 'latency')
+
+    def __init__(self):
+        self.size = max(WINDOWS.values())
+        self._minutes = array('q', [-1] * self.size)
+        self._columns = {
+            'messages': array('q', [0] * self.size),
+            'tokens': array('q', [0] * self.size),
+            'errors': array('q', [0] * self.size),
+            'latency': array('d', [0.0] * self.size)
+        }
+
+        self._current_minute = None
+        self._window_start = {}
+        self._window_totals = {
+            name: dict.fromkeys(self.FIELDS, 0) for name in WINDOWS
+        }
+
+    def _slot(self, minute: int) -> int:
+        return minute % self.size
+
+    def _value(self, field: str, minute: int):
+        slot = self._slot(minute)
+        if self._minutes[slot] != minute:
+            return 0
+        return self._columns[field][slot]
+
+    def _advance(self, minute: int):
+        """
+        Сдвигает окна к минуте minute, вычитая выпавшие корзины.
+        """
+        if self._current_minute is not None and minute <= self._current_minute:
+            return
+        self._current_minute = minute
+
+        for name, length in WINDOWS.items():
+            new_start = minute - length + 1
+            start = self._window_start.get(name, new_start)
+            totals = self._window_totals[name]
+
+            if new_start - start >= length:
+                # Окно целиком устарело — проще обнулить, чем вычитать по минуте.
+                for field in self.FIELDS:
+                    totals[field] = 0
+            else:
+                for old_minute in range(start, new_start):
+                    for field in self.FIELDS:
+                        totals[field] -= self._value(field, old_minute)
+
+            self._window_start[name] = new_start
+
+    def _accumulate(self, minute: int, values: dict, replace: bool = False):
+        self._advance(minute)
+        if self._current_minute - minute >= self.size:
+            return
+
+        slot = self._slot(minute)
+        if replace or self._minutes[slot] != minute:
+            self._minutes[slot] = minute
+            for column in self._columns.values():
+                column[slot] = 0
+
+        for field, value in values.items():
+            self._columns[field][slot] += value
+
+        for name in WINDOWS:
+            if minute >= self._window_start[name]:
+                totals = self._window_totals[name]
+                for field, value in values.items():
+                    totals[field] += value
+
+    def add(self, timestamp: datetime, tokens: int, latency: float, error: bool = False):
+        self._accumulate(naive_epoch(timestamp) // 60, {
+            'messages': 1,
+            'tokens': tokens or 0,
+            'errors': int(bool(error)),
+            'latency': latency or 0.0
+        })
+
+    def load_bucket(self, bucket_start: int, messages: int, tokens: int, errors: int, latency: float):
+        """
+        Загружает готовую минутную корзину из usage_rollups при запуске.
+        """
+        self._accumulate(bucket_start // 60, {
+            'messages': messages,
+            'tokens': tokens,
+            'errors': errors,
+            'latency': latency
+        }, replace=True)
+
+    def window(self, name: str, now: datetime | None = None) -> dict:
+        """
+        Суммы и темпы за окно name ('5m', '1h', '24h').
+        """
+        self._advance(naive_epoch(now or datetime.now()) // 60)
+        totals = self._window_totals[name]
+        minutes = WINDOWS[name]
+        messages = totals['messages']
+        return {
+            'messages': messages,
+            'tokens': totals['tokens'],
+            'errors': totals['errors'],
+            'messages_per_minute': messages / minutes,
+            'tokens_per_minute': totals['tokens'] / minutes,
+            'error_rate': totals['errors'] / messages if messages else 0,
+            'avg_latency': totals['latency'] / messages if messages else 0
+        }
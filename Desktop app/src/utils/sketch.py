@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import json
+import math
+
+# Метрики задержки, для которых ведутся скетчи по каждой модели.
+LATENCY_METRICS = ('response_time', 'time_to_first_token', 'tokens_per_second')
+
+
+def latency_samples(response_time: float, completion_tokens: int | None,
+                    time_to_first_token: float | None = None) -> dict:
+    """
+    Значения метрик LATENCY_METRICS для одного ответа (отсутствующие пропускаются).
+    Скорость генерации считается по completion_tokens: токены промпта,
+    включая весь контекст диалога, к ней не относятся.
+    """
+    samples = {'response_time': response_time}
+    if time_to_first_token is not None:
+        samples['time_to_first_token'] = time_to_first_token
+    if completion_tokens and response_time and response_time > 0:
+        samples['tokens_per_second'] = completion_tokens / response_time
+    return samples
+
+
+class QuantileSketch:
+    """
+    Сжатая оценка распределения для расчёта перцентилей (DDSketch).
+
+    Значения раскладываются по логарифмическим корзинам с относительной
+    точностью relative_accuracy: add() выполняется за O(1), память зависит
+    от разброса значений, а не от их количества, а два скетча объединяются
+    простым сложением корзин (merge).
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        if value is None or value < 0 or math.isnan(value):
+            return
+
+        if value == 0:
+            self.zero_count += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: 'QuantileSketch'):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Значение q-го квантиля (0 <= q <= 1) с относительной ошибкой не больше relative_accuracy.
+        """
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def percentiles(self) -> dict:
+        return {
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'count': self.count
+        }
+
+    # ---------- Сериализация ----------
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'a': self.relative_accuracy,
+            'z': self.zero_count,
+            'n': self.count,
+            's': self.total,
+            'min': self.min,
+            'max': self.max,
+            'b': [[index, count] for index, count in self.bins.items()]
+        }, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data: str) -> 'QuantileSketch':
+        raw = json.loads(data)
+        sketch = cls(raw['a'])
+        sketch.zero_count = raw['z']
+        sketch.count = raw['n']
+        sketch.total = raw['s']
+        sketch.min = raw['min']
+        sketch.max = raw['max']
+        sketch.bins = {index: count for index, count in raw['b']}
+        return sketch
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Текущий открытый спан; наследуется задачами asyncio и copy_context().
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class _NullSpan:
+    """
+    Заглушка, которую возвращает выключенный трейсер: вход и выход ничего не делают.
+    """
+
+    __slots__ = ()
+
+    # У заглушки нет трассы — по этому признаку вызывающий код отличает её от Span.
+    trace = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """
+    Один трассируемый запрос: корневой спан и все вложенные фазы.
+    """
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def breakdown(self) -> dict:
+        """
+        Суммарная длительность по именам фаз (в секундах), без корневого спана.
+        """
+        totals = {}
+        for span in self.spans:
+            if span['depth'] > 0:
+                totals[span['name']] = totals.get(span['name'], 0.0) + span['duration']
+        return totals
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'attrs': self.attrs,
+            'spans': sorted(self.spans, key=lambda span: span['offset'])
+        }
+
+
+class Span:
+    """
+    Интервал выполнения фазы; время — по монотонным часам perf_counter.
+    """
+
+    __slots__ = ('name', 'trace', 'depth', 'attrs', 'start', '_token', '_tracer')
+
+    def __init__(self, tracer, name: str, trace: Trace, depth: int, attrs: dict):
+        self._tracer = tracer
+        self.name = name
+        self.trace = trace
+        self.depth = depth
+        self.attrs = attrs
+        self.start = None
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+
+        self.trace.spans.append({
+            'name': self.name,
+            'depth': self.depth,
+            'offset': self.start - self.trace.start,
+            'duration': end - self.start,
+            'attrs': self.attrs
+        })
+        if self.depth == 0:
+            self.trace.duration = end - self.start
+            self._tracer._finish(self.trace)
+        return False
+
+
+class Tracer:
+    """
+    Лёгкая трассировка горячих путей.
+
+    trace() открывает корневой спан запроса, span() — вложенную фазу
+    текущего запроса (контекст передаётся через contextvars, поэтому
+    работает и в корутинах). Вне трассы и при выключенном трейсере span()
+    возвращает общую заглушку — стоимость сводится к одной проверке.
+    Завершённые трассы хранятся в ограниченной очереди и, если задан sink,
+    передаются ему (например, ChatCache.save_trace).
+    """
+
+    def __init__(self, enabled: bool = False, max_traces: int = 200, sink=None):
+        self.enabled = enabled
+        self.sink = sink
+        self.traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool | None = None, max_traces: int | None = None, sink=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if max_traces is not None:
+            with self._lock:
+                self.traces = deque(self.traces, maxlen=max_traces)
+        if sink is not None:
+            self.sink = sink
+
+    def trace(self, name: str, **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, Trace(name, attrs), 0, attrs)
+
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        parent = _current_span.get()
+        if parent is None:
+            return NULL_SPAN
+        return Span(self, name, parent.trace, parent.depth + 1, attrs)
+
+    def record(self, name: str, duration: float, **attrs):
+        """
+        Добавляет уже завершившуюся фазу длительностью duration, закончившуюся сейчас.
+        Нужен там, где спан нельзя держать открытым (например, поперёк yield).
+        """
+        if not self.enabled:
+            return
+        parent = _current_span.get()
+        if parent is None:
+            return
+        trace = parent.trace
+        trace.spans.append({
+            'name': name,
+            'depth': parent.depth + 1,
+            'offset': time.perf_counter() - duration - trace.start,
+            'duration': duration,
+            'attrs': attrs
+        })
+
+    def _finish(self, trace: Trace):
+        with self._lock:
+            self.traces.append(trace)
+        if self.sink is not None:
+            try:
+                self.sink(trace.to_dict())
+            except Exception:
+                pass
+
+    def get_traces(self, limit: int | None = None) -> list:
+        """
+        Последние завершённые трассы (новые в конце) в виде словарей.
+        """
+        with self._lock:
+            traces = list(self.traces)
+        if limit is not None:
+            traces = traces[-limit:]
+        return [trace.to_dict() for trace in traces]
+
+
+# Общий трейсер приложения (включается в ChatApp по TRACING=1).
+tracer = Tracer()
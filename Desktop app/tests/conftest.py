@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _workdir(tmp_path_factory):
+    # ChatCache и AppLogger пишут файлы относительно текущего каталога.
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("workdir"))
+    yield
+    os.chdir(previous)
@@ -0,0 +1,42 @@
+import pytest
+
+from utils.analytics import Analytics
+from utils.cache import ChatCache
+from utils.sketch import QuantileSketch, latency_samples
+
+
+def test_tokens_per_second_uses_completion_tokens():
+    samples = latency_samples(2.0, 50, 0.4)
+    assert samples == {'response_time': 2.0, 'time_to_first_token': 0.4, 'tokens_per_second': 25.0}
+    assert 'tokens_per_second' not in latency_samples(2.0, None)
+
+
+def test_sketch_quantiles_within_accuracy_and_roundtrip():
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in range(1, 1001):
+        sketch.add(value / 100)
+
+    assert sketch.quantile(0.5) == pytest.approx(5.0, rel=0.02)
+    assert sketch.quantile(0.99) == pytest.approx(9.9, rel=0.02)
+    restored = QuantileSketch.from_json(sketch.to_json())
+    assert restored.percentiles() == sketch.percentiles()
+
+
+@pytest.fixture
+def analytics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = ChatCache()
+    yield Analytics(cache)
+    cache.writer.close()
+
+
+def test_errors_and_stopped_responses_stay_out_of_sketches(analytics):
+    analytics.track_message("m/a", 10, 1.0, 1200, completion_tokens=100)
+    analytics.track_message("m/a", 10, 0.05, 0, error=True)
+    analytics.track_message("m/a", 10, 30.0, 40, sample_latency=False)
+
+    percentiles = analytics.get_latency_percentiles("m/a")
+    assert percentiles['response_time']['count'] == 1
+    assert percentiles['tokens_per_second']['p50'] == pytest.approx(100.0, rel=0.02)
+    # Все три запроса учитываются в агрегатах по модели.
+    assert analytics.model_usage["m/a"]['count'] == 3
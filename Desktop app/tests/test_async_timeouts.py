@@ -0,0 +1,83 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+from api.async_openrouter import AsyncOpenRouterClient
+
+
+async def with_server(routes, scenario):
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    client = AsyncOpenRouterClient(api_key="key", base_url=f"http://127.0.0.1:{port}", backoff_factor=0)
+    try:
+        return await scenario(client)
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+def sse(chunk: dict) -> bytes:
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+def test_send_timeout_bounds_all_attempts():
+    attempts = []
+
+    async def overloaded(request):
+        attempts.append(time.monotonic())
+        await asyncio.sleep(0.2)
+        return web.Response(status=503)
+
+    async def scenario(client):
+        start = time.monotonic()
+        result = await client.send_message("hi", "m/a", timeout=0.5)
+        return result, time.monotonic() - start
+
+    result, elapsed = asyncio.run(with_server([web.post("/chat/completions", overloaded)], scenario))
+    assert result == {"error": "No response within 0.5s"}
+    assert elapsed < 0.9
+    assert len(attempts) < 4
+
+
+def test_stream_timeout_covers_wait_for_first_data():
+    async def silent(request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for _ in range(20):
+            # Комментарии поддерживают соединение, но данных нет.
+            await response.write(b": OPENROUTER PROCESSING\n\n")
+            await asyncio.sleep(0.05)
+        return response
+
+    async def scenario(client):
+        start = time.monotonic()
+        events = [event async for event in client.stream_message("hi", "m/a", timeout=0.3)]
+        return events, time.monotonic() - start
+
+    events, elapsed = asyncio.run(with_server([web.post("/chat/completions", silent)], scenario))
+    assert events == [{"error": "No response within 0.3s"}]
+    assert elapsed < 0.8
+
+
+def test_stream_may_outlast_timeout_once_data_flows():
+    async def slow_tokens(request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in ("a", "b", "c", "d", "e"):
+            await response.write(sse({"choices": [{"delta": {"content": word}}]}))
+            await asyncio.sleep(0.1)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def scenario(client):
+        return [event async for event in client.stream_message("hi", "m/a", timeout=0.3)]
+
+    events = asyncio.run(with_server([web.post("/chat/completions", slow_tokens)], scenario))
+    assert events[-1]["choices"][0]["message"]["content"] == "abcde"
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from api.balance import BalanceRefresher
+
+
+def test_concurrent_refreshes_share_one_request():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 10.0
+
+    refresher = BalanceRefresher(fetch, ttl=60)
+
+    async def scenario():
+        results = await asyncio.gather(*(refresher.refresh() for _ in range(5)))
+        # Свежее значение отдаётся без нового запроса.
+        results.append(await refresher.refresh())
+        return results
+
+    assert asyncio.run(scenario()) == [10.0] * 6
+    assert len(calls) == 1
+
+
+def test_spend_during_refresh_is_kept_in_estimate():
+    refresher = BalanceRefresher(None, ttl=60)
+    refresher.seed(10.0)
+    refresher.record_spend(1.0)
+
+    async def fetch():
+        # Расход, сделанный пока запрос в пути, сервер ещё не видит.
+        refresher.record_spend(0.25)
+        return 9.0
+
+    refresher.fetch = fetch
+    assert asyncio.run(refresher.refresh(force=True)) == pytest.approx(8.75)
+    assert refresher.is_estimated
+
+
+def test_failed_refresh_keeps_previous_estimate():
+    async def fetch():
+        raise ConnectionError("offline")
+
+    updates = []
+    refresher = BalanceRefresher(fetch, ttl=60, on_update=updates.append)
+    refresher.seed(5.0)
+    refresher.record_spend(0.5)
+
+    assert asyncio.run(refresher.refresh(force=True)) == pytest.approx(4.5)
+    assert refresher.failed
+    assert len(updates) == 3
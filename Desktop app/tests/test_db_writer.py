@@ -0,0 +1,73 @@
+import sqlite3
+import time
+
+import pytest
+
+from utils.db_writer import DatabaseWriter
+
+
+@pytest.fixture
+def writer(tmp_path):
+    db_name = str(tmp_path / "writer.db")
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT NOT NULL)")
+    conn.close()
+    writer = DatabaseWriter(db_name)
+    yield writer
+    writer.close()
+
+
+def count_items(writer):
+    conn = sqlite3.connect(writer.db_name)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_flush_confirms_committed_batch(writer):
+    writer.submit_many("INSERT INTO items (value) VALUES (?)", [("a",), ("b",)])
+    assert writer.flush(5)
+    assert count_items(writer) == 2
+
+
+def test_flush_reports_failed_operation_once(writer):
+    writer.submit("INSERT INTO items (value) VALUES (?)", ("ok",))
+    writer.submit("INSERT INTO items (value) VALUES (NULL)")
+    assert not writer.flush(5)
+    assert "NOT NULL" in writer.get_stats()["last_error"]
+    # Остальные операции пачки не потеряны, а ошибка сообщается один раз.
+    assert count_items(writer) == 1
+    assert writer.flush(5)
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_flush_fails_when_writer_thread_died(writer):
+    def crash(cursor):
+        raise SystemExit
+
+    writer.submit_call(crash)
+    writer._thread.join(5)
+    assert not writer._thread.is_alive()
+    assert not writer.flush(1)
+
+
+
+def test_writer_survives_write_in_progress_at_startup(tmp_path):
+    db_name = str(tmp_path / "busy.db")
+    other = sqlite3.connect(db_name)
+    other.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT NOT NULL)")
+    other.commit()
+
+    writer = DatabaseWriter(db_name)
+    try:
+        # Другое соединение пишет, пока поток-писатель открывает своё.
+        other.execute("INSERT INTO items (value) VALUES ('other')")
+        writer.submit("INSERT INTO items (value) VALUES (?)", ("writer",))
+        time.sleep(0.2)
+        other.commit()
+        assert writer.flush(10)
+        assert count_items(writer) == 2
+    finally:
+        writer.close()
+        other.close()
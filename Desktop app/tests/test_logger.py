@@ -0,0 +1,19 @@
+import logging
+
+from utils.logger import AppLogger, _DeferredQueueHandler
+
+
+def test_queued_record_keeps_arguments_from_call_time():
+    stats = {"requests": 1}
+    record = logging.LogRecord("ChatApp.api", logging.INFO, __file__, 1, "Stats: %s", (stats,), None)
+
+    prepared = _DeferredQueueHandler(None).prepare(record)
+    stats["requests"] = 2
+
+    assert prepared.getMessage() == "Stats: {'requests': 1}"
+
+
+def test_logger_instances_share_handlers():
+    assert AppLogger("api") is AppLogger("api")
+    root = logging.getLogger(AppLogger.ROOT_NAME)
+    assert sum(isinstance(handler, _DeferredQueueHandler) for handler in root.handlers) == 1
@@ -0,0 +1,162 @@
+import sqlite3
+
+import pytest
+
+from utils import migrations
+from utils.sketch import QuantileSketch
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    return str(tmp_path / "chat_cache.db")
+
+
+def migrate_to(db_name, version, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, "MIGRATIONS", [m for m in migrations.MIGRATIONS if m[0] <= version])
+        return migrations.run_migrations(db_name)
+
+
+def insert_analytics(conn, model, tokens=10, cost=0.5):
+    conn.execute(
+        "INSERT INTO analytics_messages (timestamp, model, message_length, response_time, "
+        "tokens_used, cost) VALUES (datetime('now'), ?, 5, 1.0, ?, ?)",
+        (model, tokens, cost)
+    )
+
+
+def model_usage(conn):
+    return conn.execute(
+        "SELECT model, count, tokens, cost FROM analytics_model_usage ORDER BY model"
+    ).fetchall()
+
+
+def test_fresh_database_reaches_latest_version(db_name):
+    applied = migrations.run_migrations(db_name)
+    assert [m["version"] for m in applied] == [m[0] for m in migrations.MIGRATIONS]
+
+    conn = sqlite3.connect(db_name)
+    assert migrations.get_schema_version(conn) == migrations.MIGRATIONS[-1][0]
+    assert migrations.run_migrations(db_name) == []
+    conn.close()
+
+
+def test_model_usage_merges_rows_without_model(db_name):
+    migrations.run_migrations(db_name)
+    conn = sqlite3.connect(db_name)
+    insert_analytics(conn, None)
+    insert_analytics(conn, None)
+    insert_analytics(conn, "m/a")
+    conn.commit()
+    assert model_usage(conn) == [("", 2, 20, 1.0), ("m/a", 1, 10, 0.5)]
+
+    conn.execute("DELETE FROM analytics_messages WHERE model IS NULL AND id = 1")
+    conn.commit()
+    assert model_usage(conn) == [("", 1, 10, 0.5), ("m/a", 1, 10, 0.5)]
+    conn.close()
+
+
+def test_model_usage_rebuilt_for_existing_database(db_name, monkeypatch):
+    migrate_to(db_name, 13, monkeypatch)
+    conn = sqlite3.connect(db_name)
+    insert_analytics(conn, None)
+    insert_analytics(conn, None)
+    conn.commit()
+    # До исправления каждая запись без модели добавляла отдельную строку.
+    assert len(model_usage(conn)) == 2
+    conn.close()
+
+    migrations.run_migrations(db_name)
+    conn = sqlite3.connect(db_name)
+    assert model_usage(conn) == [("", 2, 20, 1.0)]
+    conn.close()
+
+
+def test_latency_sketches_rebuilt_from_successful_requests(db_name, monkeypatch):
+    migrate_to(db_name, 14, monkeypatch)
+    conn = sqlite3.connect(db_name)
+    conn.executemany(
+        "INSERT INTO analytics_messages (timestamp, model, message_length, response_time, "
+        "tokens_used, is_error) VALUES (datetime('now'), 'm/a', 5, ?, 1000, ?)",
+        [(2.0, 0), (2.0, 0), (0.01, 1)]
+    )
+    conn.execute(
+        "INSERT INTO latency_sketches (model, metric, data) VALUES ('m/a', 'tokens_per_second', '{}')"
+    )
+    conn.commit()
+    conn.close()
+
+    migrations.run_migrations(db_name)
+    conn = sqlite3.connect(db_name)
+    rows = dict(conn.execute("SELECT metric, data FROM latency_sketches WHERE model = 'm/a'").fetchall())
+    conn.close()
+
+    assert set(rows) == {'response_time'}
+    sketch = QuantileSketch.from_json(rows['response_time'])
+    assert sketch.count == 2
+    assert sketch.min == 2.0
+
+
+def install_wide_update_trigger(db_name):
+    """
+    Триггер в том виде, в каком его создавала прежняя миграция 6.
+    """
+    conn = sqlite3.connect(db_name)
+    conn.executescript('''
+        DROP TRIGGER messages_fts_update;
+        CREATE TRIGGER messages_fts_update AFTER UPDATE ON messages BEGIN
+            DELETE FROM messages_fts WHERE rowid = old.id;
+            INSERT INTO messages_fts (rowid, user_message, ai_response)
+            VALUES (new.id, new.user_message, new.ai_response);
+        END;
+    ''')
+    conn.close()
+
+
+def insert_messages(conn, count):
+    conn.executemany(
+        "INSERT INTO messages (model, user_message, ai_response, timestamp, tokens_used) "
+        "VALUES ('m', ?, 'ответ', datetime('now'), 1)",
+        [(f"вопрос {i}",) for i in range(count)]
+    )
+
+
+def fts_rows(conn):
+    return conn.execute("SELECT COUNT(*) FROM messages_fts").fetchone()[0]
+
+
+@pytest.mark.parametrize("wide_trigger", [False, True])
+def test_conversations_migration_does_not_index_history(db_name, monkeypatch, wide_trigger):
+    migrate_to(db_name, 5, monkeypatch)
+    conn = sqlite3.connect(db_name)
+    insert_messages(conn, 50)
+    conn.commit()
+    conn.close()
+
+    migrate_to(db_name, 11, monkeypatch)
+    if wide_trigger:
+        install_wide_update_trigger(db_name)
+    migrations.run_migrations(db_name)
+
+    conn = sqlite3.connect(db_name)
+    assert conn.execute("SELECT COUNT(*) FROM messages WHERE conversation_id IS NULL").fetchone()[0] == 0
+    assert fts_rows(conn) == 0
+    assert conn.execute("SELECT last_id, target_id FROM fts_backfill").fetchone() == (0, 50)
+    conn.close()
+
+
+def test_fts_update_trigger_ignores_non_text_columns(db_name, monkeypatch):
+    migrate_to(db_name, 15, monkeypatch)
+    install_wide_update_trigger(db_name)
+    migrations.run_migrations(db_name)
+
+    conn = sqlite3.connect(db_name)
+    insert_messages(conn, 1)
+    conn.execute("DELETE FROM messages_fts")
+    conn.execute("UPDATE messages SET conversation_id = 7")
+    assert fts_rows(conn) == 0
+
+    conn.execute("UPDATE messages SET user_message = 'новый вопрос'")
+    rows = conn.execute("SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'новый'").fetchall()
+    assert rows == [(1,)]
+    conn.close()
@@ -0,0 +1,38 @@
+from unittest.mock import MagicMock
+
+from api.openrouter import OpenRouterClient
+
+
+def make_client(**kwargs):
+    client = OpenRouterClient(api_key="key", base_url="http://api.test",
+                              backoff_factor=0, load_models=False, **kwargs)
+    client.logger = MagicMock()
+    return client
+
+
+def test_not_modified_without_cache():
+    client = make_client(cache=None)
+    client.session.request = MagicMock(return_value=MagicMock(status_code=304, headers={}))
+
+    assert client.refresh_models() is False
+    client.logger.error.assert_not_called()
+
+
+def test_not_modified_touches_cached_catalog():
+    cache = MagicMock()
+    cache.get_model_catalog.return_value = {"etag": '"v1"', "last_modified": None}
+    client = make_client(cache=cache)
+    client.session.request = MagicMock(return_value=MagicMock(status_code=304, headers={}))
+
+    assert client.refresh_models() is False
+    cache.touch_model_catalog.assert_called_once()
+
+
+def test_stale_catalog_refresh_goes_through_runner():
+    cache = MagicMock()
+    cache.get_model_catalog.return_value = {"models": [{"id": "m"}], "fetched_at": 0}
+    scheduled = []
+    client = make_client(cache=cache, refresh_runner=scheduled.append)
+
+    assert client.load_models() == [{"id": "m"}]
+    assert scheduled == [client.refresh_models]
@@ -0,0 +1,60 @@
+from utils.model_search import ModelSearchIndex
+
+CATALOG = [
+    ("anthropic/claude-3.5-sonnet", "Anthropic: Claude 3.5 Sonnet"),
+    ("anthropic/claude-3-haiku", "Anthropic: Claude 3 Haiku"),
+    ("openai/gpt-4o", "OpenAI: GPT-4o"),
+    ("openai/gpt-4o-mini", "OpenAI: GPT-4o-mini"),
+    ("openai/gpt-3.5-turbo", "OpenAI: GPT-3.5 Turbo"),
+    ("meta-llama/llama-3.1-70b-instruct", "Meta: Llama 3.1 70B Instruct"),
+]
+
+
+def names(index, query, **kwargs):
+    return [CATALOG[doc_id][0] for doc_id in index.search(query, **kwargs)]
+
+
+def test_empty_query_returns_catalog_order():
+    index = ModelSearchIndex(CATALOG)
+    assert index.search("  ") == list(range(len(CATALOG)))
+    assert index.search("", limit=2) == [0, 1]
+
+
+def test_exact_tokens_rank_above_prefixes():
+    index = ModelSearchIndex(CATALOG)
+    assert names(index, "gpt 4o") == ["openai/gpt-4o", "openai/gpt-4o-mini"]
+    assert names(index, "claude 3.5") == ["anthropic/claude-3.5-sonnet"]
+    assert names(index, "sonnet35") == ["anthropic/claude-3.5-sonnet"]
+
+
+def test_extending_query_narrows_previous_candidates():
+    index = ModelSearchIndex(CATALOG)
+    assert len(names(index, "g")) == 3
+    assert names(index, "gpt 3") == ["openai/gpt-3.5-turbo"]
+    # Новый запрос, не продолжающий предыдущий, ищет по всему каталогу.
+    assert names(index, "llama") == ["meta-llama/llama-3.1-70b-instruct"]
+
+
+def test_typo_falls_back_to_trigrams():
+    index = ModelSearchIndex(CATALOG)
+    assert names(index, "sonet") == ["anthropic/claude-3.5-sonnet"]
+    assert names(index, "cluade") == []
+
+
+def test_limit_returns_best_matches_in_order():
+    index = ModelSearchIndex(CATALOG)
+    full = index.search("o")
+    assert index.search("o", limit=2) == full[:2]
+
+
+def test_selector_search_uses_current_catalog():
+    from ui.components import ModelSelector
+
+    selector = ModelSelector([{"id": key, "name": name} for key, name in CATALOG])
+    assert [option.key for option in selector.search_options("gpt 4o")] == [
+        "openai/gpt-4o", "openai/gpt-4o-mini"
+    ]
+
+    selector.update_models([{"id": "x/gpt-4o", "name": "X: GPT-4o"}])
+    assert [option.key for option in selector.search_options("gpt", limit=5)] == ["x/gpt-4o"]
+    assert [option.key for option in selector.all_options] == ["x/gpt-4o"]
@@ -0,0 +1,101 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import aiohttp
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from api.async_openrouter import AsyncOpenRouterClient
+from api.openrouter import OpenRouterClient, is_connect_failure
+
+
+def make_client(side_effect):
+    client = OpenRouterClient(api_key="key", base_url="http://api.test",
+                              backoff_factor=0, load_models=False)
+    client.session.request = MagicMock(side_effect=side_effect)
+    return client
+
+
+def ok_response():
+    return MagicMock(status_code=200, headers={})
+
+
+def refused():
+    reason = NewConnectionError(None, "Connection refused")
+    return requests.ConnectionError(MaxRetryError(None, "/chat/completions", reason))
+
+
+def aborted():
+    return requests.ConnectionError(ProtocolError("Connection aborted.", ConnectionResetError()))
+
+
+def test_connect_failure_classification():
+    assert is_connect_failure(refused())
+    assert is_connect_failure(requests.exceptions.ConnectTimeout())
+    assert not is_connect_failure(aborted())
+    assert not is_connect_failure(requests.exceptions.ReadTimeout())
+
+
+@pytest.mark.parametrize("error", [refused(), requests.exceptions.ConnectTimeout()])
+def test_post_retries_connect_failures(error):
+    client = make_client([error, ok_response()])
+    assert client._request("POST", "/chat/completions").status_code == 200
+    assert client.session.request.call_count == 2
+
+
+@pytest.mark.parametrize("error", [aborted(), requests.exceptions.ReadTimeout()])
+def test_post_does_not_retry_after_request_was_sent(error):
+    client = make_client([error, ok_response()])
+    with pytest.raises(type(error)):
+        client._request("POST", "/chat/completions")
+    assert client.session.request.call_count == 1
+
+
+@pytest.mark.parametrize("error", [aborted(), requests.exceptions.ReadTimeout()])
+def test_get_retries_any_network_error(error):
+    client = make_client([error, ok_response()])
+    assert client._request("GET", "/models").status_code == 200
+    assert client.session.request.call_count == 2
+
+
+def test_retry_status_then_give_up():
+    responses = [MagicMock(status_code=503, headers={}) for _ in range(4)]
+    client = make_client(responses)
+    assert client._request("POST", "/chat/completions").status_code == 503
+    assert client.session.request.call_count == client.max_retries + 1
+
+
+def make_async_client(side_effect):
+    client = AsyncOpenRouterClient(api_key="key", base_url="http://api.test", backoff_factor=0)
+    client._session = MagicMock(closed=False, request=AsyncMock(side_effect=side_effect))
+    return client
+
+
+def connector_error():
+    return aiohttp.ClientConnectorError(MagicMock(), OSError(111, "Connection refused"))
+
+
+@pytest.mark.parametrize("error", [
+    aiohttp.ServerTimeoutError("Timeout on reading data from socket"),
+    aiohttp.ServerDisconnectedError(),
+])
+def test_async_post_does_not_retry_after_request_was_sent(error):
+    client = make_async_client([error, MagicMock(status=200)])
+    with pytest.raises(type(error)):
+        asyncio.run(client._request("POST", "/chat/completions", timeout=None))
+    assert client._session.request.await_count == 1
+
+
+def test_async_post_retries_connector_error():
+    client = make_async_client([connector_error(), MagicMock(status=200)])
+    response = asyncio.run(client._request("POST", "/chat/completions", timeout=None))
+    assert response.status == 200
+    assert client._session.request.await_count == 2
+
+
+def test_async_get_retries_disconnect():
+    client = make_async_client([aiohttp.ServerDisconnectedError(), MagicMock(status=200)])
+    response = asyncio.run(client._request("GET", "/credits", timeout=None))
+    assert response.status == 200
+    assert client._session.request.await_count == 2
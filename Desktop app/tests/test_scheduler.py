@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+from api.scheduler import BACKGROUND, RequestScheduler, TokenBucket
+
+
+class FakeClient:
+    """
+    Клиент, который только отмечает порядок и число одновременных запросов.
+    """
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.on_rate_limited = None
+        self.inflight = 0
+        self.peak = 0
+        self.order = []
+
+    async def send_message(self, message, model, messages=None, timeout=None):
+        self.inflight += 1
+        self.peak = max(self.peak, self.inflight)
+        self.order.append(message)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.inflight -= 1
+        return {"choices": [{"message": {"content": message}}]}
+
+    async def stream_message(self, message, model, messages=None, timeout=None):
+        self.inflight += 1
+        try:
+            for index in range(3):
+                await asyncio.sleep(0)
+                yield {"delta": str(index)}
+            yield {"choices": [{"message": {"content": "012"}}]}
+        finally:
+            self.inflight -= 1
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    bucket.take(now)
+    bucket.take(now)
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+
+    bucket.pause(3, now + 0.5)
+    assert bucket.delay(now + 1) == pytest.approx(2.5)
+
+
+def test_concurrency_cap_and_model_limits():
+    client = FakeClient()
+    scheduler = RequestScheduler(client, max_concurrency=2, global_rate=0, model_rate=10, model_burst=2)
+
+    async def scenario():
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *(scheduler.send_message(f"a{i}", "A") for i in range(4)),
+            scheduler.send_message("b0", "B"),
+        )
+        return results, time.monotonic() - start
+
+    results, elapsed = asyncio.run(scenario())
+    assert [r["choices"][0]["message"]["content"] for r in results] == ["a0", "a1", "a2", "a3", "b0"]
+    assert client.peak == 2
+    # Модель B не ждёт, пока A упирается в свой лимит (10/с, всплеск 2).
+    assert client.order.index("b0") < client.order.index("a2")
+    assert elapsed >= 0.15
+    assert scheduler.get_stats()["completed"] == 5
+
+
+def test_interactive_requests_overtake_background():
+    client = FakeClient()
+    scheduler = RequestScheduler(client, max_concurrency=1, global_rate=0, model_rate=0)
+
+    async def scenario():
+        tasks = [asyncio.create_task(scheduler.send_message(f"bg{i}", "A", priority=BACKGROUND))
+                 for i in range(3)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(scheduler.send_message(f"fg{i}", "A")) for i in range(2)]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert client.order == ["bg0", "fg0", "fg1", "bg1", "bg2"]
+
+
+def test_cancelled_request_releases_its_place():
+    client = FakeClient()
+    scheduler = RequestScheduler(client, max_concurrency=1, global_rate=0, model_rate=0)
+
+    async def scenario():
+        tasks = [asyncio.create_task(scheduler.send_message(f"x{i}", "A")) for i in range(3)]
+        await asyncio.sleep(0.005)
+        tasks[1].cancel()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert client.order == ["x0", "x2"]
+    assert scheduler._active == 0
+    assert scheduler.get_stats()["cancelled"] == 1
+
+
+def test_stream_holds_slot_until_closed():
+    client = FakeClient()
+    scheduler = RequestScheduler(client, max_concurrency=1, global_rate=0, model_rate=0)
+
+    async def scenario():
+        events = []
+        async for event in scheduler.stream_message("s", "A"):
+            events.append(event)
+            assert scheduler._active == 1
+        return events
+
+    events = asyncio.run(scenario())
+    assert len(events) == 4
+    assert scheduler._active == 0
+
+
+def test_rate_limit_pauses_new_requests():
+    client = FakeClient(delay=0)
+    scheduler = RequestScheduler(client, max_concurrency=4, global_rate=100, global_burst=10, model_rate=0)
+
+    async def scenario():
+        await scheduler.send_message("first", "A")
+        client.on_rate_limited(0.2)
+        start = time.monotonic()
+        await scheduler.send_message("second", "A")
+        return time.monotonic() - start
+
+    assert asyncio.run(scenario()) >= 0.19
+    assert scheduler.get_stats()["rate_limited"] == 1
+
+
+def test_blocking_calls_share_the_slots():
+    client = FakeClient(delay=0.05)
+    scheduler = RequestScheduler(client, max_concurrency=1, global_rate=0, model_rate=0)
+
+    def load_catalog():
+        time.sleep(0.05)
+        return ["m"]
+
+    async def scenario():
+        start = time.monotonic()
+        catalog, _ = await asyncio.gather(
+            scheduler.run_blocking(load_catalog), scheduler.send_message("chat", "A")
+        )
+        return catalog, time.monotonic() - start
+
+    catalog, elapsed = asyncio.run(scenario())
+    assert catalog == ["m"]
+    # Один слот: каталог и чат выполнялись по очереди, а не одновременно.
+    assert elapsed >= 0.1
+    assert scheduler.get_stats()["completed"] == 2
@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+
+import pytest
+
+from utils import migrations
+from utils.cache import ChatCache
+
+LEGACY_MESSAGES = 250
+
+
+@pytest.fixture
+def legacy_cache(tmp_path, monkeypatch):
+    """
+    ChatCache поверх базы со старой историей, созданной до индекса поиска.
+    """
+    monkeypatch.chdir(tmp_path)
+    conn = sqlite3.connect("chat_cache.db")
+    migrations._base_schema(conn.cursor())
+    conn.executemany(
+        "INSERT INTO messages (model, user_message, ai_response, timestamp, tokens_used) "
+        "VALUES ('m', ?, ?, datetime('now'), 1)",
+        [(f"вопрос {i}", f"ответ {i} python" if i % 5 == 0 else "ok") for i in range(LEGACY_MESSAGES)]
+    )
+    conn.commit()
+    conn.close()
+
+    cache = ChatCache()
+    yield cache
+    cache.writer.close()
+
+
+def wait_backfill():
+    for thread in threading.enumerate():
+        if thread.name == "fts-backfill":
+            thread.join(10)
+            assert not thread.is_alive()
+
+
+def indexed_rows(cache):
+    conn = cache.get_connection()
+    return conn.execute("SELECT COUNT(*) FROM messages_fts").fetchone()[0]
+
+
+def test_startup_does_not_index_legacy_history(legacy_cache):
+    # Миграции при запуске только создают индекс; история заносится в фоне.
+    assert indexed_rows(legacy_cache) == 0
+    assert legacy_cache.get_search_backfill_progress() == 0.0
+
+
+def test_backfill_indexes_legacy_history(legacy_cache):
+    legacy_cache.start_search_backfill(chunk_size=100, pause=0)
+    wait_backfill()
+
+    assert legacy_cache.get_search_backfill_progress() == 1.0
+    assert indexed_rows(legacy_cache) == LEGACY_MESSAGES
+    assert len(legacy_cache.search("python", limit=100)["results"]) == LEGACY_MESSAGES // 5
+
+
+def test_backfill_chunk_is_idempotent(legacy_cache):
+    # Часть строк уже в индексе (например, после прерванного backfill),
+    # поэтому порции получаются смешанными.
+    conn = legacy_cache.get_connection()
+    conn.execute(
+        "INSERT INTO messages_fts (rowid, user_message, ai_response) "
+        "SELECT id, user_message, ai_response FROM messages WHERE id <= 120"
+    )
+    conn.commit()
+
+    legacy_cache.start_search_backfill(chunk_size=100, pause=0)
+    wait_backfill()
+
+    assert legacy_cache.get_search_backfill_progress() == 1.0
+    assert indexed_rows(legacy_cache) == LEGACY_MESSAGES
+
+
+def test_backfill_gives_up_after_repeated_failures(legacy_cache, monkeypatch):
+    def failing_chunk(cursor, chunk_size):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(legacy_cache, "_backfill_search_chunk", failing_chunk)
+    legacy_cache.start_search_backfill(chunk_size=100, pause=0, max_failures=3, retry_delay=0.01)
+    wait_backfill()
+
+    stats = legacy_cache.get_write_stats()
+    assert stats["errors"] == 3
+    assert stats["last_error"] == "disk I/O error"
+    assert legacy_cache.get_search_backfill_progress() == 0.0
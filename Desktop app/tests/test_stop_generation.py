@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from main import ChatApp
+from utils.logger import AppLogger
+
+
+def make_app():
+    # Без __init__: окно и клиент API для _run_cancellable не нужны.
+    app = ChatApp.__new__(ChatApp)
+    app.logger = AppLogger("test")
+    app.stop_button = None
+    app.page = None
+    app._inflight = set()
+    app._stopped = set()
+    return app
+
+
+def test_stop_button_returns_stopped():
+    app = make_app()
+
+    async def scenario():
+        handler = asyncio.ensure_future(app._run_cancellable(asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        await app._stop_generation(None)
+        return await handler
+
+    assert asyncio.run(scenario()) == (None, True)
+    assert not app._inflight and not app._stopped
+
+
+def test_cancelled_handler_propagates():
+    app = make_app()
+
+    async def scenario():
+        handler = asyncio.ensure_future(app._run_cancellable(asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        handler.cancel()
+        await handler
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(scenario())
+    assert not app._inflight and not app._stopped